@@ -0,0 +1,45 @@
+import time
+from dataclasses import dataclass, field
+
+
+@dataclass
+class ScriptedStreamingModel:
+    # Emits `chunks` for every prompt, sleeping `first_chunk_delay` before the
+    # first one and `chunk_interval` between the rest, like a provider stream.
+    chunks: list[str]
+    first_chunk_delay: float = 0.0
+    chunk_interval: float = 0.0
+    model_id: str = "scripted-model"
+    needs_key: str | None = None
+    key_env_var: str | None = None
+    key: str | None = None
+    prompt_calls: list[str] = field(default_factory=list)
+
+    def conversation(self) -> "ScriptedConversation":
+        return ScriptedConversation(self)
+
+    def scripted_seconds(self) -> float:
+        return self.first_chunk_delay + self.chunk_interval * max(
+            len(self.chunks) - 1, 0
+        )
+
+
+class ScriptedConversation:
+    def __init__(self, model: ScriptedStreamingModel):
+        self.model = model
+
+    def prompt(self, prompt: str, **_kwargs):
+        self.model.prompt_calls.append(prompt)
+        return self._stream()
+
+    def _stream(self):
+        if self.model.first_chunk_delay:
+            time.sleep(self.model.first_chunk_delay)
+        for index, chunk in enumerate(self.model.chunks):
+            if index and self.model.chunk_interval:
+                time.sleep(self.model.chunk_interval)
+            yield chunk
+
+
+def tiny_delta_chunks(text: str, width: int = 2) -> list[str]:
+    return [text[index : index + width] for index in range(0, len(text), width)]
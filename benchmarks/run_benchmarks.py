@@ -0,0 +1,445 @@
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from types import ModuleType
+from typing import Callable
+
+from fake_model import ScriptedStreamingModel, tiny_delta_chunks
+
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+DEFAULT_SRC_PATH = PROJECT_ROOT / "src"
+DEFAULT_REPEAT = 15
+SUBPROCESS_REPEAT = 5
+DEFAULT_THRESHOLD = 0.25
+# Differences below this are timer noise, whatever the ratio says.
+MIN_REGRESSION_SECONDS = 0.0005
+CAPABILITY_LOOKUPS_PER_SAMPLE = 10_000
+HEREDOC_COMMAND = (
+    "cat <<'EOF' > notes.txt\n"
+    + "a line of generated text\n" * 80
+    + "\nThe second half follows a blank line.\n"
+    + "a line of generated text\n" * 80
+    + "EOF"
+)
+HISTORY_LINES = 100_000
+HISTORY_VOCABULARY = 20_000
+HISTORY_TOOLS = ("git", "ssh", "kubectl", "docker", "rsync", "curl", "make", "jq")
+DIRECTORY_ENTRIES = 20_000
+PROMPT_INDEX_ENTRIES = 30_000
+PROMPT_INDEX_VOCABULARY = 3_000
+PLUGIN_PACKAGE = "llm_complete_command"
+RESULTS_KEY = "results"
+SECONDS_KEY = "seconds"
+
+
+def _median_seconds(operation: Callable[[], object], repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        operation()
+        samples.append(time.perf_counter() - started_at)
+    return statistics.median(samples)
+
+
+def _subprocess_env(src_path: Path, pycache_dir: Path) -> dict[str, str]:
+    env = {
+        name: value
+        for name, value in os.environ.items()
+        if name != "PYTHONDONTWRITEBYTECODE"
+    }
+    env["PYTHONPATH"] = str(src_path)
+    env["PYTHONPYCACHEPREFIX"] = str(pycache_dir)
+    return env
+
+
+def bench_plugin_import(src_path: Path, pycache_dir: Path) -> float:
+    code = "import llm\nimport llm_complete_command"
+    best_microseconds = None
+    for _ in range(SUBPROCESS_REPEAT):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            capture_output=True,
+            text=True,
+            check=True,
+            env=_subprocess_env(src_path, pycache_dir),
+        )
+        for line in result.stderr.splitlines():
+            _self, cumulative, name = line.removeprefix("import time:").split("|")
+            if name.strip() == "llm_complete_command":
+                microseconds = int(cumulative)
+                if best_microseconds is None or microseconds < best_microseconds:
+                    best_microseconds = microseconds
+    return (best_microseconds or 0) / 1_000_000
+
+
+def bench_startup(src_path: Path, pycache_dir: Path) -> float:
+    code = (
+        "import llm\nimport llm_complete_command\n"
+        "llm_complete_command.render_default_prompt()"
+    )
+    env = _subprocess_env(src_path, pycache_dir)
+    # The first run fills the prompt cache; the rest measure a warm start.
+    subprocess.run([sys.executable, "-c", code], check=True, env=env)
+    samples = []
+    for _ in range(SUBPROCESS_REPEAT):
+        started_at = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True, env=env)
+        samples.append(time.perf_counter() - started_at)
+    return min(samples)
+
+
+class _NullTerminal:
+    def __init__(self):
+        self.output = io.StringIO()
+
+    def write(self, text: str) -> None:
+        self.output.write(text)
+
+    def read_feedback(self) -> str:
+        return ""
+
+
+def _stream_once(plugin, model: ScriptedStreamingModel) -> None:
+    plugin.run_completion_session(
+        model.conversation(),
+        "write some notes",
+        "system prompt",
+        _NullTerminal(),
+        collect=plugin._collect_without_spinner,
+        use_cache=False,
+    )
+
+
+def run_benchmarks(src_path: Path, repeat: int) -> dict[str, float]:
+    results: dict[str, float] = {}
+    with tempfile.TemporaryDirectory() as scratch:
+        scratch_path = Path(scratch)
+        pycache_dir = scratch_path / "pycache"
+        # Every cache and config file the plugin touches lands in scratch.
+        os.environ["XDG_CACHE_HOME"] = str(scratch_path / "cache")
+        os.environ["XDG_CONFIG_HOME"] = str(scratch_path / "config")
+
+        results["import.plugin"] = bench_plugin_import(src_path, pycache_dir)
+        results["startup.warm_system_prompt"] = bench_startup(src_path, pycache_dir)
+
+        sys.path.insert(0, str(src_path))
+        for benchmark in IN_PROCESS_BENCHMARKS:
+            try:
+                results.update(benchmark(scratch_path, repeat))
+            except (ImportError, AttributeError) as error:
+                # CI also runs this harness against the base branch's sources,
+                # which may predate the module or function a benchmark uses.
+                if not _is_missing_from_src(error):
+                    raise
+                print(f"skipped {benchmark.__name__}: {error}", file=sys.stderr)
+    return results
+
+
+def _is_missing_from_src(error: ImportError | AttributeError) -> bool:
+    if isinstance(error, ImportError):
+        return (error.name or "").startswith(PLUGIN_PACKAGE)
+    owner = error.obj
+    return isinstance(owner, ModuleType) and owner.__name__.startswith(PLUGIN_PACKAGE)
+
+
+def bench_environment(_scratch_path: Path, repeat: int) -> dict[str, float]:
+    from llm_complete_command import environment_config
+    from llm_complete_command.system_prompt import build_system_prompt
+
+    # Background refreshes would race the measurements.
+    environment_config.spawn_background_refresh = lambda: None
+    detected_path = environment_config._detected_config_path()
+
+    def load_environment_miss():
+        detected_path.unlink(missing_ok=True)
+        return environment_config.load_effective_environment()
+
+    results = {
+        "environment.load_miss": _median_seconds(
+            load_environment_miss, max(repeat // 3, 1)
+        )
+    }
+    environment = environment_config.load_effective_environment()
+    results["environment.load_hit"] = _median_seconds(
+        environment_config.load_effective_environment, repeat
+    )
+    results["system_prompt.build"] = _median_seconds(
+        lambda: build_system_prompt(environment), repeat
+    )
+    return results
+
+
+def bench_cached_system_prompt(_scratch_path: Path, repeat: int) -> dict[str, float]:
+    from llm_complete_command import system_prompt_cache
+
+    # Each sample reads the cache file as a fresh process would, rather than
+    # the copy kept in memory after the first read.
+    forget_cached_entry = getattr(
+        system_prompt_cache, "forget_cached_entry", lambda: None
+    )
+
+    def cached_render():
+        forget_cached_entry()
+        return system_prompt_cache.render_cached_system_prompt()
+
+    cached_render()
+    return {"system_prompt.cached_render": _median_seconds(cached_render, repeat)}
+
+
+def bench_capabilities(_scratch_path: Path, repeat: int) -> dict[str, float]:
+    from llm_complete_command.model_capabilities_cache import (
+        get_model_capability,
+        set_model_capability,
+    )
+
+    set_model_capability("scripted-model", "supports_temperature", True)
+
+    def capability_lookups():
+        for _ in range(CAPABILITY_LOOKUPS_PER_SAMPLE):
+            get_model_capability("scripted-model", "supports_temperature")
+
+    return {
+        "capabilities.lookup": _median_seconds(capability_lookups, repeat)
+        / CAPABILITY_LOOKUPS_PER_SAMPLE
+    }
+
+
+def bench_streaming(_scratch_path: Path, repeat: int) -> dict[str, float]:
+    import llm_complete_command as plugin
+
+    tiny_deltas = ScriptedStreamingModel(tiny_delta_chunks(HEREDOC_COMMAND))
+    results = {
+        "stream.render_tiny_deltas": _median_seconds(
+            lambda: _stream_once(plugin, tiny_deltas), repeat
+        )
+    }
+
+    paced = ScriptedStreamingModel(
+        tiny_delta_chunks(HEREDOC_COMMAND, width=16),
+        first_chunk_delay=0.02,
+        chunk_interval=0.0005,
+    )
+    results["stream.paced_overhead"] = max(
+        _median_seconds(lambda: _stream_once(plugin, paced), max(repeat // 3, 1))
+        - paced.scripted_seconds(),
+        0.0,
+    )
+    return results
+
+
+def bench_history(scratch_path: Path, repeat: int) -> dict[str, float]:
+    from llm_complete_command import shell_history
+
+    history_path = scratch_path / ".zsh_history"
+    words = _write_history(history_path)
+    query = f"ssh into {words[12]} with {words[345]}"
+    # A fresh history this long is indexed by the background refresh.
+    shell_history._configured_history_path = lambda: history_path
+    shell_history.refresh_shell_history_index()
+    results = {
+        "history.retrieve_100k": _median_seconds(
+            lambda: shell_history.relevant_history_commands(history_path, query),
+            repeat,
+        )
+    }
+
+    def append_and_retrieve():
+        with history_path.open("a") as history_file:
+            history_file.write(f": 1700000000:0;ssh {random.choice(words)}\n")
+        return shell_history.relevant_history_commands(history_path, query)
+
+    results["history.append_and_retrieve_100k"] = _median_seconds(
+        append_and_retrieve, repeat
+    )
+    return results
+
+
+def bench_prompt_index(_scratch_path: Path, repeat: int) -> dict[str, float]:
+    from llm_complete_command import prompt_index
+
+    prompts = _write_prompt_index(prompt_index)
+    similar_prompt = f"{prompts[12_345]} please"
+    results = {
+        "prompt_index.lookup_30k": _median_seconds(
+            lambda: prompt_index.find_similar_completion(similar_prompt), repeat
+        )
+    }
+    accepted = iter(range(repeat))
+    results["prompt_index.accept_30k"] = _median_seconds(
+        lambda: prompt_index.add_accepted_completion(
+            f"{prompts[next(accepted)]} again", "true"
+        ),
+        repeat,
+    )
+    return results
+
+
+def bench_working_directory(scratch_path: Path, repeat: int) -> dict[str, float]:
+    # Settings are read once per request and timed with the system prompt.
+    from llm_complete_command import working_directory
+
+    huge_directory = scratch_path / "huge-directory"
+    huge_directory.mkdir()
+    for number in range(DIRECTORY_ENTRIES):
+        (huge_directory / f"file-{number:05d}.log").touch()
+
+    def describe_changed_directory():
+        # A new mtime misses the cache, as after any change to the listing.
+        os.utime(huge_directory, ns=(time.time_ns(), time.time_ns()))
+        return working_directory.working_directory_context(str(huge_directory), {})
+
+    return {
+        "working_directory.miss_20k": _median_seconds(
+            describe_changed_directory, repeat
+        ),
+        "working_directory.hit_20k": _median_seconds(
+            lambda: working_directory.working_directory_context(
+                str(huge_directory), {}
+            ),
+            repeat,
+        ),
+    }
+
+
+def bench_git_context(scratch_path: Path, repeat: int) -> dict[str, float]:
+    from llm_complete_command import git_context
+
+    repository = scratch_path / "repository"
+    repository.mkdir()
+    for args in (
+        ["init", "-q", "-b", "main"],
+        ["commit", "-q", "--allow-empty", "-m", "Initial commit"],
+    ):
+        subprocess.run(
+            ["git", "-c", "user.name=bench", "-c", "user.email=bench@example.com"]
+            + ["-C", str(repository), *args],
+            check=True,
+        )
+    git_context.git_context(str(repository), {})
+    return {
+        "git_context.hit": _median_seconds(
+            lambda: git_context.git_context(str(repository), {}), repeat
+        )
+    }
+
+
+IN_PROCESS_BENCHMARKS: tuple[Callable[[Path, int], dict[str, float]], ...] = (
+    bench_environment,
+    bench_cached_system_prompt,
+    bench_capabilities,
+    bench_streaming,
+    bench_history,
+    bench_prompt_index,
+    bench_working_directory,
+    bench_git_context,
+)
+
+
+def _write_history(path: Path) -> list[str]:
+    generator = random.Random(7)
+    words = [
+        "".join(generator.choices("abcdefghijklmnopqrstuvwxyz", k=length))
+        for length in generator.choices(range(3, 9), k=HISTORY_VOCABULARY)
+    ]
+    path.write_text(
+        "".join(
+            f": {1_700_000_000 + number}:0;{generator.choice(HISTORY_TOOLS)} "
+            f"{' '.join(generator.choices(words, k=4))}\n"
+            for number in range(HISTORY_LINES)
+        )
+    )
+    return words
+
+
+def _write_prompt_index(prompt_index) -> list[str]:
+    generator = random.Random(7)
+    words = [
+        "".join(generator.choices("abcdefghijklmnopqrstuvwxyz", k=length))
+        for length in generator.choices(range(3, 9), k=PROMPT_INDEX_VOCABULARY)
+    ]
+    prompts = [
+        " ".join(generator.choices(words, k=generator.randint(3, 8)))
+        for _ in range(PROMPT_INDEX_ENTRIES)
+    ]
+    index = prompt_index.PromptIndex()
+    for number, prompt in enumerate(prompts):
+        index.add(prompt, f"command {number}")
+    index.merge()
+    path = prompt_index.cache_file_path(prompt_index.CACHE_FILE_NAME)
+    path.write_bytes(index.base_bytes())
+    return prompts
+
+
+def compare_results(
+    baseline: dict[str, float], current: dict[str, float], threshold: float
+) -> list[str]:
+    regressions = []
+    # A benchmark either side skipped has nothing to compare against.
+    for name in sorted(baseline.keys() & current.keys()):
+        baseline_seconds, current_seconds = baseline[name], current[name]
+        if (
+            current_seconds > baseline_seconds * (1 + threshold)
+            and current_seconds - baseline_seconds > MIN_REGRESSION_SECONDS
+        ):
+            regressions.append(
+                f"{name}: {baseline_seconds * 1000:.3f} ms -> "
+                f"{current_seconds * 1000:.3f} ms"
+            )
+    return regressions
+
+
+def _load_results(path: Path) -> dict[str, float]:
+    report = json.loads(path.read_text())
+    return {
+        name: measurement[SECONDS_KEY]
+        for name, measurement in report[RESULTS_KEY].items()
+    }
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Offline llm-complete-command benchmarks"
+    )
+    parser.add_argument("--output", type=Path, help="Write results as JSON here")
+    parser.add_argument("--compare", type=Path, help="Baseline JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--src", type=Path, default=DEFAULT_SRC_PATH)
+    options = parser.parse_args(argv)
+
+    results = run_benchmarks(options.src.resolve(), options.repeat)
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        RESULTS_KEY: {
+            name: {SECONDS_KEY: seconds} for name, seconds in results.items()
+        },
+    }
+    for name, seconds in results.items():
+        print(f"{name:<32}{seconds * 1000:>12.3f} ms")
+    if options.output is not None:
+        options.output.write_text(json.dumps(report, indent=2) + "\n")
+
+    if options.compare is None:
+        return 0
+
+    regressions = compare_results(
+        _load_results(options.compare), results, options.threshold
+    )
+    for regression in regressions:
+        print(f"regression: {regression}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,12 +6,17 @@ __llm_complete_command() {
     local old_cmd="${READLINE_LINE}"
     local cursor_pos="${READLINE_POINT}"
     local result
+    local -a completer=(llm complete_command)
+    if [[ -n "${LLM_COMPLETE_COMMAND_DAEMON:-}" ]]; then
+        completer=(llm-complete-command-client)
+    fi
 
     # Move to a new line
     echo
 
     # Get the LLM completion
-    if result="$(llm complete_command "${old_cmd}")"; then
+    # HISTFILE is not exported by default; pass it on for the history context.
+    if result="$(HISTFILE="${HISTFILE:-}" "${completer[@]}" "${old_cmd}")"; then
         # Replace the command line with the result
         READLINE_LINE="${result}"
         READLINE_POINT="${#result}"
@@ -24,3 +29,6 @@ __llm_complete_command() {
         echo "Command completion failed" >&2
     fi
 }
+
+# Refresh the detected environment in the background so completions never wait on it
+( HISTFILE="${HISTFILE:-}" llm complete_command --refresh-environment >/dev/null 2>&1 & )
@@ -3,11 +3,43 @@ bind \e\\ __llm_complete_command
 function __llm_complete_command -d "Fill in the command using an LLM"
   set __llm_oldcmd (commandline -b)
   set __llm_cursor_pos (commandline -C)
+  set -l completer llm complete_command
+  if set -q LLM_COMPLETE_COMMAND_DAEMON
+    set completer llm-complete-command-client
+  end
   echo # Start the program on a blank line
-  set result (llm complete_command $__llm_oldcmd)
+  set result ($completer $__llm_oldcmd)
   if test $status -eq 0
     commandline -r $result
     echo # Move down a line to prevent fish from overwriting the program output
   end
   commandline -f repaint
 end
+
+# Opt-in speculative prefetch. fish has no buffer-change hook, so a prefetch is
+# scheduled at each word boundary; the next word kills the pending one.
+function __llm_complete_command_prefetch -d "Prefetch an LLM command for the current buffer"
+  set -l buffer (commandline -b)
+  test "$buffer" = "$__llm_prefetch_buffer"; and return
+  set -g __llm_prefetch_buffer $buffer
+  if set -q __llm_prefetch_pid[1]
+    kill $__llm_prefetch_pid 2>/dev/null
+    set -e __llm_prefetch_pid
+  end
+  string match -qr '\S' -- $buffer; or return
+  set -l delay 0.75
+  set -q LLM_COMPLETE_COMMAND_PREFETCH_DELAY; and set delay $LLM_COMPLETE_COMMAND_PREFETCH_DELAY
+  sh -c 'sleep "$1" && exec llm complete_command --prefetch -- "$2"' sh $delay "$buffer" </dev/null >/dev/null 2>&1 &
+  set -g __llm_prefetch_pid $last_pid
+  disown $last_pid 2>/dev/null
+end
+
+if set -q LLM_COMPLETE_COMMAND_PREFETCH; and status is-interactive
+  bind ' ' self-insert expand-abbr __llm_complete_command_prefetch
+end
+
+# Refresh the detected environment in the background so completions never wait on it
+if status is-interactive
+  llm complete_command --refresh-environment >/dev/null 2>&1 &
+  disown
+end
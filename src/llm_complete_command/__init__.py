@@ -1,25 +1,39 @@
-from typing import Callable
+import time
+from typing import Any, Callable
 
-import better_exceptions
 import click
 import llm
-from .environment_config import load_effective_environment
-from loguru import logger
+from .command_sanitizer import sanitized_chunks
+from .environment_config import refresh_detected_environment
+from .frame_writer import CoalescingChunkWriter
+from .latency_stats import (
+    flush_latency_records,
+    format_latency_report,
+    timed_chunks,
+)
 from .model_capabilities_cache import get_model_capability, set_model_capability
-from prompt_toolkit import PromptSession
-from prompt_toolkit.formatted_text import ANSI
-from prompt_toolkit.input import create_input
-from prompt_toolkit.output import create_output
-from .system_prompt import build_system_prompt
-from .thinking_spinner import ThinkingSpinner
-
-
-better_exceptions.MAX_LENGTH = None
+from .prompt_index import add_accepted_completion, find_similar_completion
+from .response_cache import (
+    get_cached_response,
+    get_prefetched_response,
+    response_cache_key,
+    store_response,
+)
+from .system_prompt_cache import cached_settings, render_cached_system_prompt
+
+# This module is imported by every `llm` invocation through the plugin entry
+# point, so heavier dependencies (prompt_toolkit, loguru, yaml, ...)
+# are imported inside the functions that need them.
 
 DEFAULT_TEMPERATURE = 0.25
 TEMPERATURE_PARAM = "temperature"
+PROMPT_CACHE_OPTION = "cache"
 UNSUPPORTED_VALUE_CODE = "unsupported_value"
 SUPPORTS_TEMPERATURE_CAPABILITY = "supports_temperature"
+REVISION_TOKEN_BUDGET_SETTING = "revision_token_budget"
+DEFAULT_REVISION_TOKEN_BUDGET = 1000
+# A rough average across tokenizers; the budget only needs to track growth.
+CHARACTERS_PER_TOKEN = 4
 ANSI_RESET = "\x1b[0m"
 COMMAND_PROMPT_COLOR_HEX = "#31748f"
 FEEDBACK_PROMPT_COLOR_HEX = "#73628a"
@@ -41,6 +55,11 @@ def _colorize_prompt_symbol(symbol: str, hex_color: str) -> str:
 
 COMMAND_PROMPT = _colorize_prompt_symbol("$", COMMAND_PROMPT_COLOR_HEX)
 FEEDBACK_PROMPT = _colorize_prompt_symbol(">", FEEDBACK_PROMPT_COLOR_HEX)
+REVISION_INSTRUCTIONS = "\n# Provide revision instructions; leave blank to finish\n"
+SIMILAR_PROMPT_NOTE = "# Suggested from an earlier request: {prompt}\n"
+RACE_WINNER_NOTE = "\n# {model_id} answered first"
+HEDGE_WINNER_NOTE = "\n# {model_id} answered first after a slow start"
+CANCELLED_NOTE = "\n# Cancelled"
 
 
 def _format_generated_chunk(chunk: str) -> str:
@@ -55,6 +74,12 @@ def _write_terminal(output, text: str) -> None:
     output.write(text)
 
 
+def _flush_terminal(terminal) -> None:
+    flush = getattr(terminal, "flush", None)
+    if callable(flush):
+        flush()
+
+
 class ResponseStreamError(Exception):
     original: Exception
     emitted_chunks: int
@@ -65,6 +90,20 @@ class ResponseStreamError(Exception):
         self.emitted_chunks = emitted_chunks
 
 
+class GenerationCancelledError(Exception):
+    partial_text: str
+
+    def __init__(self, partial_text: str):
+        super().__init__("generation cancelled")
+        self.partial_text = partial_text
+
+
+class CancelledCommand(str):
+    # The partial text of a cancelled generation. It is handed back to the
+    # shell when the user accepts it, but never remembered for replay.
+    pass
+
+
 @llm.hookimpl
 def register_commands(cli):
     @cli.command()
@@ -72,24 +111,164 @@ def register_commands(cli):
     @click.option("-m", "--model", default=None, help="Specify the model to use")
     @click.option("-s", "--system", help="Custom system prompt")
     @click.option("--key", help="API key to use")
-    def complete_command(args, model, system, key):
+    @click.option(
+        "--daemon",
+        is_flag=True,
+        help="Serve completions to the shell client from a warm background process",
+    )
+    @click.option(
+        "--refresh-environment",
+        is_flag=True,
+        help="Re-probe the detected environment if it is stale, then exit",
+    )
+    @click.option(
+        "--print-system-prompt",
+        is_flag=True,
+        help="Print the default system prompt with its cache status, then exit",
+    )
+    @click.option(
+        "--stats",
+        is_flag=True,
+        help="Print latency percentiles and race win rates per model, then exit",
+    )
+    @click.option(
+        "--no-cache",
+        is_flag=True,
+        help="Always ask the model instead of replaying a previously accepted command",
+    )
+    @click.option(
+        "--race",
+        default=None,
+        help="Comma-separated models to prompt at once; the first to answer is used",
+    )
+    @click.option(
+        "--prefetch",
+        is_flag=True,
+        help="Generate a command in the background and store it in the response cache",
+    )
+    def complete_command(
+        args,
+        model,
+        system,
+        key,
+        daemon,
+        refresh_environment,
+        print_system_prompt,
+        stats,
+        no_cache,
+        race,
+        prefetch,
+    ):
         """Generate commands directly in your command line (requires shell integration)"""
         from llm import get_default_model
 
+        _configure_exception_formatting()
+
+        if refresh_environment:
+            from .shell_history import refresh_shell_history_index
+
+            refresh_detected_environment()
+            refresh_shell_history_index()
+            return
+
+        if print_system_prompt:
+            _print_system_prompt()
+            return
+
+        if stats:
+            _print_stats()
+            return
+
+        if daemon:
+            from .daemon import serve
+
+            serve()
+            return
+
         prompt = " ".join(args)
 
-        model_id = model or get_default_model()
-        model_obj = llm.get_model(model_id)
-        if model_obj.needs_key:
-            model_obj.key = llm.get_key(key, model_obj.needs_key, model_obj.key_env_var)
-        conversation = model_obj.conversation()
         system = system or render_default_prompt()
-        interactive_exec(conversation, prompt, system)
+        race_ids: list[str] = []
+        if race is not None or model is None:
+            # An explicit -m opts out of the configured race set.
+            from .model_race import race_model_ids
+
+            race_ids = race_model_ids(race)
+
+        if prefetch:
+            from .prefetch import prefetch_completion
+
+            # Interactive lookups are keyed on the first race model, so a
+            # prefetch asks that model alone instead of racing.
+            prefetch_completion(
+                _model_conversation(
+                    race_ids[0] if race_ids else model or get_default_model(), key
+                ),
+                prompt,
+                system,
+            )
+            return
+
+        race_conversations = None
+        if race_ids:
+            race_conversations = [
+                _model_conversation(race_id, key) for race_id in race_ids
+            ]
+            conversation = race_conversations[0]
+        else:
+            conversation = _model_conversation(model or get_default_model(), key)
+
+        interactive_exec(
+            conversation,
+            prompt,
+            system,
+            use_cache=not no_cache,
+            race_conversations=race_conversations,
+            key=key,
+        )
+
+
+def _model_conversation(model_id: str, key: str | None):
+    model_obj = llm.get_model(model_id)
+    if model_obj.needs_key:
+        model_obj.key = llm.get_key(key, model_obj.needs_key, model_obj.key_env_var)
+    return model_obj.conversation()
+
+
+def _configure_exception_formatting() -> None:
+    import better_exceptions
+
+    better_exceptions.MAX_LENGTH = None
 
 
 def render_default_prompt():
-    environment = load_effective_environment()
-    return build_system_prompt(environment)
+    prompt, _cache_hit = render_cached_system_prompt()
+    return prompt
+
+
+def _print_system_prompt() -> None:
+    started_at = time.perf_counter()
+    prompt, cache_hit = render_cached_system_prompt()
+    elapsed_milliseconds = (time.perf_counter() - started_at) * 1000
+
+    click.echo(prompt)
+    cache_status = "hit" if cache_hit else "miss"
+    click.echo(
+        f"# system prompt cache {cache_status}, rendered in "
+        f"{elapsed_milliseconds:.2f} ms",
+        err=True,
+    )
+
+
+def _print_stats() -> None:
+    from .model_race import race_win_rates
+
+    click.echo(format_latency_report())
+    win_rates = race_win_rates()
+    if win_rates:
+        click.echo("\nRace wins")
+        for model_id, (wins, races) in sorted(win_rates.items()):
+            click.echo(f"  {model_id}: {wins}/{races} ({wins / races:.0%})")
 
 
 def _is_unsupported_temperature_error(error: Exception) -> bool:
@@ -105,9 +284,23 @@ def _prompt_with_temperature(
     prompt_kwargs: dict[str, object] = {"system": system}
     if use_temperature:
         prompt_kwargs[TEMPERATURE_PARAM] = DEFAULT_TEMPERATURE
+    if _supports_prompt_cache_option(conversation.model):
+        prompt_kwargs[PROMPT_CACHE_OPTION] = True
     return conversation.prompt(prompt, **prompt_kwargs)
 
 
+def _supports_prompt_cache_option(model_obj) -> bool:
+    # Some providers only cache the system prompt prefix when asked to, and
+    # their llm plugins expose that as a boolean `cache` option. Others cache
+    # prefixes automatically and need no hint.
+    options = getattr(model_obj, "Options", None)
+    option_fields = getattr(options, "model_fields", None)
+    if not isinstance(option_fields, dict) or PROMPT_CACHE_OPTION not in option_fields:
+        return False
+    annotation = option_fields[PROMPT_CACHE_OPTION].annotation
+    return annotation is bool or bool in getattr(annotation, "__args__", ())
+
+
 def _collect_response_text(
     response,
     write_chunk: Callable[[str], None],
@@ -139,7 +332,13 @@ def _should_retry_without_temperature(
     )
 
 
+def _collect_without_spinner(_conversation, response, write_chunk) -> str:
+    return _collect_response_text(response, write_chunk)
+
+
 def _collect_with_spinner(conversation, response, write_chunk) -> str:
+    from .thinking_spinner import ThinkingSpinner
+
     spinner = ThinkingSpinner(conversation.model.model_id)
     spinner.start()
 
@@ -151,7 +350,10 @@ def _collect_with_spinner(conversation, response, write_chunk) -> str:
         spinner.stop()
 
 
-def _generate_command_text(conversation, prompt: str, system: str, write_chunk) -> str:
+def _generate_command_text(
+    conversation, prompt: str, system: str, write_chunk, collect=None, revision_round=0
+) -> str:
+    collect = collect or _collect_with_spinner
     model_id = conversation.model.model_id
     supports_temperature = get_model_capability(
         model_id, SUPPORTS_TEMPERATURE_CAPABILITY
@@ -163,14 +365,33 @@ def _generate_command_text(conversation, prompt: str, system: str, write_chunk)
     )
 
     try:
-        generated_text = _collect_with_spinner(conversation, response, write_chunk)
+        generated_text = collect(
+            conversation,
+            timed_chunks(
+                sanitized_chunks(response),
+                model_id,
+                revision_round=revision_round,
+                usage_from=response,
+            ),
+            write_chunk,
+        )
     except ResponseStreamError as stream_error:
         if _should_retry_without_temperature(stream_error, use_temperature):
             set_model_capability(model_id, SUPPORTS_TEMPERATURE_CAPABILITY, False)
             response = _prompt_with_temperature(
                 conversation, prompt, system, use_temperature=False
             )
-            return _collect_with_spinner(conversation, response, write_chunk)
+            return collect(
+                conversation,
+                timed_chunks(
+                    sanitized_chunks(response),
+                    model_id,
+                    revision_round=revision_round,
+                    temperature_retry=True,
+                    usage_from=response,
+                ),
+                write_chunk,
+            )
 
         raise stream_error.original from stream_error.original
 
@@ -180,31 +401,273 @@ def _generate_command_text(conversation, prompt: str, system: str, write_chunk)
     return generated_text
 
 
-def interactive_exec(conversation, prompt, system):
-    ttyin = create_input(always_prefer_tty=True)
-    ttyout = create_output(always_prefer_tty=True)
-    session = PromptSession(input=ttyin, output=ttyout)
-    system = system or render_default_prompt()
+class _TtyTerminal:
+    def __init__(self):
+        from prompt_toolkit import PromptSession
+        from prompt_toolkit.input import create_input
+        from prompt_toolkit.output import create_output
 
-    try:
-        current_prompt = prompt
-        generated_command = ""
-        while True:
-            _write_terminal(ttyout, COMMAND_PROMPT)
-            generated_command = _generate_command_text(
-                conversation,
-                current_prompt,
-                system,
-                write_chunk=lambda chunk: _write_terminal(
-                    ttyout, _format_generated_chunk(chunk)
-                ),
+        self.input = create_input(always_prefer_tty=True)
+        self._output = create_output(always_prefer_tty=True)
+        self._session = PromptSession(input=self.input, output=self._output)
+
+    def write(self, text: str) -> None:
+        _write_terminal(self._output, text)
+
+    def flush(self) -> None:
+        self._output.flush()
+
+    def read_feedback(self) -> str:
+        from prompt_toolkit.formatted_text import ANSI
+
+        return self._session.prompt(ANSI(FEEDBACK_PROMPT))
+
+
+def _revision_prompt_after_replay(
+    original_prompt: str, replayed_command: str, feedback: str
+) -> str:
+    # A replayed or suggested command never went through this conversation, so the model
+    # needs the request and the command it is being asked to revise. The same
+    # goes for a generation that was cancelled or cut short, which llm leaves out
+    # of the conversation history.
+    if not replayed_command:
+        return f"{original_prompt}\n\nRevision instructions:\n{feedback}"
+    return (
+        f"{original_prompt}\n\n"
+        f"Previous command:\n{replayed_command}\n\n"
+        f"Revision instructions:\n{feedback}"
+    )
+
+
+def _recorded_response_count(conversation) -> int | None:
+    responses = getattr(conversation, "responses", None)
+    return len(responses) if isinstance(responses, list) else None
+
+
+def _revision_token_budget(settings: dict[str, Any]) -> int:
+    budget = settings.get(REVISION_TOKEN_BUDGET_SETTING)
+    if isinstance(budget, bool) or not isinstance(budget, int) or budget < 0:
+        return DEFAULT_REVISION_TOKEN_BUDGET
+    return budget
+
+
+def run_completion_session(
+    conversation,
+    prompt: str,
+    system: str,
+    terminal,
+    collect=None,
+    use_cache=True,
+    race_conversations=None,
+    cancellable=False,
+    cwd=None,
+    histfile=None,
+    key=None,
+) -> str:
+    def write_chunk(chunk: str) -> None:
+        terminal.write(_format_generated_chunk(chunk))
+        _flush_terminal(terminal)
+
+    settings = cached_settings()
+    replayed_command = None
+    if use_cache:
+        from .request_context import request_context_key
+
+        context_key = request_context_key(cwd, settings)
+        cache_key = response_cache_key(
+            conversation.model.model_id, system, prompt, context_key
+        )
+        replayed_command = get_cached_response(cache_key)
+        if replayed_command is None:
+            replayed_command = get_prefetched_response(cache_key)
+        if replayed_command is None:
+            # A near match is offered like a replay: accepting it skips the
+            # model, and revision instructions send it to the model as context.
+            similar_completion = find_similar_completion(prompt, context_key)
+            if similar_completion is not None:
+                similar_prompt, replayed_command = similar_completion
+                terminal.write(SIMILAR_PROMPT_NOTE.format(prompt=similar_prompt))
+
+    hedge = None
+    if replayed_command is not None:
+        # The replay answers the opening request, so revisions continue on
+        # one conversation, as they do after a race.
+        race_conversations = None
+    elif not race_conversations:
+        from .model_race import plan_hedge
+
+        hedge = plan_hedge(conversation, settings, key)
+
+    async_conversation = None
+    if cancellable and hedge is None and not race_conversations:
+        from .async_generation import async_conversation_for
+
+        # Racing and hedging already cancel their losing streams, so only a
+        # single-model session runs on the cancellable event loop.
+        async_conversation = async_conversation_for(conversation)
+
+    revision_token_budget = _revision_token_budget(settings)
+    history_characters = 0
+    current_prompt = prompt
+    revision_round = 0
+    generation_system = None
+    while True:
+        terminal.write(COMMAND_PROMPT)
+        winner_note = None
+        unrecorded_prompt = None
+        history_length = _recorded_response_count(async_conversation or conversation)
+        frames = CoalescingChunkWriter(write_chunk)
+        try:
+            if replayed_command is not None:
+                generated_command = replayed_command
+                write_chunk(replayed_command)
+            else:
+                if generation_system is None:
+                    from .request_context import with_request_context
+
+                    # Built once, on the first request that reaches a model.
+                    generation_system = with_request_context(
+                        system, prompt, cwd, settings, histfile
+                    )
+                if race_conversations or hedge is not None:
+                    from .model_race import race_command_text
+
+                    # Only the opening request is raced or hedged; revisions
+                    # continue on the conversation of the model that answered first.
+                    primary_conversation = conversation
+                    if hedge is not None:
+                        racers = [conversation, hedge.conversation]
+                        start_delays = [0, hedge.delay_seconds]
+                    else:
+                        racers, start_delays = race_conversations, None
+                    conversation, generated_command = race_command_text(
+                        racers,
+                        current_prompt,
+                        generation_system,
+                        write_chunk=frames.write,
+                        collect=collect,
+                        start_delays=start_delays,
+                        record_results=bool(race_conversations),
+                    )
+                    if race_conversations:
+                        winner_note = RACE_WINNER_NOTE
+                    elif conversation is not primary_conversation:
+                        winner_note = HEDGE_WINNER_NOTE
+                    race_conversations = hedge = None
+                elif async_conversation is not None:
+                    from .async_generation import generate_cancellable_command_text
+
+                    generated_command = generate_cancellable_command_text(
+                        async_conversation,
+                        current_prompt,
+                        generation_system,
+                        write_chunk=write_chunk,
+                        terminal=terminal,
+                        revision_round=revision_round,
+                    )
+                else:
+                    generated_command = _generate_command_text(
+                        conversation,
+                        current_prompt,
+                        generation_system,
+                        write_chunk=frames.write,
+                        collect=collect,
+                        revision_round=revision_round,
+                    )
+        except GenerationCancelledError as cancelled:
+            generated_command = CancelledCommand(cancelled.partial_text)
+            unrecorded_prompt = current_prompt
+            terminal.write(CANCELLED_NOTE)
+        finally:
+            frames.close()
+
+        if (
+            replayed_command is None
+            and history_length is not None
+            and _recorded_response_count(async_conversation or conversation)
+            == history_length
+        ):
+            # The sanitizer closed the stream once the command was complete.
+            unrecorded_prompt = current_prompt
+        if replayed_command is None:
+            history_characters += len(current_prompt) + len(generated_command)
+
+        if winner_note is not None:
+            terminal.write(winner_note.format(model_id=conversation.model.model_id))
+        terminal.write(REVISION_INSTRUCTIONS)
+        feedback = terminal.read_feedback()
+        if feedback == "":
+            return generated_command
+
+        revision_round += 1
+
+        if replayed_command is not None:
+            current_prompt = _revision_prompt_after_replay(
+                prompt, replayed_command, feedback
             )
-            ttyout.write("\n# Provide revision instructions; leave blank to finish\n")
-            feedback = session.prompt(ANSI(FEEDBACK_PROMPT))
-            if feedback == "":
-                break
+            replayed_command = None
+        elif unrecorded_prompt is not None:
+            current_prompt = _revision_prompt_after_replay(
+                unrecorded_prompt, generated_command, feedback
+            )
+        else:
             current_prompt = feedback
 
+        if (
+            revision_token_budget
+            and history_characters + len(current_prompt)
+            > revision_token_budget * CHARACTERS_PER_TOKEN
+        ):
+            # Re-sending every earlier attempt makes each round slower than the
+            # last, so long loops restart from the latest attempt alone.
+            conversation = conversation.model.conversation()
+            if async_conversation is not None:
+                from .async_generation import async_conversation_for
+
+                async_conversation = async_conversation_for(conversation)
+            current_prompt = _revision_prompt_after_replay(
+                prompt, generated_command, feedback
+            )
+            history_characters = 0
+
+
+def remember_accepted_command(
+    conversation, prompt: str, system: str, command: str, cwd=None
+):
+    if isinstance(command, CancelledCommand):
+        return
+    from .request_context import request_context_key
+
+    context_key = request_context_key(cwd)
+    store_response(
+        response_cache_key(conversation.model.model_id, system, prompt, context_key),
+        command,
+    )
+    add_accepted_completion(prompt, command, context_key)
+
+
+def interactive_exec(
+    conversation, prompt, system, use_cache=True, race_conversations=None, key=None
+):
+    from loguru import logger
+
+    terminal = _TtyTerminal()
+    system = system or render_default_prompt()
+
+    try:
+        generated_command = run_completion_session(
+            conversation,
+            prompt,
+            system,
+            terminal,
+            use_cache=use_cache,
+            race_conversations=race_conversations,
+            cancellable=True,
+            key=key,
+        )
         print(generated_command)
+        if use_cache:
+            remember_accepted_command(conversation, prompt, system, generated_command)
+        flush_latency_records()
     except Exception:
         logger.exception("an error occurred during processing")
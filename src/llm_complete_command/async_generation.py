@@ -0,0 +1,187 @@
+import asyncio
+import signal
+from contextlib import contextmanager
+
+from . import (
+    SUPPORTS_TEMPERATURE_CAPABILITY,
+    GenerationCancelledError,
+    ResponseStreamError,
+    _prompt_with_temperature,
+    _should_retry_without_temperature,
+    get_model_capability,
+    set_model_capability,
+)
+from .command_sanitizer import sanitized_async_chunks
+from .frame_writer import CoalescingChunkWriter
+from .latency_stats import timed_async_chunks
+from .thinking_spinner import ThinkingSpinner
+
+
+# A lone Esc is held back by the key parser in case an escape sequence follows;
+# flushing it after this long tells the two apart, as prompt_toolkit does.
+ESCAPE_FLUSH_SECONDS = 0.05
+
+
+def async_conversation_for(conversation):
+    import llm
+
+    model_obj = conversation.model
+    try:
+        async_model = llm.get_async_model(model_obj.model_id)
+    except llm.UnknownModelError:
+        return None
+
+    if getattr(async_model, "needs_key", None):
+        async_model.key = model_obj.key
+    return async_model.conversation()
+
+
+def generate_cancellable_command_text(
+    conversation, prompt: str, system: str, write_chunk, terminal, revision_round=0
+) -> str:
+    # asyncio.run() closes the abandoned response stream on the way out, so a
+    # cancelled request does not keep streaming in the background.
+    return asyncio.run(
+        _generate(
+            conversation,
+            prompt,
+            system,
+            write_chunk,
+            getattr(terminal, "input", None),
+            revision_round,
+        )
+    )
+
+
+async def _generate(
+    conversation, prompt: str, system: str, write_chunk, key_input, revision_round
+) -> str:
+    loop = asyncio.get_running_loop()
+    generation = asyncio.current_task()
+    assert generation is not None
+    frames = CoalescingChunkWriter(write_chunk, schedule=loop.call_later)
+    spinner = ThinkingSpinner(conversation.model.model_id)
+    spinner_task = asyncio.create_task(spinner.run())
+    chunks: list[str] = []
+
+    def write_frame_chunk(chunk: str) -> None:
+        spinner.stop()
+        chunks.append(chunk)
+        frames.write(chunk)
+
+    try:
+        with (
+            _cancel_on_keys(key_input, generation.cancel),
+            _cancel_on_sigint(loop, generation.cancel),
+        ):
+            return await _generate_with_temperature_retry(
+                conversation, prompt, system, write_frame_chunk, revision_round
+            )
+    except asyncio.CancelledError:
+        raise GenerationCancelledError("".join(chunks)) from None
+    finally:
+        spinner.stop()
+        spinner_task.cancel()
+        frames.close()
+
+
+async def _generate_with_temperature_retry(
+    conversation, prompt: str, system: str, write_chunk, revision_round
+) -> str:
+    model_id = conversation.model.model_id
+    supports_temperature = get_model_capability(
+        model_id, SUPPORTS_TEMPERATURE_CAPABILITY
+    )
+    use_temperature = supports_temperature is not False
+
+    response = _prompt_with_temperature(
+        conversation, prompt, system, use_temperature=use_temperature
+    )
+    try:
+        generated_text = await _collect_async_response_text(
+            timed_async_chunks(
+                sanitized_async_chunks(response),
+                model_id,
+                revision_round=revision_round,
+                usage_from=response,
+            ),
+            write_chunk,
+        )
+    except ResponseStreamError as stream_error:
+        if not _should_retry_without_temperature(stream_error, use_temperature):
+            raise stream_error.original from stream_error.original
+
+        set_model_capability(model_id, SUPPORTS_TEMPERATURE_CAPABILITY, False)
+        response = _prompt_with_temperature(
+            conversation, prompt, system, use_temperature=False
+        )
+        return await _collect_async_response_text(
+            timed_async_chunks(
+                sanitized_async_chunks(response),
+                model_id,
+                revision_round=revision_round,
+                temperature_retry=True,
+                usage_from=response,
+            ),
+            write_chunk,
+        )
+
+    if use_temperature and supports_temperature is None:
+        set_model_capability(model_id, SUPPORTS_TEMPERATURE_CAPABILITY, True)
+
+    return generated_text
+
+
+async def _collect_async_response_text(response, write_chunk) -> str:
+    chunks = []
+    try:
+        async for chunk in response:
+            write_chunk(chunk)
+            chunks.append(chunk)
+    except Exception as error:
+        raise ResponseStreamError(error, len(chunks)) from error
+
+    return "".join(chunks)
+
+
+@contextmanager
+def _cancel_on_keys(key_input, cancel):
+    if key_input is None:
+        yield
+        return
+
+    from prompt_toolkit.keys import Keys
+
+    loop = asyncio.get_running_loop()
+    cancel_keys = {Keys.Escape, Keys.ControlC}
+
+    def handle(key_presses) -> bool:
+        if any(key_press.key in cancel_keys for key_press in key_presses):
+            cancel()
+            return True
+        return False
+
+    def read_keys() -> None:
+        if not handle(key_input.read_keys()):
+            loop.call_later(
+                ESCAPE_FLUSH_SECONDS, lambda: handle(key_input.flush_keys())
+            )
+
+    # Raw mode turns Ctrl-C into a key press instead of SIGINT and keeps
+    # typed keys from echoing over the streamed command.
+    with key_input.raw_mode(), key_input.attach(read_keys):
+        yield
+
+
+@contextmanager
+def _cancel_on_sigint(loop, cancel):
+    try:
+        loop.add_signal_handler(signal.SIGINT, cancel)
+    except (NotImplementedError, RuntimeError, ValueError):
+        yield
+        return
+
+    try:
+        yield
+    finally:
+        loop.remove_signal_handler(signal.SIGINT)
@@ -0,0 +1,245 @@
+import re
+from collections.abc import AsyncIterable, AsyncIterator, Awaitable
+from typing import Protocol, runtime_checkable
+
+
+FENCE = "```"
+WRAPPING_QUOTES = ("`", "'", '"')
+# After a blank line, a capitalised word or a list marker starts an explanation
+# rather than more of the command. Shell comments (`# ...`) are left alone.
+PROSE_LINE_PATTERN = re.compile(r"[A-Z][a-z']*[ ,:.]|[-*] |\*\*")
+UNDECIDED_PROSE_PATTERN = re.compile(r"[A-Z][a-z']*|[-*]|\*")
+# A heredoc body may hold blank lines and prose, so nothing in it ends the
+# command; `<<<` here-strings and `1<<2` shifts do not open one.
+HEREDOC_PATTERN = re.compile(r"(?<!<)<<(-?)[ \t]*(['\"]?)([A-Za-z_][\w.-]*)\2")
+
+
+@runtime_checkable
+class _AsyncClosable(Protocol):
+    def aclose(self) -> Awaitable[object]: ...
+
+
+class CommandSanitizer:
+    # Strips code fences and wrapping quotes from a streamed command as the
+    # chunks arrive. Only what is needed to decide is held back: the opening
+    # characters, and each newline until the next line shows whether the
+    # command goes on. `finished` turns true once the fence closes or prose
+    # begins, and the caller can stop reading the stream there.
+    def __init__(self):
+        self.finished = False
+        self._leading = True
+        self._in_fence_header = False
+        self._in_fence = False
+        self._wrapper_quote: str | None = None
+        self._held = ""
+        self._line = ""
+        # Delimiters of heredocs still open, in the order they close, and
+        # whether each one's closing line may be indented with tabs (`<<-`).
+        self._heredocs: list[tuple[str, bool]] = []
+
+    def feed(self, chunk: str) -> str:
+        if self.finished:
+            return ""
+        if not self._held and self._in_body() and "\n" not in chunk:
+            self._line += chunk
+            return chunk
+
+        self._held += chunk
+        if self._leading:
+            return self._resolve_leading(final=False)
+        if self._in_fence_header:
+            return self._skip_fence_header()
+        if self._wrapper_quote is not None:
+            return self._resolve_wrapper(final=False)
+        return self._resolve_body(final=False)
+
+    def finish(self) -> str:
+        if self.finished:
+            return ""
+
+        text = ""
+        if self._leading:
+            text = self._resolve_leading(final=True)
+        elif self._wrapper_quote is not None:
+            text = self._resolve_wrapper(final=True)
+        elif not self._in_fence_header:
+            text = self._resolve_body(final=True)
+        self.finished = True
+        self._held = ""
+        return text
+
+    def _in_body(self) -> bool:
+        return not (
+            self._leading or self._in_fence_header or self._wrapper_quote is not None
+        )
+
+    def _resolve_leading(self, final: bool) -> str:
+        stripped = self._held.lstrip()
+        if not stripped or (not final and FENCE.startswith(stripped)):
+            return ""
+
+        self._leading = False
+        if stripped.startswith(FENCE):
+            self._in_fence_header = True
+            self._held = stripped[len(FENCE) :]
+            return "" if final else self._skip_fence_header()
+        if stripped[0] in WRAPPING_QUOTES and stripped[:2] != FENCE[:2]:
+            self._wrapper_quote = stripped[0]
+            self._held = stripped[1:]
+            return self._resolve_wrapper(final)
+
+        self._held = stripped
+        return self._resolve_body(final)
+
+    def _skip_fence_header(self) -> str:
+        # The rest of the opening fence line is a language tag.
+        newline_index = self._held.find("\n")
+        if newline_index == -1:
+            self._held = ""
+            return ""
+
+        self._in_fence_header = False
+        self._in_fence = True
+        self._held = self._held[newline_index + 1 :]
+        return self._resolve_body(final=False)
+
+    def _resolve_wrapper(self, final: bool) -> str:
+        quote = self._wrapper_quote
+        assert quote is not None
+        closing_index = self._held.find(quote)
+        newline_index = self._held.find("\n")
+        if closing_index == -1 or -1 < newline_index < closing_index:
+            if newline_index == -1 and not final:
+                return ""
+            # The quote opens part of a longer command rather than wrapping it.
+            return self._unwrap_as_body(final)
+
+        after_quote = self._held[closing_index + 1 :]
+        if after_quote.strip(" \t") == "" and not final:
+            return ""
+        if after_quote.lstrip(" \t").startswith("\n") or not after_quote.strip():
+            self.finished = True
+            return self._held[:closing_index]
+        return self._unwrap_as_body(final)
+
+    def _unwrap_as_body(self, final: bool) -> str:
+        self._held = f"{self._wrapper_quote}{self._held}"
+        self._wrapper_quote = None
+        return self._resolve_body(final)
+
+    def _resolve_body(self, final: bool) -> str:
+        emitted: list[str] = []
+        while self._held:
+            newline_index = self._held.find("\n")
+            if newline_index != 0:
+                line_end = len(self._held) if newline_index == -1 else newline_index
+                emitted.append(self._emit(self._held[:line_end]))
+                self._held = self._held[line_end:]
+                continue
+
+            # Held text now starts with a newline; see what the next line is.
+            decision = self._next_line_decision(final)
+            if decision is None:
+                break
+            if decision:
+                self.finished = True
+                self._held = ""
+                break
+            next_newline = self._held.find("\n", self._next_line_start())
+            line_end = len(self._held) if next_newline == -1 else next_newline
+            emitted.append(self._emit(self._held[:line_end]))
+            self._held = self._held[line_end:]
+
+        if final:
+            # Trailing blank lines and an undecided tail are not command text.
+            self._held = ""
+        return "".join(emitted)
+
+    def _emit(self, text: str) -> str:
+        # Only the last line of the text can still be incomplete; any line
+        # before it ended with a newline that was already decided on.
+        _complete, newline, last_line = text.rpartition("\n")
+        self._line = last_line if newline else self._line + text
+        return text
+
+    def _end_line(self) -> None:
+        line, self._line = self._line, ""
+        if not self._heredocs:
+            self._heredocs.extend(
+                (match.group(3), match.group(1) == "-")
+                for match in HEREDOC_PATTERN.finditer(line)
+            )
+            return
+        delimiter, strips_tabs = self._heredocs[0]
+        if (line.lstrip("\t") if strips_tabs else line).rstrip() == delimiter:
+            del self._heredocs[0]
+
+    def _next_line_start(self) -> int:
+        index = 0
+        while index < len(self._held) and self._held[index] in "\n \t":
+            index += 1
+        return index
+
+    def _next_line_decision(self, final: bool) -> bool | None:
+        # True ends the command here, False keeps the newline, None waits.
+        self._end_line()
+        start = self._next_line_start()
+        line_end = self._held.find("\n", start)
+        line = self._held[start:] if line_end == -1 else self._held[start:line_end]
+        complete = final or line_end != -1
+        if not line:
+            return True if final else None
+        if self._heredocs:
+            return False
+
+        if line.startswith(FENCE):
+            return True
+        if FENCE.startswith(line) and not complete:
+            return None
+        if self._in_fence or self._held[:start].count("\n") < 2:
+            return False
+
+        if PROSE_LINE_PATTERN.match(line):
+            return True
+        if UNDECIDED_PROSE_PATTERN.fullmatch(line):
+            return True if complete else None
+        return False
+
+
+def sanitized_chunks(response):
+    sanitizer = CommandSanitizer()
+    chunks = iter(response)
+    try:
+        for chunk in chunks:
+            text = sanitizer.feed(chunk)
+            if text:
+                yield text
+            if sanitizer.finished:
+                return
+        text = sanitizer.finish()
+        if text:
+            yield text
+    finally:
+        # Stopping early closes the model's stream instead of reading the
+        # explanation nobody will see.
+        close = getattr(chunks, "close", None)
+        if callable(close):
+            close()
+
+
+async def sanitized_async_chunks(response: AsyncIterable[str]):
+    sanitizer = CommandSanitizer()
+    chunks: AsyncIterator[str] = aiter(response)
+    try:
+        async for chunk in chunks:
+            text = sanitizer.feed(chunk)
+            if text:
+                yield text
+            if sanitizer.finished:
+                return
+        text = sanitizer.finish()
+        if text:
+            yield text
+    finally:
+        if isinstance(chunks, _AsyncClosable):
+            await chunks.aclose()
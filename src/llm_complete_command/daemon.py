@@ -0,0 +1,198 @@
+import os
+import socket
+import socketserver
+import threading
+import time
+from pathlib import Path
+from typing import Any, cast
+
+import llm
+from loguru import logger
+from llm_complete_command_client import (
+    COMPLETE_FRAME,
+    ERROR_FRAME,
+    FEEDBACK_FRAME,
+    OUTPUT_FRAME,
+    RESULT_FRAME,
+    REVISE_FRAME,
+    daemon_socket_path,
+    read_frame,
+    write_frame,
+)
+
+from . import (
+    FEEDBACK_PROMPT,
+    _collect_without_spinner,
+    remember_accepted_command,
+    render_default_prompt,
+    run_completion_session,
+)
+from .latency_stats import flush_latency_records
+from .model_race import race_model_ids
+from .system_prompt_cache import forget_cached_entry
+
+
+SYSTEM_PROMPT_TTL_SECONDS = 5 * 60
+SOCKET_DIRECTORY_MODE = 0o700
+SOCKET_FILE_MODE = 0o600
+
+
+class DaemonAlreadyRunningError(Exception):
+    pass
+
+
+class DaemonState:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models: dict[tuple[str, str | None], Any] = {}
+        self._config_read_at = time.monotonic()
+
+    def model(self, model_id: str | None, key: str | None):
+        resolved_model_id = model_id or llm.get_default_model()
+        cache_key = (resolved_model_id, key)
+
+        with self._lock:
+            model_obj = self._models.get(cache_key)
+            if model_obj is None:
+                model_obj = llm.get_model(resolved_model_id)
+                if model_obj.needs_key:
+                    model_obj.key = llm.get_key(
+                        key, model_obj.needs_key, model_obj.key_env_var
+                    )
+                self._models[cache_key] = model_obj
+            return model_obj
+
+    def expire_config(self) -> None:
+        # The system prompt and settings are read once per process, so the
+        # daemon drops its copy after a while to pick up config changes.
+        with self._lock:
+            if time.monotonic() - self._config_read_at > SYSTEM_PROMPT_TTL_SECONDS:
+                forget_cached_entry()
+                self._config_read_at = time.monotonic()
+
+    def system_prompt(self) -> str:
+        return render_default_prompt()
+
+
+class ClientDisconnectedError(Exception):
+    pass
+
+
+class _FrameTerminal:
+    def __init__(self, stream):
+        self._stream = stream
+
+    def write(self, text: str) -> None:
+        write_frame(self._stream, {"type": OUTPUT_FRAME, "text": text})
+
+    def read_feedback(self) -> str:
+        write_frame(self._stream, {"type": FEEDBACK_FRAME, "prompt": FEEDBACK_PROMPT})
+        reply = read_frame(self._stream)
+        if reply is None or reply.get("type") != REVISE_FRAME:
+            raise ClientDisconnectedError()
+        return str(reply.get("feedback") or "")
+
+
+def serve_session(stream, state: DaemonState) -> None:
+    request = read_frame(stream)
+    if request is None or request.get("type") != COMPLETE_FRAME:
+        return
+
+    try:
+        state.expire_config()
+        race_conversations = _race_conversations(request, state)
+        conversation = (
+            race_conversations[0]
+            if race_conversations
+            else state.model(request.get("model"), request.get("key")).conversation()
+        )
+        system = request.get("system") or state.system_prompt()
+        prompt = str(request.get("prompt") or "")
+        use_cache = not request.get("no_cache")
+
+        generated_command = run_completion_session(
+            conversation,
+            prompt,
+            system,
+            _FrameTerminal(stream),
+            collect=_collect_without_spinner,
+            use_cache=use_cache,
+            race_conversations=race_conversations,
+            cwd=request.get("cwd"),
+            histfile=request.get("histfile"),
+            key=request.get("key"),
+        )
+        write_frame(stream, {"type": RESULT_FRAME, "command": generated_command})
+        if use_cache:
+            remember_accepted_command(
+                conversation, prompt, system, generated_command, request.get("cwd")
+            )
+        flush_latency_records()
+    except (BrokenPipeError, ConnectionResetError, ClientDisconnectedError):
+        return
+    except Exception as error:
+        logger.exception("an error occurred while serving a completion")
+        write_frame(stream, {"type": ERROR_FRAME, "message": str(error)})
+
+
+def _race_conversations(request: dict[str, Any], state: DaemonState) -> list | None:
+    race = request.get("race")
+    if race is None and request.get("model") is not None:
+        return None
+
+    race_ids = race_model_ids(race if isinstance(race, str) else None)
+    if not race_ids:
+        return None
+    return [
+        state.model(race_id, request.get("key")).conversation() for race_id in race_ids
+    ]
+
+
+class _SessionHandler(socketserver.BaseRequestHandler):
+    def handle(self) -> None:
+        server = cast("CompletionServer", self.server)
+        with self.request.makefile("rwb") as stream:
+            serve_session(stream, server.state)
+
+
+class CompletionServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: Path, state: DaemonState):
+        self.state = state
+        super().__init__(str(socket_path), _SessionHandler)
+
+
+def _prepare_socket_path(socket_path: Path) -> None:
+    socket_path.parent.mkdir(parents=True, exist_ok=True, mode=SOCKET_DIRECTORY_MODE)
+    # Without XDG_RUNTIME_DIR the socket lives under the shared temp dir, where
+    # another user could have created its directory first.
+    if socket_path.parent.stat().st_uid != os.getuid():
+        raise PermissionError(f"{socket_path.parent} belongs to another user")
+    if not socket_path.exists():
+        return
+
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(str(socket_path))
+    except OSError:
+        socket_path.unlink(missing_ok=True)
+        return
+    finally:
+        probe.close()
+
+    raise DaemonAlreadyRunningError(f"a daemon is already listening on {socket_path}")
+
+
+def serve(socket_path: Path | None = None) -> None:
+    socket_path = socket_path or daemon_socket_path()
+    _prepare_socket_path(socket_path)
+
+    with CompletionServer(socket_path, DaemonState()) as server:
+        os.chmod(socket_path, SOCKET_FILE_MODE)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            socket_path.unlink(missing_ok=True)
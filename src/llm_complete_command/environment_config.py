@@ -1,13 +1,14 @@
 import os
 import platform
-import shutil
 import subprocess
+import sys
+import threading
 import time
 from pathlib import Path
-from typing import Any
+from typing import Any, Callable
 
-import yaml
-from platformdirs import user_config_dir
+from .atomic_file import write_text_atomically
+from .executable_index import find_executable, find_executables
 
 
 APP_NAME = "llm-complete-command"
@@ -16,27 +17,147 @@ DETECTED_CONFIG_FILE_NAME = "config.detected.yaml"
 OVERRIDE_CONFIG_FILE_NAME = "config.yaml"
 DETECTED_AT_KEY = "detected_at"
 ADDITIONAL_DETAILS_KEY = "additional_details"
+SETTINGS_KEY = "settings"
+EXTRA_PROBED_TOOLS_SETTING = "extra_probed_tools"
+PENDING_PROBES_KEY = "pending_probes"
+FINGERPRINTS_KEY = "fingerprints"
+TOOLS_KEY = "tools"
+TOOL_PROBE_PREFIX = "tools."
 ENVIRONMENT_PROBE_TTL_SECONDS = 7 * 24 * 60 * 60
 PROBED_TOOLS = ("rg", "fd", "choose", "eza", "procs", "jq", "yq")
 COMMAND_TIMEOUT_SECONDS = 2
+ENVIRONMENT_PROBE_DEADLINE_SECONDS = COMMAND_TIMEOUT_SECONDS + 0.5
+FIRST_RUN_PROBE_DEADLINE_SECONDS = 0.2
+REFRESH_LOCK_FILE_NAME = "config.detected.lock"
+REFRESH_RETRY_SECONDS = 60
+REFRESH_COMMAND = ("-m", "llm", "complete_command", "--refresh-environment")
+OS_RELEASE_PATHS = (
+    Path("/etc/os-release"),
+    Path("/System/Library/CoreServices/SystemVersion.plist"),
+)
+MISSING_FINGERPRINT = "missing"
 
 
 def load_effective_environment() -> dict[str, Any]:
     detected_environment = _load_detected_environment()
     override_environment = _read_yaml_dict(_override_config_path())
+    override_environment.pop(SETTINGS_KEY, None)
     return _deep_merge_dicts(detected_environment, override_environment)
 
 
+def load_settings() -> dict[str, Any]:
+    settings = _read_yaml_dict(_override_config_path()).get(SETTINGS_KEY)
+    return settings if isinstance(settings, dict) else {}
+
+
+def refresh_detected_environment() -> None:
+    import fcntl
+
+    detected_path = _detected_config_path()
+    with open(_refresh_lock_path(), "a") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return
+
+        detected_environment = _read_yaml_dict(detected_path)
+        refreshed_environment = _refreshed_environment(detected_environment)
+        if refreshed_environment is not None:
+            _write_yaml_dict(detected_path, refreshed_environment)
+
+
 def _load_detected_environment() -> dict[str, Any]:
     detected_path = _detected_config_path()
     detected_environment = _read_yaml_dict(detected_path)
 
-    if _is_fresh(detected_environment):
-        return detected_environment
+    if not detected_environment:
+        # Nothing to serve yet: take whatever a short probe finds and let the
+        # background refresh fill in the sections it missed.
+        detected_environment = _probe_environment(FIRST_RUN_PROBE_DEADLINE_SECONDS)
+        _write_yaml_dict(detected_path, detected_environment)
+
+    schedule_refresh_if_needed(detected_environment)
+    return detected_environment
+
+
+def schedule_refresh_if_needed(
+    environment: dict[str, Any], settings: dict[str, Any] | None = None
+) -> None:
+    # Callers that already hold the settings pass them in, so checking for
+    # staleness does not parse the YAML config again.
+    if _needs_refresh(environment, settings):
+        spawn_background_refresh()
+
+
+def config_signature() -> list[list[int]]:
+    signature = []
+    for path in (_detected_config_path(), _override_config_path()):
+        try:
+            stat_result = path.stat()
+        except OSError:
+            signature.append([0, 0])
+            continue
+        signature.append([stat_result.st_mtime_ns, stat_result.st_size])
+    return signature
+
+
+def freshness_fields(environment: dict[str, Any]) -> dict[str, Any]:
+    return {
+        key: environment[key]
+        for key in (DETECTED_AT_KEY, PENDING_PROBES_KEY, FINGERPRINTS_KEY)
+        if key in environment
+    }
+
+
+def _needs_refresh(
+    environment: dict[str, Any], settings: dict[str, Any] | None = None
+) -> bool:
+    return not _is_fresh(environment) or bool(_stale_probes(environment, settings))
+
+
+def _refreshed_environment(environment: dict[str, Any]) -> dict[str, Any] | None:
+    if not _is_fresh(environment):
+        return _probe_environment()
+    if stale_probes := _stale_probes(environment):
+        return _probe_sections(stale_probes, environment)
+    return None
+
 
-    refreshed_environment = _probe_environment()
-    _write_yaml_dict(detected_path, refreshed_environment)
-    return refreshed_environment
+def _stale_probes(
+    environment: dict[str, Any], settings: dict[str, Any] | None = None
+) -> list[str]:
+    stale_probes = _pending_probes(environment)
+    fingerprints = environment.get(FINGERPRINTS_KEY)
+    if not isinstance(fingerprints, dict):
+        fingerprints = {}
+
+    probe_names = [name for name in _probe_names(settings) if name not in stale_probes]
+    for probe_name, fingerprint in _section_fingerprints(probe_names).items():
+        if fingerprints.get(probe_name) != fingerprint:
+            stale_probes.append(probe_name)
+
+    return stale_probes
+
+
+def spawn_background_refresh() -> None:
+    lock_path = _refresh_lock_path()
+    try:
+        if time.time() - lock_path.stat().st_mtime < REFRESH_RETRY_SECONDS:
+            return
+    except OSError:
+        pass
+
+    try:
+        lock_path.touch()
+        subprocess.Popen(
+            [sys.executable, *REFRESH_COMMAND],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+    except OSError:
+        return
 
 
 def _is_fresh(environment: dict[str, Any]) -> bool:
@@ -48,24 +169,228 @@ def _is_fresh(environment: dict[str, Any]) -> bool:
     return elapsed_seconds <= ENVIRONMENT_PROBE_TTL_SECONDS
 
 
-def _probe_environment() -> dict[str, Any]:
-    return {
+def _pending_probes(environment: dict[str, Any]) -> list[str]:
+    pending_probes = environment.get(PENDING_PROBES_KEY)
+    if not isinstance(pending_probes, list):
+        return []
+    return [probe_name for probe_name in pending_probes if isinstance(probe_name, str)]
+
+
+def _probe_environment(deadline_seconds: float | None = None) -> dict[str, Any]:
+    environment = {
         DETECTED_AT_KEY: int(time.time()),
-        "os": _safe_probe(
-            _probe_os,
-            {"family": UNKNOWN_VALUE, "name": UNKNOWN_VALUE, "version": UNKNOWN_VALUE},
-        ),
-        "shell": _safe_probe(
-            _probe_shell,
-            {"name": UNKNOWN_VALUE, "path": UNKNOWN_VALUE, "version": UNKNOWN_VALUE},
-        ),
-        "terminal": _safe_probe(
-            _probe_terminal,
-            {"name": UNKNOWN_VALUE, "version": UNKNOWN_VALUE},
-        ),
-        "tools": _safe_probe(_probe_tools, {}),
+        "os": {},
+        "shell": {},
+        "terminal": {},
+        TOOLS_KEY: {},
         ADDITIONAL_DETAILS_KEY: {},
     }
+    return _probe_sections(_probe_names(), environment, deadline_seconds)
+
+
+def _probe_names(settings: dict[str, Any] | None = None) -> list[str]:
+    return [
+        "os",
+        "shell",
+        "terminal",
+        *(f"{TOOL_PROBE_PREFIX}{tool_name}" for tool_name in _probed_tools(settings)),
+    ]
+
+
+def _probed_tools(settings: dict[str, Any] | None = None) -> list[str]:
+    if settings is None:
+        settings = load_settings()
+    extra_tools = settings.get(EXTRA_PROBED_TOOLS_SETTING)
+    if not isinstance(extra_tools, list):
+        extra_tools = []
+
+    probed_tools: list[str] = list(PROBED_TOOLS)
+    for tool_name in extra_tools:
+        if isinstance(tool_name, str) and tool_name not in probed_tools:
+            probed_tools.append(tool_name)
+    return probed_tools
+
+
+def _probe_sections(
+    probe_names: list[str],
+    environment: dict[str, Any],
+    deadline_seconds: float | None = None,
+) -> dict[str, Any]:
+    # Probes that miss the deadline keep their unknown fallback and are listed
+    # under pending_probes so the next load retries just those.
+    probes = {probe_name: _section_probe(probe_name) for probe_name in probe_names}
+    fingerprints = _section_fingerprints(probe_names)
+    # Availability-only tools are a lookup in the PATH index, so they are
+    # resolved here instead of waiting for a worker.
+    results = {
+        probe_name: _safe_probe(*probe)
+        for probe_name, probe in probes.items()
+        if _is_availability_only(probe_name)
+    }
+    results.update(
+        _run_probes_concurrently(
+            {
+                probe_name: probe
+                for probe_name, probe in probes.items()
+                if probe_name not in results
+            },
+            deadline_seconds or ENVIRONMENT_PROBE_DEADLINE_SECONDS,
+        )
+    )
+
+    probed_environment = dict(environment)
+    tools = probed_environment.get(TOOLS_KEY)
+    probed_environment[TOOLS_KEY] = dict(tools) if isinstance(tools, dict) else {}
+    previous_fingerprints = probed_environment.get(FINGERPRINTS_KEY)
+    if isinstance(previous_fingerprints, dict):
+        fingerprints = {**previous_fingerprints, **fingerprints}
+    pending_probes = []
+
+    for probe_name, (_probe_function, fallback_value) in probes.items():
+        if probe_name in results:
+            value = results[probe_name]
+        else:
+            value = fallback_value
+            pending_probes.append(probe_name)
+
+        if probe_name.startswith(TOOL_PROBE_PREFIX):
+            tool_name = probe_name.removeprefix(TOOL_PROBE_PREFIX)
+            probed_environment[TOOLS_KEY][tool_name] = value
+        else:
+            probed_environment[probe_name] = value
+
+    probed_environment[PENDING_PROBES_KEY] = pending_probes
+    probed_environment[FINGERPRINTS_KEY] = fingerprints
+    return probed_environment
+
+
+def _section_probe(probe_name: str) -> tuple[Callable[[], Any], Any]:
+    if probe_name == "os":
+        return _probe_os, {
+            "family": UNKNOWN_VALUE,
+            "name": UNKNOWN_VALUE,
+            "version": UNKNOWN_VALUE,
+        }
+    if probe_name == "shell":
+        return _probe_shell, {
+            "name": UNKNOWN_VALUE,
+            "path": UNKNOWN_VALUE,
+            "version": UNKNOWN_VALUE,
+        }
+    if probe_name == "terminal":
+        return _probe_terminal, {"name": UNKNOWN_VALUE, "version": UNKNOWN_VALUE}
+
+    # Only the built-in tools pay for a --version subprocess; extra tools from
+    # the settings are resolved against the executable index alone.
+    tool_name = probe_name.removeprefix(TOOL_PROBE_PREFIX)
+    probe_version = not _is_availability_only(probe_name)
+    return lambda: _probe_tool(tool_name, probe_version), {
+        "available": False,
+        "path": UNKNOWN_VALUE,
+        "version": UNKNOWN_VALUE,
+    }
+
+
+def _is_availability_only(probe_name: str) -> bool:
+    return (
+        probe_name.startswith(TOOL_PROBE_PREFIX)
+        and probe_name.removeprefix(TOOL_PROBE_PREFIX) not in PROBED_TOOLS
+    )
+
+
+def _section_fingerprints(probe_names: list[str]) -> dict[str, str]:
+    tool_paths = find_executables(
+        probe_name.removeprefix(TOOL_PROBE_PREFIX)
+        for probe_name in probe_names
+        if probe_name.startswith(TOOL_PROBE_PREFIX)
+    )
+    return {
+        probe_name: (
+            _tool_fingerprint(
+                probe_name, tool_paths[probe_name.removeprefix(TOOL_PROBE_PREFIX)]
+            )
+            if probe_name.startswith(TOOL_PROBE_PREFIX)
+            else _section_fingerprint(probe_name)
+        )
+        for probe_name in probe_names
+    }
+
+
+def _section_fingerprint(probe_name: str) -> str:
+    # Cheap stand-ins for each probe's inputs: when one changes, only that
+    # section is probed again.
+    if probe_name == "os":
+        release_files = (_file_fingerprint(path) for path in OS_RELEASE_PATHS)
+        return ":".join([platform.system(), platform.release(), *release_files])
+    if probe_name == "shell":
+        shell_path = os.getenv("SHELL")
+        return _file_fingerprint(Path(shell_path)) if shell_path else UNKNOWN_VALUE
+    if probe_name == "terminal":
+        terminal_name = _detect_terminal_name()
+        terminal_version = os.getenv("TERM_PROGRAM_VERSION") or UNKNOWN_VALUE
+        terminal_path = find_executable(terminal_name)
+        terminal_binary = (
+            _file_fingerprint(Path(terminal_path))
+            if terminal_path
+            else MISSING_FINGERPRINT
+        )
+        return f"{terminal_name}:{terminal_version}:{terminal_binary}"
+
+    return _tool_fingerprint(
+        probe_name, find_executable(probe_name.removeprefix(TOOL_PROBE_PREFIX))
+    )
+
+
+def _tool_fingerprint(probe_name: str, tool_path: str | None) -> str:
+    if tool_path is None:
+        return MISSING_FINGERPRINT
+    # Without a version to go stale, where the tool lives is all that matters,
+    # and the path comes from the index without a stat call.
+    if _is_availability_only(probe_name):
+        return tool_path
+    return _file_fingerprint(Path(tool_path))
+
+
+def _file_fingerprint(path: Path) -> str:
+    try:
+        stat_result = path.stat()
+    except OSError:
+        return f"{path}:{MISSING_FINGERPRINT}"
+    return f"{path}:{stat_result.st_mtime_ns}:{stat_result.st_ino}"
+
+
+def _run_probes_concurrently(
+    probes: dict[str, tuple[Callable[[], Any], Any]], deadline_seconds: float
+) -> dict[str, Any]:
+    # One daemon thread per probe, so a refresh costs the slowest single tool;
+    # availability-only tools are resolved inline and never get here. Daemon
+    # threads rather than a ThreadPoolExecutor: the executor joins its workers
+    # at interpreter exit, which would wait out any slow subprocess.
+    results: dict[str, Any] = {}
+    threads = []
+    for probe_name, (probe_function, fallback_value) in probes.items():
+        thread = threading.Thread(
+            target=_store_probe_result,
+            args=(results, probe_name, probe_function, fallback_value),
+            daemon=True,
+        )
+        thread.start()
+        threads.append(thread)
+
+    deadline = time.monotonic() + deadline_seconds
+    for thread in threads:
+        thread.join(max(0.0, deadline - time.monotonic()))
+
+    return dict(results)
+
+
+def _store_probe_result(
+    results: dict[str, Any],
+    probe_name: str,
+    probe_function: Callable[[], Any],
+    fallback_value: Any,
+) -> None:
+    results[probe_name] = _safe_probe(probe_function, fallback_value)
 
 
 def _probe_os() -> dict[str, str]:
@@ -129,7 +454,7 @@ def _probe_terminal() -> dict[str, str]:
     terminal_name = _detect_terminal_name()
     terminal_version = os.getenv("TERM_PROGRAM_VERSION") or UNKNOWN_VALUE
 
-    if terminal_version == UNKNOWN_VALUE and shutil.which(terminal_name):
+    if terminal_version == UNKNOWN_VALUE and find_executable(terminal_name):
         terminal_version = _command_version(terminal_name, ["--version"])
 
     return {"name": terminal_name, "version": terminal_version}
@@ -150,22 +475,20 @@ def _detect_terminal_name() -> str:
     return os.getenv("TERM") or UNKNOWN_VALUE
 
 
-def _probe_tools() -> dict[str, dict[str, str | bool]]:
-    tools: dict[str, dict[str, str | bool]] = {}
-    for tool_name in PROBED_TOOLS:
-        tool_path = shutil.which(tool_name)
-        available = tool_path is not None
-        version = (
-            _command_version(tool_name, ["--version"]) if available else UNKNOWN_VALUE
-        )
-
-        tools[tool_name] = {
-            "available": available,
-            "path": tool_path or UNKNOWN_VALUE,
-            "version": version,
-        }
+def _probe_tool(tool_name: str, probe_version: bool = True) -> dict[str, str | bool]:
+    tool_path = find_executable(tool_name)
+    available = tool_path is not None
+    version = (
+        _command_version(tool_name, ["--version"])
+        if available and probe_version
+        else UNKNOWN_VALUE
+    )
 
-    return tools
+    return {
+        "available": available,
+        "path": tool_path or UNKNOWN_VALUE,
+        "version": version,
+    }
 
 
 def _command_version(command: str, args: list[str]) -> str:
@@ -216,6 +539,8 @@ def _deep_merge_dicts(base: dict[str, Any], override: dict[str, Any]) -> dict[st
 
 
 def _config_dir() -> Path:
+    from platformdirs import user_config_dir
+
     config_dir = Path(user_config_dir(APP_NAME))
     config_dir.mkdir(parents=True, exist_ok=True)
     return config_dir
@@ -225,16 +550,24 @@ def _detected_config_path() -> Path:
     return _config_dir() / DETECTED_CONFIG_FILE_NAME
 
 
+def _refresh_lock_path() -> Path:
+    return _config_dir() / REFRESH_LOCK_FILE_NAME
+
+
 def _override_config_path() -> Path:
     return _config_dir() / OVERRIDE_CONFIG_FILE_NAME
 
 
 def _read_yaml_dict(path: Path) -> dict[str, Any]:
+    import yaml
+
     if not path.exists():
         return {}
 
     try:
-        raw_data = yaml.safe_load(path.read_text())
+        # libyaml's loader parses the same safe subset several times faster.
+        loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+        raw_data = yaml.load(path.read_text(), Loader=loader)
     except (OSError, yaml.YAMLError):
         return {}
 
@@ -242,7 +575,9 @@ def _read_yaml_dict(path: Path) -> dict[str, Any]:
 
 
 def _write_yaml_dict(path: Path, data: dict[str, Any]) -> None:
+    import yaml
+
     try:
-        path.write_text(yaml.safe_dump(data, sort_keys=False), encoding="utf-8")
+        write_text_atomically(path, yaml.safe_dump(data, sort_keys=False))
     except OSError:
         return
@@ -0,0 +1,116 @@
+import json
+import os
+from pathlib import Path
+from typing import Any, Iterable
+
+from .atomic_file import cache_file_path, write_text_atomically
+
+
+INDEX_FILE_NAME = "executables.json"
+DIRECTORIES_KEY = "directories"
+NAMES_KEY = "names"
+EXECUTABLES_KEY = "executables"
+
+# The file lists each PATH directory once, with its mtime, and the executable
+# names in it. In memory the names become a map to the first directory that
+# has them, as the shell would resolve them.
+
+_index_cache: dict[str, Any] | None = None
+
+
+def find_executable(name: str) -> str | None:
+    directory = _load_index()[EXECUTABLES_KEY].get(name)
+    if directory is None:
+        return None
+    return os.path.join(directory, name)
+
+
+def find_executables(names: Iterable[str]) -> dict[str, str | None]:
+    # One PATH check for many names, rather than one per find_executable call.
+    executables = _load_index()[EXECUTABLES_KEY]
+    return {
+        name: os.path.join(executables[name], name) if name in executables else None
+        for name in names
+    }
+
+
+def _load_index() -> dict[str, Any]:
+    global _index_cache
+    directories = _path_directory_mtimes()
+
+    if _index_cache is not None and _index_cache[DIRECTORIES_KEY] == directories:
+        return _index_cache
+
+    index_path = cache_file_path(INDEX_FILE_NAME)
+    stored_index = _read_index(index_path)
+    if stored_index is None or stored_index[DIRECTORIES_KEY] != directories:
+        stored_index = _build_index(directories)
+        try:
+            write_text_atomically(index_path, json.dumps(stored_index))
+        except OSError:
+            pass
+
+    executables: dict[str, str] = {}
+    for (directory, _mtime_ns), names in zip(directories, stored_index[NAMES_KEY]):
+        for name in names:
+            executables.setdefault(name, directory)
+    _index_cache = {DIRECTORIES_KEY: directories, EXECUTABLES_KEY: executables}
+    return _index_cache
+
+
+def _path_directory_mtimes() -> list[list[Any]]:
+    directories: list[list[Any]] = []
+    seen_directories: set[str] = set()
+
+    for directory in os.environ.get("PATH", os.defpath).split(os.pathsep):
+        directory = directory or os.curdir
+        if directory in seen_directories:
+            continue
+        seen_directories.add(directory)
+
+        try:
+            mtime_ns = os.stat(directory).st_mtime_ns
+        except OSError:
+            continue
+        directories.append([directory, mtime_ns])
+
+    return directories
+
+
+def _build_index(directories: list[list[Any]]) -> dict[str, Any]:
+    names: list[list[str]] = []
+
+    for directory, _mtime_ns in directories:
+        directory_names: list[str] = []
+        names.append(directory_names)
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            continue
+
+        for entry in entries:
+            try:
+                is_executable_file = entry.is_file() and os.access(entry.path, os.X_OK)
+            except OSError:
+                continue
+            if is_executable_file:
+                directory_names.append(entry.name)
+
+    return {DIRECTORIES_KEY: directories, NAMES_KEY: names}
+
+
+def _read_index(path: Path) -> dict[str, Any] | None:
+    try:
+        index = json.loads(path.read_text())
+    except (OSError, json.JSONDecodeError):
+        return None
+
+    if not isinstance(index, dict):
+        return None
+    directories = index.get(DIRECTORIES_KEY)
+    names = index.get(NAMES_KEY)
+    if not isinstance(directories, list) or not isinstance(names, list):
+        return None
+    if len(names) != len(directories):
+        return None
+    return index
@@ -0,0 +1,70 @@
+import threading
+import time
+from typing import Any, Callable
+
+
+FRAME_INTERVAL_SECONDS = 0.016
+
+
+def _start_timer_thread(delay_seconds: float, callback: Callable[[], None]):
+    timer = threading.Timer(delay_seconds, callback)
+    timer.daemon = True
+    timer.start()
+    return timer
+
+
+class CoalescingChunkWriter:
+    # Joins streamed chunks into at most one write per frame interval. The
+    # first chunk is written straight away, and a timer flushes whatever is
+    # left when the stream pauses part way through a frame. `schedule` has the
+    # signature of loop.call_later, so an event loop can drive the timer
+    # instead of a thread.
+    def __init__(
+        self,
+        emit: Callable[[str], None],
+        frame_seconds: float = FRAME_INTERVAL_SECONDS,
+        schedule: Callable[[float, Callable[[], None]], Any] = _start_timer_thread,
+    ):
+        self._emit = emit
+        self._frame_seconds = frame_seconds
+        self._schedule = schedule
+        self._lock = threading.Lock()
+        self._pending: list[str] = []
+        self._last_flush_at: float | None = None
+        self._timer = None
+
+    def write(self, chunk: str) -> None:
+        with self._lock:
+            self._pending.append(chunk)
+            now = time.monotonic()
+            if (
+                self._last_flush_at is None
+                or now - self._last_flush_at >= self._frame_seconds
+            ):
+                self._flush_locked(now)
+                return
+
+            if self._timer is None:
+                remaining_seconds = self._frame_seconds - (now - self._last_flush_at)
+                self._timer = self._schedule(remaining_seconds, self._flush_on_timer)
+
+    def close(self) -> None:
+        with self._lock:
+            self._flush_locked(time.monotonic())
+
+    def _flush_on_timer(self) -> None:
+        with self._lock:
+            self._timer = None
+            self._flush_locked(time.monotonic())
+
+    def _flush_locked(self, now: float) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+
+        frame = "".join(self._pending)
+        self._pending.clear()
+        self._last_flush_at = now
+        self._emit(frame)
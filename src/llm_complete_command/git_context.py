@@ -0,0 +1,312 @@
+import configparser
+import marshal
+import os
+import subprocess
+import time
+from pathlib import Path
+from typing import Any
+
+from .atomic_file import cache_file_path, write_bytes_atomically
+from .system_prompt_cache import cached_settings
+
+
+CACHE_FILE_NAME = "git-context.bin"
+CACHE_FORMAT_VERSION = 1
+REPOSITORIES_KEY = "repositories"
+VERSION_KEY = "version"
+GIT_CONTEXT_SETTING = "git_context"
+GIT_EXECUTABLE = "git"
+# Both git commands run at once and whatever has not finished by the deadline
+# is killed; the branch and HEAD are read from the files and always present.
+GIT_DEADLINE_SECONDS = 0.2
+# Editing a tracked file or fetching changes the output without touching the
+# index or HEAD, so a cached description is also refreshed after this long.
+MAX_CACHE_AGE_SECONDS = 60
+MAX_CACHED_REPOSITORIES = 64
+RECENT_COMMITS = 5
+MAX_SUBJECT_CHARACTERS = 100
+SHORT_HASH_LENGTH = 12
+HEAD_REF_PREFIX = "ref: "
+BRANCH_REF_PREFIX = "refs/heads/"
+GITDIR_PREFIX = "gitdir: "
+STATUS_COMMAND = (
+    "status",
+    "--porcelain=v2",
+    "--branch",
+    "--untracked-files=normal",
+    "--ignore-submodules=dirty",
+)
+LOG_COMMAND = ("log", f"--max-count={RECENT_COMMITS}", "--format=%s")
+
+
+def git_context(cwd: str | None = None, settings: dict[str, Any] | None = None) -> str:
+    if settings is None:
+        settings = cached_settings()
+    if settings.get(GIT_CONTEXT_SETTING) is False:
+        return ""
+    try:
+        repository = _find_repository(Path(os.path.abspath(cwd or os.getcwd())))
+    except OSError:
+        return ""
+    if repository is None:
+        return ""
+
+    work_tree, git_dir, common_dir = repository
+    head = _read_text(git_dir / "HEAD")
+    if head is None:
+        return ""
+    branch = head.removeprefix(HEAD_REF_PREFIX + BRANCH_REF_PREFIX)
+    detached = branch == head
+    head_hash = (
+        head if detached else _resolve_ref(common_dir, BRANCH_REF_PREFIX + branch)
+    )
+    signature = (
+        _mtime_ns(git_dir / "HEAD"),
+        _mtime_ns(git_dir / "index"),
+        head_hash,
+    )
+
+    cache_path = cache_file_path(CACHE_FILE_NAME)
+    repositories = _read_cached_repositories(cache_path)
+    cached = repositories.get(str(work_tree))
+    if (
+        cached is not None
+        and cached[0] == signature
+        and time.time() - cached[1] < MAX_CACHE_AGE_SECONDS
+    ):
+        return cached[2]
+
+    context = _describe_repository(
+        work_tree,
+        None if detached else branch,
+        head_hash,
+        None if detached else _upstream(common_dir, branch),
+    )
+    repositories.pop(str(work_tree), None)
+    repositories[str(work_tree)] = (signature, time.time(), context)
+    while len(repositories) > MAX_CACHED_REPOSITORIES:
+        del repositories[next(iter(repositories))]
+    try:
+        write_bytes_atomically(
+            cache_path,
+            marshal.dumps(
+                {VERSION_KEY: CACHE_FORMAT_VERSION, REPOSITORIES_KEY: repositories}
+            ),
+        )
+    except OSError:
+        pass
+    return context
+
+
+def git_head_name(cwd: str | None = None) -> str:
+    # The repository and checked-out branch, or the commit when HEAD is
+    # detached, read from the files alone.
+    try:
+        repository = _find_repository(Path(os.path.abspath(cwd or os.getcwd())))
+    except OSError:
+        return ""
+    if repository is None:
+        return ""
+    work_tree, git_dir, _common_dir = repository
+    head = _read_text(git_dir / "HEAD")
+    if head is None:
+        return ""
+    return f"{work_tree} {head.removeprefix(HEAD_REF_PREFIX + BRANCH_REF_PREFIX)}"
+
+
+def _describe_repository(
+    work_tree: Path, branch: str | None, head_hash: str | None, upstream: str | None
+) -> str:
+    status_output, log_output = _run_git_commands(
+        work_tree, [STATUS_COMMAND, LOG_COMMAND]
+    )
+    if branch is None:
+        branch_line = "- branch: none (detached HEAD)"
+    else:
+        branch_line = f"- branch: {branch} ({_tracking_note(upstream, status_output)})"
+
+    lines = [f"Git repository: {work_tree}", branch_line]
+    if head_hash:
+        lines.append(f"- HEAD: {head_hash[:SHORT_HASH_LENGTH]}")
+    lines.append(f"- working tree: {_working_tree_note(status_output)}")
+    subjects = [
+        _display_subject(subject) for subject in (log_output or "").splitlines()
+    ]
+    if subjects:
+        lines.append("- recent commits:")
+        lines.extend(f"  - {subject}" for subject in subjects)
+    return "\n".join(lines)
+
+
+def _run_git_commands(
+    work_tree: Path, commands: list[tuple[str, ...]]
+) -> list[str | None]:
+    deadline = time.monotonic() + GIT_DEADLINE_SECONDS
+    # Optional locks would let a read-only status contend with the user's own
+    # git commands for the index lock.
+    environment = {**os.environ, "GIT_OPTIONAL_LOCKS": "0", "LC_ALL": "C"}
+    processes = []
+    for command in commands:
+        try:
+            processes.append(
+                subprocess.Popen(
+                    [GIT_EXECUTABLE, "-C", str(work_tree), *command],
+                    stdin=subprocess.DEVNULL,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.DEVNULL,
+                    env=environment,
+                )
+            )
+        except OSError:
+            processes.append(None)
+
+    outputs: list[str | None] = []
+    for process in processes:
+        if process is None:
+            outputs.append(None)
+            continue
+        try:
+            stdout, _stderr = process.communicate(
+                timeout=max(0.0, deadline - time.monotonic())
+            )
+        except subprocess.TimeoutExpired:
+            # Its children may still hold the pipe, so it is not read again.
+            process.kill()
+            if process.stdout is not None:
+                process.stdout.close()
+            process.wait()
+            outputs.append(None)
+            continue
+        outputs.append(
+            stdout.decode(errors="replace") if process.returncode == 0 else None
+        )
+    return outputs
+
+
+def _tracking_note(upstream: str | None, status_output: str | None) -> str:
+    # The config names the upstream even when status did not finish in time.
+    ahead_behind = None
+    for line in (status_output or "").splitlines():
+        if line.startswith("# branch.upstream "):
+            upstream = line.removeprefix("# branch.upstream ")
+        elif line.startswith("# branch.ab "):
+            ahead, behind = line.removeprefix("# branch.ab ").split()
+            ahead_behind = f"ahead {ahead.lstrip('+')}, behind {behind.lstrip('-')}"
+    if upstream is None:
+        return "no upstream"
+    if ahead_behind is None:
+        return f"tracking {upstream}"
+    return f"tracking {upstream}, {ahead_behind}"
+
+
+def _working_tree_note(status_output: str | None) -> str:
+    if status_output is None:
+        return "unknown"
+
+    staged = modified = untracked = conflicted = 0
+    for line in status_output.splitlines():
+        kind, _space, rest = line.partition(" ")
+        if kind in ("1", "2"):
+            # The XY field: index status, then work tree status; "." is unchanged.
+            staged += rest[0] != "."
+            modified += rest[1] != "."
+        elif kind == "u":
+            conflicted += 1
+        elif kind == "?":
+            untracked += 1
+    counts = [
+        f"{count} {label}"
+        for count, label in (
+            (conflicted, "conflicted"),
+            (staged, "staged"),
+            (modified, "modified"),
+            (untracked, "untracked"),
+        )
+        if count
+    ]
+    return ", ".join(counts) if counts else "clean"
+
+
+def _display_subject(subject: str) -> str:
+    printable = "".join(char if char.isprintable() else "?" for char in subject)
+    if len(printable) > MAX_SUBJECT_CHARACTERS:
+        return f"{printable[: MAX_SUBJECT_CHARACTERS - 3]}..."
+    return printable
+
+
+def _find_repository(directory: Path) -> tuple[Path, Path, Path] | None:
+    # Returns the work tree, its git directory, and the directory shared by
+    # all worktrees, which holds the refs and config.
+    for work_tree in (directory, *directory.parents):
+        dot_git = work_tree / ".git"
+        if dot_git.is_dir():
+            git_dir = dot_git
+        elif dot_git.is_file():
+            # Worktrees and submodules point at their git directory instead.
+            pointer = _read_text(dot_git) or ""
+            if not pointer.startswith(GITDIR_PREFIX):
+                return None
+            git_dir = work_tree / pointer.removeprefix(GITDIR_PREFIX)
+        else:
+            continue
+        common_dir = _read_text(git_dir / "commondir")
+        return work_tree, git_dir, git_dir / common_dir if common_dir else git_dir
+    return None
+
+
+def _resolve_ref(common_dir: Path, ref: str) -> str | None:
+    loose = _read_text(common_dir / ref)
+    if loose is not None:
+        return loose
+    packed = _read_text(common_dir / "packed-refs") or ""
+    for line in packed.splitlines():
+        object_hash, _space, name = line.partition(" ")
+        if name == ref:
+            return object_hash
+    return None
+
+
+def _upstream(common_dir: Path, branch: str) -> str | None:
+    parser = configparser.ConfigParser(
+        strict=False, interpolation=None, allow_no_value=True
+    )
+    try:
+        parser.read(common_dir / "config", encoding="utf-8")
+    except (configparser.Error, UnicodeDecodeError):
+        return None
+
+    section = f'branch "{branch}"'
+    if not parser.has_section(section):
+        return None
+    remote = parser.get(section, "remote", fallback=None)
+    merge = parser.get(section, "merge", fallback=None)
+    if not remote or not merge:
+        return None
+    merge_branch = merge.removeprefix(BRANCH_REF_PREFIX)
+    return merge_branch if remote == "." else f"{remote}/{merge_branch}"
+
+
+def _read_text(path: Path) -> str | None:
+    try:
+        return path.read_text(encoding="utf-8", errors="replace").strip()
+    except OSError:
+        return None
+
+
+def _mtime_ns(path: Path) -> int:
+    try:
+        return path.stat().st_mtime_ns
+    except OSError:
+        return 0
+
+
+def _read_cached_repositories(path: Path) -> dict[str, Any]:
+    try:
+        data = marshal.loads(path.read_bytes())
+    except (OSError, EOFError, ValueError, TypeError):
+        return {}
+
+    if not isinstance(data, dict) or data.get(VERSION_KEY) != CACHE_FORMAT_VERSION:
+        return {}
+    repositories = data.get(REPOSITORIES_KEY)
+    return repositories if isinstance(repositories, dict) else {}
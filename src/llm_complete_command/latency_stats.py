@@ -0,0 +1,371 @@
+import bisect
+import json
+import math
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+from .atomic_file import cache_file_path, locked, write_text_atomically
+
+
+CACHE_FILE_NAME = "latency-histograms.json"
+STATS_FORMAT_VERSION = 1
+HISTOGRAM_RETENTION_DAYS = 30
+PERCENTILE_WINDOW_DAYS = 7
+MIN_SAMPLES_FOR_PERCENTILE = 20
+REPORTED_PERCENTILES = (50, 90, 99)
+VERSION_KEY = "version"
+DAYS_KEY = "days"
+GENERATIONS_KEY = "generations"
+TEMPERATURE_RETRIES_KEY = "temperature_retries"
+INPUT_TOKENS_KEY = "input_tokens"
+CACHED_INPUT_TOKENS_KEY = "cached_input_tokens"
+FIRST_TOKEN_METRIC = "first_token_seconds"
+CACHED_FIRST_TOKEN_METRIC = "cached_first_token_seconds"
+STREAM_METRIC = "stream_seconds"
+CHUNKS_METRIC = "chunks"
+CHARACTERS_METRIC = "characters"
+REVISION_ROUND_METRIC = "revision_round"
+
+
+def _geometric_bounds(first: float, ratio: float, count: int) -> tuple[float, ...]:
+    return tuple(round(first * ratio**index, 3) for index in range(count))
+
+
+# Where providers report prompt-cache reads in the usage details. Anthropic
+# counts them separately from input_tokens rather than as part of it.
+CACHED_TOKEN_DETAIL_KEYS = (
+    "cached_tokens",
+    "cache_read_input_tokens",
+    "cachedContentTokenCount",
+)
+SEPARATELY_COUNTED_CACHE_KEYS = ("cache_read_input_tokens",)
+
+
+# Each metric has fixed bucket upper bounds; one overflow bucket follows them.
+# Fixed buckets keep the store bounded no matter how many completions it sees.
+METRIC_BUCKETS: dict[str, tuple[float, ...]] = {
+    FIRST_TOKEN_METRIC: _geometric_bounds(0.05, 1.25, 32),
+    CACHED_FIRST_TOKEN_METRIC: _geometric_bounds(0.05, 1.25, 32),
+    STREAM_METRIC: _geometric_bounds(0.05, 1.25, 36),
+    CHUNKS_METRIC: _geometric_bounds(1, 1.5, 24),
+    CHARACTERS_METRIC: _geometric_bounds(8, 1.5, 24),
+    REVISION_ROUND_METRIC: tuple(float(round_number) for round_number in range(10)),
+}
+METRIC_LABELS = {
+    FIRST_TOKEN_METRIC: "first token",
+    CACHED_FIRST_TOKEN_METRIC: "first (cached)",
+    STREAM_METRIC: "stream",
+    CHUNKS_METRIC: "chunks",
+    CHARACTERS_METRIC: "characters",
+    REVISION_ROUND_METRIC: "revision round",
+}
+
+
+@dataclass(frozen=True)
+class GenerationRecord:
+    model_id: str
+    stream_seconds: float
+    chunks: int
+    characters: int
+    revision_round: int
+    temperature_retry: bool
+    first_token_seconds: float | None = None
+    input_tokens: int | None = None
+    cached_input_tokens: int | None = None
+
+
+# Records are buffered in memory while a completion is on screen and written
+# by flush_latency_records() once the command has been handed back.
+_pending_first_tokens: list[tuple[str, float]] = []
+_pending_generations: list[GenerationRecord] = []
+
+
+def timed_chunks(
+    response,
+    model_id: str,
+    revision_round: int = 0,
+    temperature_retry: bool = False,
+    usage_from=None,
+):
+    # `usage_from` is the llm response behind `response`, read for token usage
+    # once the stream is done.
+    started_at = time.monotonic()
+    first_token_seconds = None
+    chunks = 0
+    characters = 0
+    for chunk in response:
+        if first_token_seconds is None:
+            first_token_seconds = time.monotonic() - started_at
+            note_first_token(model_id, first_token_seconds)
+        chunks += 1
+        characters += len(chunk)
+        yield chunk
+
+    # Streams abandoned part way (a lost race, an error) never get here, so
+    # only their time to first token is recorded.
+    _note_generation(
+        model_id,
+        started_at,
+        chunks,
+        characters,
+        revision_round,
+        temperature_retry,
+        first_token_seconds,
+        usage_from,
+    )
+
+
+async def timed_async_chunks(
+    response,
+    model_id: str,
+    revision_round: int = 0,
+    temperature_retry: bool = False,
+    usage_from=None,
+):
+    started_at = time.monotonic()
+    first_token_seconds = None
+    chunks = 0
+    characters = 0
+    async for chunk in response:
+        if first_token_seconds is None:
+            first_token_seconds = time.monotonic() - started_at
+            note_first_token(model_id, first_token_seconds)
+        chunks += 1
+        characters += len(chunk)
+        yield chunk
+
+    _note_generation(
+        model_id,
+        started_at,
+        chunks,
+        characters,
+        revision_round,
+        temperature_retry,
+        first_token_seconds,
+        usage_from,
+    )
+
+
+def note_first_token(model_id: str, seconds: float) -> None:
+    _pending_first_tokens.append((model_id, seconds))
+
+
+def _note_generation(
+    model_id: str,
+    started_at: float,
+    chunks: int,
+    characters: int,
+    revision_round: int,
+    temperature_retry: bool,
+    first_token_seconds: float | None,
+    usage_from,
+) -> None:
+    input_tokens, cached_input_tokens = _response_usage(usage_from)
+    _pending_generations.append(
+        GenerationRecord(
+            model_id,
+            time.monotonic() - started_at,
+            chunks,
+            characters,
+            revision_round,
+            temperature_retry,
+            first_token_seconds,
+            input_tokens,
+            cached_input_tokens,
+        )
+    )
+
+
+def _response_usage(response) -> tuple[int | None, int | None]:
+    input_tokens = getattr(response, "input_tokens", None)
+    if isinstance(input_tokens, bool) or not isinstance(input_tokens, int):
+        return None, None
+
+    cached_input_tokens = 0
+    for key, value in _usage_detail_counts(getattr(response, "token_details", None)):
+        if key in CACHED_TOKEN_DETAIL_KEYS:
+            cached_input_tokens += value
+            if key in SEPARATELY_COUNTED_CACHE_KEYS:
+                input_tokens += value
+    return input_tokens, cached_input_tokens
+
+
+def _usage_detail_counts(details):
+    if not isinstance(details, dict):
+        return
+    for key, value in details.items():
+        if isinstance(value, dict):
+            yield from _usage_detail_counts(value)
+        elif isinstance(value, int) and not isinstance(value, bool):
+            yield key, value
+
+
+def flush_latency_records() -> None:
+    if not _pending_first_tokens and not _pending_generations:
+        return
+
+    first_tokens = list(_pending_first_tokens)
+    del _pending_first_tokens[: len(first_tokens)]
+    generations = list(_pending_generations)
+    del _pending_generations[: len(generations)]
+
+    path = cache_file_path(CACHE_FILE_NAME)
+    today = time.strftime("%Y-%m-%d")
+    with locked(path):
+        days = _read_days(path)
+        today_models = days.setdefault(today, {})
+        for model_id, seconds in first_tokens:
+            _add_sample(_model_day(today_models, model_id), FIRST_TOKEN_METRIC, seconds)
+        for record in generations:
+            model_day = _model_day(today_models, record.model_id)
+            model_day[GENERATIONS_KEY] += 1
+            model_day[TEMPERATURE_RETRIES_KEY] += int(record.temperature_retry)
+            _add_sample(model_day, STREAM_METRIC, record.stream_seconds)
+            _add_sample(model_day, CHUNKS_METRIC, record.chunks)
+            _add_sample(model_day, CHARACTERS_METRIC, record.characters)
+            _add_sample(model_day, REVISION_ROUND_METRIC, record.revision_round)
+            if record.input_tokens is not None:
+                model_day[INPUT_TOKENS_KEY] = (
+                    model_day.get(INPUT_TOKENS_KEY, 0) + record.input_tokens
+                )
+                model_day[CACHED_INPUT_TOKENS_KEY] = model_day.get(
+                    CACHED_INPUT_TOKENS_KEY, 0
+                ) + (record.cached_input_tokens or 0)
+                if record.cached_input_tokens and record.first_token_seconds:
+                    _add_sample(
+                        model_day, CACHED_FIRST_TOKEN_METRIC, record.first_token_seconds
+                    )
+
+        retained_days = dict(sorted(days.items())[-HISTOGRAM_RETENTION_DAYS:])
+        try:
+            write_text_atomically(
+                path,
+                json.dumps(
+                    {VERSION_KEY: STATS_FORMAT_VERSION, DAYS_KEY: retained_days}
+                ),
+            )
+        except OSError:
+            return
+
+
+def first_token_percentile(model_id: str, percentile: float) -> float | None:
+    recent_days = sorted(_read_days(cache_file_path(CACHE_FILE_NAME)).items())
+    model_days = [
+        models[model_id]
+        for _day, models in recent_days[-PERCENTILE_WINDOW_DAYS:]
+        if model_id in models
+    ]
+    counts = _merged_counts(model_days, FIRST_TOKEN_METRIC)
+    if sum(counts) < MIN_SAMPLES_FOR_PERCENTILE:
+        return None
+    return _histogram_percentile(counts, METRIC_BUCKETS[FIRST_TOKEN_METRIC], percentile)
+
+
+def format_latency_report() -> str:
+    model_days: dict[str, list[dict[str, Any]]] = {}
+    for _day, models in sorted(_read_days(cache_file_path(CACHE_FILE_NAME)).items()):
+        for model_id, model_day in models.items():
+            model_days.setdefault(model_id, []).append(model_day)
+
+    if not model_days:
+        return "No completions recorded yet."
+
+    lines: list[str] = []
+    for model_id, days in sorted(model_days.items()):
+        generations = sum(day[GENERATIONS_KEY] for day in days)
+        retries = sum(day[TEMPERATURE_RETRIES_KEY] for day in days)
+        lines.append(
+            f"{model_id} ({generations} generations, {retries} temperature retries)"
+        )
+        for metric, label in METRIC_LABELS.items():
+            counts = _merged_counts(days, metric)
+            if not sum(counts):
+                continue
+            lines.append(f"  {label:<15}{_format_percentiles(metric, counts)}")
+        input_tokens = sum(day.get(INPUT_TOKENS_KEY, 0) for day in days)
+        if input_tokens:
+            cached_tokens = sum(day.get(CACHED_INPUT_TOKENS_KEY, 0) for day in days)
+            lines.append(
+                f"  {'cached input':<15}{cached_tokens} of {input_tokens} tokens "
+                f"({cached_tokens / input_tokens:.0%})"
+            )
+    return "\n".join(lines)
+
+
+def _format_percentiles(metric: str, counts: list[int]) -> str:
+    formatted = []
+    for percentile in REPORTED_PERCENTILES:
+        value = _histogram_percentile(counts, METRIC_BUCKETS[metric], percentile)
+        formatted.append(f"p{percentile} {_format_value(metric, value)}")
+    return "  ".join(formatted)
+
+
+def _format_value(metric: str, value: float) -> str:
+    if math.isinf(value):
+        return "max+"
+    if metric in (FIRST_TOKEN_METRIC, CACHED_FIRST_TOKEN_METRIC, STREAM_METRIC):
+        return f"{value:.2f}s"
+    return f"{value:g}"
+
+
+def _model_day(today_models: dict[str, Any], model_id: str) -> dict[str, Any]:
+    return today_models.setdefault(
+        model_id, {GENERATIONS_KEY: 0, TEMPERATURE_RETRIES_KEY: 0}
+    )
+
+
+def _add_sample(model_day: dict[str, Any], metric: str, value: float) -> None:
+    bounds = METRIC_BUCKETS[metric]
+    counts = model_day.get(metric)
+    if not isinstance(counts, list) or len(counts) != len(bounds) + 1:
+        counts = model_day[metric] = [0] * (len(bounds) + 1)
+    counts[bisect.bisect_left(bounds, value)] += 1
+
+
+def _merged_counts(model_days: list[dict[str, Any]], metric: str) -> list[int]:
+    merged = [0] * (len(METRIC_BUCKETS[metric]) + 1)
+    for model_day in model_days:
+        counts = model_day.get(metric)
+        if isinstance(counts, list) and len(counts) == len(merged):
+            merged = [total + count for total, count in zip(merged, counts)]
+    return merged
+
+
+def _histogram_percentile(
+    counts: list[int], bounds: tuple[float, ...], percentile: float
+) -> float:
+    # Reports the upper bound of the bucket holding the requested rank.
+    rank = max(math.ceil(percentile / 100 * sum(counts)), 1)
+    seen = 0
+    for bucket_index, count in enumerate(counts):
+        seen += count
+        if seen >= rank:
+            return bounds[bucket_index] if bucket_index < len(bounds) else math.inf
+    return math.inf
+
+
+def _read_days(path: Path) -> dict[str, dict[str, dict[str, Any]]]:
+    try:
+        stats = json.loads(path.read_text())
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+    if not isinstance(stats, dict) or stats.get(VERSION_KEY) != STATS_FORMAT_VERSION:
+        return {}
+    days = stats.get(DAYS_KEY)
+    if not isinstance(days, dict):
+        return {}
+
+    return {
+        day: {
+            model_id: model_day
+            for model_id, model_day in models.items()
+            if isinstance(model_day, dict)
+            and isinstance(model_day.get(GENERATIONS_KEY), int)
+            and isinstance(model_day.get(TEMPERATURE_RETRIES_KEY), int)
+        }
+        for day, models in days.items()
+        if isinstance(models, dict)
+    }
@@ -3,30 +3,25 @@ import time
 from pathlib import Path
 from typing import Any
 
-from platformdirs import user_cache_dir
+from .atomic_file import cache_file_path, locked, write_text_atomically
 
 
-CACHE_APP_NAME = "llm-complete-command"
 CACHE_FILE_NAME = "model-capabilities.json"
 CACHE_TTL_SECONDS = 30 * 24 * 60 * 60
 MODEL_CAPABILITIES_KEY = "models"
 UPDATED_AT_KEY = "updated_at"
 
+_cache_snapshot: dict[str, Any] | None = None
 
-def _cache_file_path() -> Path:
-    cache_dir = Path(user_cache_dir(CACHE_APP_NAME))
-    cache_dir.mkdir(parents=True, exist_ok=True)
-    return cache_dir / CACHE_FILE_NAME
 
-
-def _read_cache() -> dict[str, Any]:
-    path = _cache_file_path()
+def _read_cache(path: Path | None = None) -> dict[str, Any]:
+    path = path or cache_file_path(CACHE_FILE_NAME)
     if not path.exists():
         return {MODEL_CAPABILITIES_KEY: {}}
 
     try:
         cache = json.loads(path.read_text())
-    except json.JSONDecodeError:
+    except (OSError, json.JSONDecodeError):
         return {MODEL_CAPABILITIES_KEY: {}}
 
     if not isinstance(cache, dict):
@@ -39,13 +34,20 @@ def _read_cache() -> dict[str, Any]:
     return cache
 
 
-def _write_cache(cache: dict[str, Any]) -> None:
-    path = _cache_file_path()
-    path.write_text(json.dumps(cache, indent=2, sort_keys=True) + "\n")
+def _write_cache(cache: dict[str, Any], path: Path | None = None) -> None:
+    path = path or cache_file_path(CACHE_FILE_NAME)
+    write_text_atomically(path, json.dumps(cache, indent=2, sort_keys=True) + "\n")
+
+
+def _cached_snapshot() -> dict[str, Any]:
+    global _cache_snapshot
+    if _cache_snapshot is None:
+        _cache_snapshot = _read_cache()
+    return _cache_snapshot
 
 
 def get_model_capability(model_id: str, capability: str) -> bool | None:
-    cache = _read_cache()
+    cache = _cached_snapshot()
     model_capabilities = cache.get(MODEL_CAPABILITIES_KEY, {})
     if not isinstance(model_capabilities, dict):
         return None
@@ -69,15 +71,23 @@ def get_model_capability(model_id: str, capability: str) -> bool | None:
 
 
 def set_model_capability(model_id: str, capability: str, value: bool) -> None:
-    cache = _read_cache()
-    model_capabilities = cache.setdefault(MODEL_CAPABILITIES_KEY, {})
+    global _cache_snapshot
+    path = cache_file_path(CACHE_FILE_NAME)
 
-    model_entry = model_capabilities.get(model_id)
-    if not isinstance(model_entry, dict):
-        model_entry = {}
+    # Re-read under the lock so updates from other shells since this process
+    # took its snapshot are merged rather than overwritten.
+    with locked(path):
+        cache = _read_cache(path)
+        model_capabilities = cache.setdefault(MODEL_CAPABILITIES_KEY, {})
+
+        model_entry = model_capabilities.get(model_id)
+        if not isinstance(model_entry, dict):
+            model_entry = {}
+
+        model_entry[capability] = value
+        model_entry[UPDATED_AT_KEY] = int(time.time())
+        model_capabilities[model_id] = model_entry
 
-    model_entry[capability] = value
-    model_entry[UPDATED_AT_KEY] = int(time.time())
-    model_capabilities[model_id] = model_entry
+        _write_cache(cache, path)
 
-    _write_cache(cache)
+    _cache_snapshot = cache
@@ -0,0 +1,332 @@
+import json
+import queue
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any
+
+from . import (
+    SUPPORTS_TEMPERATURE_CAPABILITY,
+    ResponseStreamError,
+    _collect_with_spinner,
+    _is_unsupported_temperature_error,
+    _prompt_with_temperature,
+    get_model_capability,
+    set_model_capability,
+)
+from .atomic_file import cache_file_path, locked, write_text_atomically
+from .command_sanitizer import sanitized_chunks
+from .latency_stats import first_token_percentile, timed_chunks
+from .system_prompt_cache import cached_settings
+
+
+CACHE_FILE_NAME = "race-results.json"
+RACE_MODELS_SETTING = "race_models"
+RACE_LABEL_SEPARATOR = " vs "
+RACES_KEY = "races"
+WINS_KEY = "wins"
+HEDGE_AFTER_SECONDS_SETTING = "hedge_after_seconds"
+HEDGE_MODEL_SETTING = "hedge_model"
+ADAPTIVE_HEDGE_DEADLINE = "p95"
+HEDGE_PERCENTILE = 95
+DEFAULT_ADAPTIVE_HEDGE_SECONDS = 5.0
+MIN_HEDGE_SECONDS = 0.5
+
+_STREAM_FINISHED = object()
+
+
+class RaceFailedError(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class HedgePlan:
+    conversation: object
+    delay_seconds: float
+
+
+def plan_hedge(
+    conversation, settings: dict[str, Any] | None = None, key: str | None = None
+) -> HedgePlan | None:
+    if settings is None:
+        settings = cached_settings()
+    model_obj = conversation.model
+    delay_seconds = _hedge_delay_seconds(
+        settings.get(HEDGE_AFTER_SECONDS_SETTING), model_obj.model_id
+    )
+    if delay_seconds is None:
+        return None
+
+    hedge_model_id = settings.get(HEDGE_MODEL_SETTING)
+    if isinstance(hedge_model_id, str) and hedge_model_id != model_obj.model_id:
+        import llm
+
+        model_obj = llm.get_model(hedge_model_id)
+        if model_obj.needs_key:
+            model_obj.key = llm.get_key(key, model_obj.needs_key, model_obj.key_env_var)
+    return HedgePlan(model_obj.conversation(), delay_seconds)
+
+
+def _hedge_delay_seconds(setting, model_id: str) -> float | None:
+    if setting == ADAPTIVE_HEDGE_DEADLINE:
+        # Hedge only on outliers: wait out the model's own p95 once it has one.
+        percentile = first_token_percentile(model_id, HEDGE_PERCENTILE)
+        if percentile is None:
+            return DEFAULT_ADAPTIVE_HEDGE_SECONDS
+        return max(percentile, MIN_HEDGE_SECONDS)
+
+    if isinstance(setting, bool) or not isinstance(setting, (int, float)):
+        return None
+    return max(float(setting), 0.0)
+
+
+def race_model_ids(race_option: str | None) -> list[str]:
+    race_models: Any = race_option
+    if race_models is None:
+        race_models = cached_settings().get(RACE_MODELS_SETTING)
+    if isinstance(race_models, str):
+        race_models = race_models.split(",")
+    if not isinstance(race_models, list):
+        return []
+
+    model_ids: list[str] = []
+    for model_id in race_models:
+        if isinstance(model_id, str) and model_id.strip():
+            if model_id.strip() not in model_ids:
+                model_ids.append(model_id.strip())
+    return model_ids if len(model_ids) > 1 else []
+
+
+def race_command_text(
+    conversations,
+    prompt: str,
+    system: str,
+    write_chunk,
+    collect=None,
+    start_delays=None,
+    record_results=True,
+):
+    collect = collect or _collect_with_spinner
+    start_delays = start_delays or [0.0] * len(conversations)
+    model_ids = [conversation.model.model_id for conversation in conversations]
+    # The spinner names the racers that start right away; a hedge only joins
+    # once its deadline passes.
+    label_ids: list[str] = []
+    for model_id, start_delay in zip(model_ids, start_delays):
+        if start_delay <= 0 and model_id not in label_ids:
+            label_ids.append(model_id)
+    race_label = SimpleNamespace(
+        model=SimpleNamespace(model_id=RACE_LABEL_SEPARATOR.join(label_ids))
+    )
+    chunks: queue.Queue = queue.Queue()
+    cancel_events = [threading.Event() for _ in conversations]
+    winner: list[int] = []
+    responses: dict[int, object] = {}
+
+    for racer_index, conversation in enumerate(conversations):
+        threading.Thread(
+            target=_run_racer,
+            args=(
+                racer_index,
+                conversation,
+                prompt,
+                system,
+                chunks,
+                cancel_events[racer_index],
+                responses,
+                start_delays[racer_index],
+            ),
+            daemon=True,
+        ).start()
+
+    try:
+        generated_text = collect(
+            race_label,
+            _winning_chunks(
+                chunks, len(conversations), winner, cancel_events, responses
+            ),
+            write_chunk,
+        )
+    except ResponseStreamError as stream_error:
+        raise stream_error.original from stream_error.original
+    finally:
+        for cancelled in cancel_events:
+            cancelled.set()
+
+    winning_conversation = conversations[winner[0]]
+    if record_results:
+        record_race_result(model_ids, winning_conversation.model.model_id)
+    return winning_conversation, generated_text
+
+
+def _winning_chunks(
+    chunks: queue.Queue,
+    racer_count: int,
+    winner: list[int],
+    cancel_events: list[threading.Event],
+    responses: dict[int, object],
+):
+    failures: list[Exception] = []
+    while True:
+        racer_index, chunk = chunks.get()
+        if winner and racer_index != winner[0]:
+            continue
+
+        if isinstance(chunk, Exception):
+            if winner:
+                raise chunk
+            failures.append(chunk)
+            if len(failures) == racer_count:
+                raise RaceFailedError("every raced model failed") from failures[0]
+            continue
+
+        if chunk is _STREAM_FINISHED:
+            if winner:
+                return
+            # A model that finished without producing text does not win.
+            failures.append(RaceFailedError("raced model returned no text"))
+            if len(failures) == racer_count:
+                raise RaceFailedError("every raced model failed") from failures[0]
+            continue
+
+        if not winner:
+            winner.append(racer_index)
+            # The first token decides the race, so the losers stop now rather
+            # than once the winner has finished streaming.
+            for loser_index, cancelled in enumerate(cancel_events):
+                if loser_index != racer_index:
+                    cancelled.set()
+                    _close_response(responses.get(loser_index))
+        yield chunk
+
+
+def _run_racer(
+    racer_index: int,
+    conversation,
+    prompt: str,
+    system: str,
+    chunks: queue.Queue,
+    cancelled: threading.Event,
+    responses: dict[int, object],
+    start_delay: float = 0.0,
+) -> None:
+    if start_delay > 0 and cancelled.wait(start_delay):
+        return
+
+    def track_response(response) -> None:
+        responses[racer_index] = response
+        if cancelled.is_set():
+            _close_response(response)
+
+    stream = _stream_racer(conversation, prompt, system, track_response)
+    try:
+        for chunk in stream:
+            if cancelled.is_set():
+                return
+            chunks.put((racer_index, chunk))
+    except Exception as error:
+        chunks.put((racer_index, error))
+        return
+    finally:
+        # Closing the generator closes the model's response iterator, which
+        # ends its HTTP stream.
+        stream.close()
+    chunks.put((racer_index, _STREAM_FINISHED))
+
+
+def _close_response(response) -> None:
+    # llm's sync responses cannot abort a request that is still waiting for
+    # its first token, but responses that offer close or cancel are stopped.
+    close = getattr(response, "close", None) or getattr(response, "cancel", None)
+    if not callable(close):
+        return
+    try:
+        close()
+    except Exception:
+        pass
+
+
+def _stream_racer(conversation, prompt: str, system: str, on_response=None):
+    model_id = conversation.model.model_id
+    supports_temperature = get_model_capability(
+        model_id, SUPPORTS_TEMPERATURE_CAPABILITY
+    )
+    use_temperature = supports_temperature is not False
+    emitted_chunks = 0
+
+    try:
+        response = _prompt_with_temperature(
+            conversation, prompt, system, use_temperature=use_temperature
+        )
+        if on_response is not None:
+            on_response(response)
+        for chunk in timed_chunks(
+            sanitized_chunks(response), model_id, usage_from=response
+        ):
+            emitted_chunks += 1
+            yield chunk
+    except Exception as error:
+        if not (
+            use_temperature
+            and emitted_chunks == 0
+            and _is_unsupported_temperature_error(error)
+        ):
+            raise
+        set_model_capability(model_id, SUPPORTS_TEMPERATURE_CAPABILITY, False)
+        response = _prompt_with_temperature(
+            conversation, prompt, system, use_temperature=False
+        )
+        if on_response is not None:
+            on_response(response)
+        yield from timed_chunks(
+            sanitized_chunks(response),
+            model_id,
+            temperature_retry=True,
+            usage_from=response,
+        )
+        return
+
+    if use_temperature and supports_temperature is None:
+        set_model_capability(model_id, SUPPORTS_TEMPERATURE_CAPABILITY, True)
+
+
+def record_race_result(model_ids: list[str], winner_id: str) -> None:
+    path = cache_file_path(CACHE_FILE_NAME)
+    with locked(path):
+        results = _read_results(path)
+        for model_id in model_ids:
+            model_results = results.setdefault(model_id, {RACES_KEY: 0, WINS_KEY: 0})
+            model_results[RACES_KEY] += 1
+            if model_id == winner_id:
+                model_results[WINS_KEY] += 1
+        try:
+            write_text_atomically(path, json.dumps(results))
+        except OSError:
+            return
+
+
+def race_win_rates() -> dict[str, tuple[int, int]]:
+    return {
+        model_id: (model_results[WINS_KEY], model_results[RACES_KEY])
+        for model_id, model_results in _read_results(
+            cache_file_path(CACHE_FILE_NAME)
+        ).items()
+    }
+
+
+def _read_results(path: Path) -> dict[str, dict[str, int]]:
+    try:
+        results = json.loads(path.read_text())
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+    if not isinstance(results, dict):
+        return {}
+    return {
+        model_id: model_results
+        for model_id, model_results in results.items()
+        if isinstance(model_results, dict)
+        and isinstance(model_results.get(RACES_KEY), int)
+        and isinstance(model_results.get(WINS_KEY), int)
+    }
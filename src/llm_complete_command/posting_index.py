@@ -0,0 +1,169 @@
+import marshal
+import mmap
+import zlib
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+from typing import Any
+
+
+DIRECTORY_BUCKETS = 4096
+ENTRY_TYPECODE = "I"
+
+# Shared by the prompt index and the shell history index. A base file is a
+# marshal header followed by its sections as raw bytes, so a lookup maps the
+# file and only touches the pages it needs; a small marshal delta file holds
+# what changed since. A key's entry ids are its span of `postings`, found in
+# `directory`, whose "\nkey\tstart,end" records are grouped into hash buckets
+# ending at directory_bucket_ends. Ids only grow along a posting list.
+
+
+def init_sections(owner, sections_spec, sections: dict[str, Any]) -> None:
+    # Base sections are read-only views of the mapped file.
+    for name, typecode in sections_spec:
+        section = sections.get(name)
+        if section is None:
+            section = b"" if typecode is None else array(typecode)
+        elif typecode is not None:
+            section = section.cast(typecode)
+        setattr(owner, name, section)
+
+
+def sections_bytes(owner, sections_spec, header: dict[str, Any]) -> bytes:
+    sections = [
+        getattr(owner, name) if typecode is None else getattr(owner, name).tobytes()
+        for name, typecode in sections_spec
+    ]
+    encoded_header = marshal.dumps(
+        {**header, "section_sizes": [len(section) for section in sections]}
+    )
+    return b"".join(
+        [len(encoded_header).to_bytes(8, "little"), encoded_header, *sections]
+    )
+
+
+def map_sections(
+    path: Path, sections_spec, version: int
+) -> tuple[dict[str, Any], dict[str, memoryview]] | None:
+    try:
+        with open(path, "rb") as index_file:
+            mapped = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+    # The views keep the mapping alive after the file is closed.
+    view = memoryview(mapped)
+    try:
+        header_end = 8 + int.from_bytes(view[:8], "little")
+        header = marshal.loads(view[8:header_end])
+        section_sizes = header["section_sizes"]
+        if (
+            header.get("version") != version
+            or len(section_sizes) != len(sections_spec)
+            or header_end + sum(section_sizes) != len(view)
+        ):
+            return None
+    except (EOFError, ValueError, TypeError, KeyError):
+        return None
+
+    sections = {}
+    position = header_end
+    for (name, _typecode), size in zip(sections_spec, section_sizes):
+        sections[name] = view[position : position + size]
+        position += size
+    return header, sections
+
+
+def read_marshal(path: Path, version: int) -> dict[str, Any] | None:
+    try:
+        data = marshal.loads(path.read_bytes())
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+
+    if not isinstance(data, dict) or data.get("version") != version:
+        return None
+    return data
+
+
+def posting_span(
+    directory, directory_bucket_ends: array, key: bytes
+) -> tuple[int, int] | None:
+    if not directory_bucket_ends:
+        return None
+    bucket = _directory_bucket(key)
+    bucket_start = directory_bucket_ends[bucket - 1] if bucket else 0
+    # Only this bucket of the directory is copied out of the mapping.
+    records = bytes(directory[bucket_start : directory_bucket_ends[bucket]])
+    found = records.find(b"\n" + key + b"\t")
+    if found == -1:
+        return None
+    span_start = found + len(key) + 2
+    span_end = records.find(b"\n", span_start)
+    if span_end == -1:
+        span_end = len(records)
+    start, end = records[span_start:span_end].split(b",")
+    return int(start), int(end)
+
+
+def posting_ids(postings, span: tuple[int, int] | None) -> array:
+    ids = array(ENTRY_TYPECODE)
+    if span is not None:
+        ids.frombytes(postings[span[0] : span[1]])
+    return ids
+
+
+def merge_postings(
+    directory, postings, new_postings: dict[bytes, bytes], live_from: int = 0
+) -> tuple[bytes, bytes, array]:
+    # Returns the directory, postings and directory_bucket_ends holding both
+    # the base and the new postings, without ids below live_from.
+    merged: dict[bytes, bytes] = {}
+    for record in bytes(directory).split(b"\n"):
+        if not record:
+            continue
+        key, span = record.split(b"\t")
+        start, end = span.split(b",")
+        merged[key] = _live_ids(postings[int(start) : int(end)], live_from)
+    for key, encoded_ids in new_postings.items():
+        merged[key] = merged.get(key, b"") + _live_ids(encoded_ids, live_from)
+
+    buckets: list[list[bytes]] = [[] for _ in range(DIRECTORY_BUCKETS)]
+    for key, encoded_ids in merged.items():
+        if encoded_ids:
+            buckets[_directory_bucket(key)].append(key)
+
+    merged_directory: list[bytes] = []
+    merged_postings: list[bytes] = []
+    directory_bucket_ends = array(ENTRY_TYPECODE)
+    directory_size = postings_size = 0
+    for bucket_keys in buckets:
+        for key in bucket_keys:
+            encoded_ids = merged[key]
+            record = b"\n%s\t%d,%d" % (
+                key,
+                postings_size,
+                postings_size + len(encoded_ids),
+            )
+            merged_directory.append(record)
+            merged_postings.append(encoded_ids)
+            directory_size += len(record)
+            postings_size += len(encoded_ids)
+        directory_bucket_ends.append(directory_size)
+    return (
+        b"".join(merged_directory),
+        b"".join(merged_postings),
+        directory_bucket_ends,
+    )
+
+
+def _live_ids(encoded_ids, live_from: int) -> bytes:
+    if not live_from:
+        return bytes(encoded_ids)
+    ids = array(ENTRY_TYPECODE)
+    ids.frombytes(encoded_ids)
+    # Dropped entries have the lowest ids, so they are a prefix of each list.
+    return ids[bisect_left(ids, live_from) :].tobytes()
+
+
+def _directory_bucket(key: bytes) -> int:
+    return zlib.crc32(key) % DIRECTORY_BUCKETS
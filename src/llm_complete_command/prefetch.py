@@ -0,0 +1,97 @@
+import json
+import time
+from pathlib import Path
+
+from . import _collect_without_spinner, _generate_command_text
+from .atomic_file import cache_file_path, locked, write_text_atomically
+from .latency_stats import flush_latency_records
+from .request_context import request_context_key, with_request_context
+from .response_cache import (
+    get_cached_response,
+    get_prefetched_response,
+    normalize_prompt,
+    response_cache_key,
+    store_prefetched_response,
+)
+from .system_prompt_cache import cached_settings
+
+
+BUDGET_FILE_NAME = "prefetch-budget.json"
+STARTED_AT_KEY = "started_at"
+PREFETCH_REQUESTS_PER_MINUTE_SETTING = "prefetch_requests_per_minute"
+DEFAULT_PREFETCH_REQUESTS_PER_MINUTE = 6
+PREFETCH_BUDGET_WINDOW_SECONDS = 60
+PREFETCH_MIN_PROMPT_LENGTH = 8
+
+# The shell integrations debounce typing and kill a pending prefetch when the
+# buffer changes, so this only has to skip work that is not worth a request.
+
+
+def prefetch_completion(conversation, prompt: str, system: str) -> bool:
+    if len(normalize_prompt(prompt)) < PREFETCH_MIN_PROMPT_LENGTH:
+        return False
+
+    key = response_cache_key(
+        conversation.model.model_id, system, prompt, request_context_key()
+    )
+    if get_cached_response(key) is not None or get_prefetched_response(key) is not None:
+        return False
+
+    if not _reserve_budget(_requests_per_minute()):
+        return False
+
+    command = _generate_command_text(
+        conversation,
+        prompt,
+        with_request_context(system, prompt),
+        write_chunk=lambda _chunk: None,
+        collect=_collect_without_spinner,
+    )
+    store_prefetched_response(key, command)
+    flush_latency_records()
+    return True
+
+
+def _requests_per_minute() -> int:
+    requests_per_minute = cached_settings().get(PREFETCH_REQUESTS_PER_MINUTE_SETTING)
+    if isinstance(requests_per_minute, bool) or not isinstance(
+        requests_per_minute, int
+    ):
+        return DEFAULT_PREFETCH_REQUESTS_PER_MINUTE
+    return max(requests_per_minute, 0)
+
+
+def _reserve_budget(requests_per_minute: int) -> bool:
+    path = cache_file_path(BUDGET_FILE_NAME)
+    now = time.time()
+    with locked(path):
+        recent_starts = [
+            started_at
+            for started_at in _read_starts(path)
+            if now - started_at < PREFETCH_BUDGET_WINDOW_SECONDS
+        ]
+        if len(recent_starts) >= requests_per_minute:
+            return False
+
+        recent_starts.append(now)
+        try:
+            write_text_atomically(path, json.dumps({STARTED_AT_KEY: recent_starts}))
+        except OSError:
+            return False
+    return True
+
+
+def _read_starts(path: Path) -> list[float]:
+    try:
+        budget = json.loads(path.read_text())
+    except (OSError, json.JSONDecodeError):
+        return []
+
+    starts = budget.get(STARTED_AT_KEY) if isinstance(budget, dict) else None
+    if not isinstance(starts, list):
+        return []
+    return [
+        started_at
+        for started_at in starts
+        if isinstance(started_at, (int, float)) and not isinstance(started_at, bool)
+    ]
@@ -0,0 +1,359 @@
+import hashlib
+import marshal
+import math
+import os
+from array import array
+from collections import Counter
+from pathlib import Path
+
+from .atomic_file import cache_file_path, locked, write_bytes_atomically
+from .posting_index import (
+    ENTRY_TYPECODE,
+    init_sections,
+    map_sections,
+    merge_postings,
+    posting_ids,
+    posting_span,
+    read_marshal,
+    sections_bytes,
+)
+from .response_cache import normalize_prompt
+
+
+CACHE_FILE_NAME = "prompt-index.bin"
+DELTA_FILE_NAME = "prompt-index.delta"
+INDEX_FORMAT_VERSION = 3
+PROMPT_INDEX_MAX_ENTRIES = 50_000
+SUGGESTION_MIN_SIMILARITY = 0.6
+# Accepted completions go to a small delta file, so accepting one does not
+# rewrite the whole index. The delta is merged in once it holds this many
+# posting bytes or changed entries.
+DELTA_MERGE_POSTING_BYTES = 64 * 1024
+DELTA_MERGE_CHANGED_ENTRIES = 256
+OFFSET_TYPECODE = "Q"
+
+# Index layout: entries have ids that are never reused, and the base holds
+# ids first_id onwards. Entry first_id + i has trigram_counts[i], the digest
+# of the request context it was accepted in at contexts[i], and its prompt and
+# command end at prompt_ends[i] and command_ends[i] in the UTF-8 prompt_text
+# and command_text, where the entry before it ends. Each trigram has a
+# posting list of entry ids, stored as posting_index describes.
+#
+# The delta file holds what changed since the base was written: new entries
+# with their postings, new commands for base entries, and live_from, the
+# oldest id still kept. It names the base generation it extends and is
+# ignored after any other merge.
+SECTIONS = (
+    ("trigram_counts", ENTRY_TYPECODE),
+    ("prompt_ends", OFFSET_TYPECODE),
+    ("command_ends", OFFSET_TYPECODE),
+    ("contexts", OFFSET_TYPECODE),
+    ("directory_bucket_ends", ENTRY_TYPECODE),
+    ("prompt_text", None),
+    ("command_text", None),
+    ("directory", None),
+    ("postings", None),
+)
+
+
+class PromptIndex:
+    def __init__(self, header=None, sections=None, delta=None):
+        header = header or {}
+        self.generation: int = header.get("generation", 0)
+        self.first_id: int = header.get("first_id", 0)
+        init_sections(self, SECTIONS, sections or {})
+        self.base_count = len(self.trigram_counts)
+
+        if not delta or delta.get("generation") != self.generation:
+            delta = {}
+        self.live_from: int = delta.get("live_from", self.first_id)
+        self.new_prompts: list[str] = delta.get("new_prompts", [])
+        self.new_commands: list[str] = delta.get("new_commands", [])
+        self.new_trigram_counts = array(ENTRY_TYPECODE)
+        self.new_trigram_counts.frombytes(delta.get("new_trigram_counts", b""))
+        self.new_contexts = array(OFFSET_TYPECODE)
+        self.new_contexts.frombytes(delta.get("new_contexts", b""))
+        self.changed: dict[int, str] = delta.get("changed", {})
+        self.new_postings: dict[str, array] = {
+            trigram: array(ENTRY_TYPECODE, encoded_ids)
+            for trigram, encoded_ids in delta.get("new_postings", {}).items()
+        }
+
+    @property
+    def prompts(self) -> list[str]:
+        return [self._prompt(entry_id) for entry_id in self._live_ids()]
+
+    def add(self, prompt: str, command: str, context_key: str = "") -> None:
+        prompt = normalize_prompt(prompt)
+        trigrams = _trigrams(prompt)
+        context = _context_digest(context_key)
+        existing_id = self._entry_for_prompt(prompt, trigrams, context)
+        if existing_id is not None:
+            new_id = existing_id - self.first_id - self.base_count
+            if new_id >= 0:
+                self.new_commands[new_id] = command
+            else:
+                self.changed[existing_id] = command
+            return
+
+        entry_id = self._next_id()
+        self.new_prompts.append(prompt)
+        self.new_commands.append(command)
+        self.new_trigram_counts.append(len(trigrams))
+        self.new_contexts.append(context)
+        for trigram in trigrams:
+            self.new_postings.setdefault(trigram, array(ENTRY_TYPECODE)).append(
+                entry_id
+            )
+
+        if self._next_id() - self.live_from > PROMPT_INDEX_MAX_ENTRIES:
+            # Dropped entries stay in the files, skipped, until the next merge.
+            self.live_from = self._next_id() - PROMPT_INDEX_MAX_ENTRIES
+            self.changed = {
+                changed_id: changed_command
+                for changed_id, changed_command in self.changed.items()
+                if changed_id >= self.live_from
+            }
+
+    def find_similar(
+        self, prompt: str, context_key: str = ""
+    ) -> tuple[str, str] | None:
+        query_trigrams = _trigrams(normalize_prompt(prompt))
+        if not query_trigrams:
+            return None
+        context = _context_digest(context_key)
+
+        # Prefix filter: an entry reaching the similarity threshold must share
+        # at least one of the rarest trigrams, so the long posting lists of
+        # common trigrams are never read.
+        query_size = len(query_trigrams)
+        required_shared = math.ceil(SUGGESTION_MIN_SIMILARITY * query_size)
+        prefix_size = query_size - required_shared + 1
+        rarest_trigrams = sorted(query_trigrams, key=self._posting_length)[:prefix_size]
+
+        prefix_hits: Counter[int] = Counter()
+        for trigram in rarest_trigrams:
+            prefix_hits.update(self._posting_ids(trigram))
+
+        best_id = None
+        best_similarity = SUGGESTION_MIN_SIMILARITY
+        unchecked_size = query_size - prefix_size
+        for entry_id, hits in prefix_hits.most_common():
+            if entry_id < self.live_from or self._context(entry_id) != context:
+                continue
+            entry_size = self._trigram_count(entry_id)
+            if (hits + unchecked_size) / max(query_size, entry_size) < best_similarity:
+                continue
+
+            shared = len(query_trigrams & _trigrams(self._prompt(entry_id)))
+            similarity = shared / (query_size + entry_size - shared)
+            if similarity >= best_similarity:
+                best_id, best_similarity = entry_id, similarity
+                if similarity == 1:
+                    break
+
+        if best_id is None:
+            return None
+        return self._prompt(best_id), self._command(best_id)
+
+    def needs_merge(self) -> bool:
+        return (
+            sum(map(len, self.new_postings.values())) * 4 > DELTA_MERGE_POSTING_BYTES
+            or len(self.new_prompts) + len(self.changed) > DELTA_MERGE_CHANGED_ENTRIES
+        )
+
+    def merge(self) -> None:
+        live_ids = self._live_ids()
+        trigram_counts = array(ENTRY_TYPECODE)
+        prompt_ends = array(OFFSET_TYPECODE)
+        command_ends = array(OFFSET_TYPECODE)
+        contexts = array(OFFSET_TYPECODE)
+        prompt_text: list[bytes] = []
+        command_text: list[bytes] = []
+        prompt_size = command_size = 0
+        for entry_id in live_ids:
+            encoded_prompt = self._prompt(entry_id).encode("utf-8")
+            encoded_command = self._command(entry_id).encode("utf-8")
+            prompt_size += len(encoded_prompt)
+            command_size += len(encoded_command)
+            trigram_counts.append(self._trigram_count(entry_id))
+            contexts.append(self._context(entry_id))
+            prompt_ends.append(prompt_size)
+            command_ends.append(command_size)
+            prompt_text.append(encoded_prompt)
+            command_text.append(encoded_command)
+        self._merge_postings()
+
+        self.trigram_counts = trigram_counts
+        self.contexts = contexts
+        self.prompt_ends, self.command_ends = prompt_ends, command_ends
+        self.prompt_text = b"".join(prompt_text)
+        self.command_text = b"".join(command_text)
+        self.first_id = live_ids.start
+        self.base_count = len(live_ids)
+        self.generation = int.from_bytes(os.urandom(8), "little")
+        self.new_prompts = []
+        self.new_commands = []
+        self.new_trigram_counts = array(ENTRY_TYPECODE)
+        self.new_contexts = array(OFFSET_TYPECODE)
+        self.changed = {}
+        self.new_postings = {}
+
+    def base_bytes(self) -> bytes:
+        return sections_bytes(
+            self,
+            SECTIONS,
+            {
+                "version": INDEX_FORMAT_VERSION,
+                "generation": self.generation,
+                "first_id": self.first_id,
+            },
+        )
+
+    def delta_bytes(self) -> bytes:
+        return marshal.dumps(
+            {
+                "version": INDEX_FORMAT_VERSION,
+                "generation": self.generation,
+                "live_from": self.live_from,
+                "new_prompts": self.new_prompts,
+                "new_commands": self.new_commands,
+                "new_trigram_counts": self.new_trigram_counts.tobytes(),
+                "new_contexts": self.new_contexts.tobytes(),
+                "changed": self.changed,
+                "new_postings": {
+                    trigram: entry_ids.tobytes()
+                    for trigram, entry_ids in self.new_postings.items()
+                },
+            }
+        )
+
+    def _next_id(self) -> int:
+        return self.first_id + self.base_count + len(self.new_prompts)
+
+    def _live_ids(self) -> range:
+        return range(self.live_from, self._next_id())
+
+    def _entry_for_prompt(
+        self, prompt: str, trigrams: set[str], context: int
+    ) -> int | None:
+        if not trigrams:
+            return None
+        # The same prompt has the same trigrams, so only entries on the
+        # shortest of their posting lists can hold it.
+        rarest_trigram = min(trigrams, key=self._posting_length)
+        for entry_id in self._posting_ids(rarest_trigram):
+            if (
+                entry_id >= self.live_from
+                and self._trigram_count(entry_id) == len(trigrams)
+                and self._context(entry_id) == context
+                and self._prompt(entry_id) == prompt
+            ):
+                return entry_id
+        return None
+
+    def _prompt(self, entry_id: int) -> str:
+        base_id = entry_id - self.first_id
+        if base_id >= self.base_count:
+            return self.new_prompts[base_id - self.base_count]
+        return _text_at(self.prompt_text, self.prompt_ends, base_id)
+
+    def _command(self, entry_id: int) -> str:
+        base_id = entry_id - self.first_id
+        if base_id >= self.base_count:
+            return self.new_commands[base_id - self.base_count]
+        changed = self.changed.get(entry_id)
+        if changed is not None:
+            return changed
+        return _text_at(self.command_text, self.command_ends, base_id)
+
+    def _trigram_count(self, entry_id: int) -> int:
+        base_id = entry_id - self.first_id
+        if base_id >= self.base_count:
+            return self.new_trigram_counts[base_id - self.base_count]
+        return self.trigram_counts[base_id]
+
+    def _context(self, entry_id: int) -> int:
+        base_id = entry_id - self.first_id
+        if base_id >= self.base_count:
+            return self.new_contexts[base_id - self.base_count]
+        return self.contexts[base_id]
+
+    def _posting_length(self, trigram: str) -> int:
+        span = self._posting_span(trigram)
+        base_length = 0 if span is None else span[1] - span[0]
+        return base_length // 4 + len(self.new_postings.get(trigram, ()))
+
+    def _posting_ids(self, trigram: str) -> array:
+        ids = posting_ids(self.postings, self._posting_span(trigram))
+        ids.extend(self.new_postings.get(trigram, ()))
+        return ids
+
+    def _posting_span(self, trigram: str) -> tuple[int, int] | None:
+        return posting_span(
+            self.directory, self.directory_bucket_ends, trigram.encode("utf-8")
+        )
+
+    def _merge_postings(self) -> None:
+        self.directory, self.postings, self.directory_bucket_ends = merge_postings(
+            self.directory,
+            self.postings,
+            {
+                trigram.encode("utf-8"): ids.tobytes()
+                for trigram, ids in self.new_postings.items()
+            },
+            self.live_from,
+        )
+
+
+def find_similar_completion(
+    prompt: str, context_key: str = ""
+) -> tuple[str, str] | None:
+    return load_prompt_index(cache_file_path(CACHE_FILE_NAME)).find_similar(
+        prompt, context_key
+    )
+
+
+def add_accepted_completion(prompt: str, command: str, context_key: str = "") -> None:
+    if not normalize_prompt(prompt) or not command.strip():
+        return
+
+    path = cache_file_path(CACHE_FILE_NAME)
+    with locked(path):
+        index = load_prompt_index(path)
+        index.add(prompt, command, context_key)
+        try:
+            if index.needs_merge():
+                index.merge()
+                write_bytes_atomically(path, index.base_bytes())
+            write_bytes_atomically(_delta_path(path), index.delta_bytes())
+        except OSError:
+            return
+
+
+def load_prompt_index(path: Path) -> PromptIndex:
+    delta = read_marshal(_delta_path(path), INDEX_FORMAT_VERSION)
+    mapped = map_sections(path, SECTIONS, INDEX_FORMAT_VERSION)
+    if mapped is None:
+        return PromptIndex(delta=delta)
+    header, sections = mapped
+    return PromptIndex(header, sections, delta)
+
+
+def _delta_path(path: Path) -> Path:
+    return path.with_name(DELTA_FILE_NAME)
+
+
+def _text_at(text, ends: array, base_id: int) -> str:
+    start = ends[base_id - 1] if base_id else 0
+    return bytes(text[start : ends[base_id]]).decode("utf-8")
+
+
+def _context_digest(context_key: str) -> int:
+    digest = hashlib.blake2b(context_key.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def _trigrams(prompt: str) -> set[str]:
+    padded = f"  {prompt.lower()} "
+    return {padded[index : index + 3] for index in range(len(padded) - 2)}
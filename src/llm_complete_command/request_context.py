@@ -0,0 +1,57 @@
+import os
+from typing import Any
+
+from .git_context import GIT_CONTEXT_SETTING, git_context, git_head_name
+from .shell_history import shell_history_context
+from .system_prompt_cache import cached_settings
+from .working_directory import (
+    WORKING_DIRECTORY_CONTEXT_SETTING,
+    working_directory_context,
+)
+
+
+# Context gathered for one request goes after the system prompt, so the cached
+# prefix of stable instructions is the same for every request. The response
+# cache and the prompt index are keyed by the bare system prompt plus
+# request_context_key, so a command generated for one directory or branch is
+# not replayed in another. The daemon
+# serves clients in other directories, so they send their working directory
+# and history file along. Settings are passed down so every section reads the
+# same copy.
+
+
+def with_request_context(
+    system: str,
+    prompt: str,
+    cwd: str | None = None,
+    settings: dict[str, Any] | None = None,
+    histfile: str | None = None,
+) -> str:
+    if settings is None:
+        settings = cached_settings()
+    sections = [
+        section
+        for section in (
+            working_directory_context(cwd, settings),
+            git_context(cwd, settings),
+            shell_history_context(prompt, settings, histfile),
+        )
+        if section
+    ]
+    return "\n\n".join([system, *sections])
+
+
+def request_context_key(
+    cwd: str | None = None, settings: dict[str, Any] | None = None
+) -> str:
+    if settings is None:
+        settings = cached_settings()
+    parts: list[str] = []
+    if settings.get(WORKING_DIRECTORY_CONTEXT_SETTING) is not False:
+        try:
+            parts.append(os.path.abspath(cwd or os.getcwd()))
+        except OSError:
+            pass
+    if settings.get(GIT_CONTEXT_SETTING) is not False:
+        parts.append(git_head_name(cwd))
+    return "\n".join(part for part in parts if part)
@@ -0,0 +1,163 @@
+import hashlib
+import json
+import time
+from pathlib import Path
+from typing import Any
+
+from .atomic_file import cache_file_path, locked, write_text_atomically
+
+
+CACHE_FILE_NAME = "responses.json"
+RESPONSE_CACHE_MAX_ENTRIES = 500
+RESPONSE_CACHE_TTL_SECONDS = 30 * 24 * 60 * 60
+# Prefetched commands were never accepted, so they are kept apart from the
+# accepted ones and only for as long as the user may still be typing.
+PREFETCH_CACHE_FILE_NAME = "prefetched-responses.json"
+PREFETCH_CACHE_MAX_ENTRIES = 32
+PREFETCH_CACHE_TTL_SECONDS = 10 * 60
+ENTRIES_KEY = "entries"
+COMMAND_KEY = "command"
+CREATED_AT_KEY = "created_at"
+LAST_USED_AT_KEY = "last_used_at"
+# A hit only rewrites the file when the entry's last use is older than this,
+# which is plenty of resolution for choosing what to evict.
+LAST_USED_UPDATE_INTERVAL_SECONDS = 60 * 60
+
+
+def normalize_prompt(prompt: str) -> str:
+    return " ".join(prompt.split())
+
+
+def response_cache_key(
+    model_id: str, system: str, prompt: str, context_key: str = ""
+) -> str:
+    system_hash = hashlib.sha256(system.encode("utf-8")).hexdigest()
+    key_material = json.dumps(
+        [model_id, system_hash, normalize_prompt(prompt), context_key]
+    )
+    return hashlib.sha256(key_material.encode("utf-8")).hexdigest()
+
+
+def get_cached_response(key: str) -> str | None:
+    return _get_response(
+        cache_file_path(CACHE_FILE_NAME), key, RESPONSE_CACHE_TTL_SECONDS
+    )
+
+
+def store_response(key: str, command: str) -> None:
+    _store_response(
+        cache_file_path(CACHE_FILE_NAME),
+        key,
+        command,
+        RESPONSE_CACHE_TTL_SECONDS,
+        RESPONSE_CACHE_MAX_ENTRIES,
+    )
+
+
+def get_prefetched_response(key: str) -> str | None:
+    return _get_response(
+        cache_file_path(PREFETCH_CACHE_FILE_NAME), key, PREFETCH_CACHE_TTL_SECONDS
+    )
+
+
+def store_prefetched_response(key: str, command: str) -> None:
+    _store_response(
+        cache_file_path(PREFETCH_CACHE_FILE_NAME),
+        key,
+        command,
+        PREFETCH_CACHE_TTL_SECONDS,
+        PREFETCH_CACHE_MAX_ENTRIES,
+    )
+
+
+def _get_response(path: Path, key: str, ttl_seconds: int) -> str | None:
+    entry = _read_entries(path).get(key)
+    if entry is None or not _is_live(entry, ttl_seconds):
+        return None
+    if int(time.time()) - entry[LAST_USED_AT_KEY] >= LAST_USED_UPDATE_INTERVAL_SECONDS:
+        _mark_used(path, key)
+    return entry[COMMAND_KEY]
+
+
+def _mark_used(path: Path, key: str) -> None:
+    with locked(path):
+        entries = _read_entries(path)
+        entry = entries.get(key)
+        if entry is None:
+            return
+        entry[LAST_USED_AT_KEY] = int(time.time())
+        _write_entries(path, entries)
+
+
+def _store_response(
+    path: Path, key: str, command: str, ttl_seconds: int, max_entries: int
+) -> None:
+    if not command.strip():
+        return
+
+    now = int(time.time())
+    with locked(path):
+        entries = {
+            entry_key: entry
+            for entry_key, entry in _read_entries(path).items()
+            if _is_live(entry, ttl_seconds)
+        }
+        # Storing the same command again counts as a use but does not extend
+        # its TTL, so a command replayed every day still ages out.
+        previous = entries.get(key)
+        created_at = (
+            previous[CREATED_AT_KEY]
+            if previous is not None and previous[COMMAND_KEY] == command
+            else now
+        )
+        entries[key] = {
+            COMMAND_KEY: command,
+            CREATED_AT_KEY: created_at,
+            LAST_USED_AT_KEY: now,
+        }
+        _write_entries(path, _evict_least_recently_used(entries, max_entries))
+
+
+def _is_live(entry: dict[str, Any], ttl_seconds: int) -> bool:
+    return int(time.time()) - entry[CREATED_AT_KEY] <= ttl_seconds
+
+
+def _evict_least_recently_used(
+    entries: dict[str, dict[str, Any]], max_entries: int
+) -> dict[str, dict[str, Any]]:
+    if len(entries) <= max_entries:
+        return entries
+
+    most_recent = sorted(
+        entries.items(),
+        key=lambda item: item[1][LAST_USED_AT_KEY],
+        reverse=True,
+    )[:max_entries]
+    return dict(most_recent)
+
+
+def _read_entries(path: Path) -> dict[str, dict[str, Any]]:
+    try:
+        cache = json.loads(path.read_text())
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+    entries = cache.get(ENTRIES_KEY) if isinstance(cache, dict) else None
+    if not isinstance(entries, dict):
+        return {}
+
+    return {
+        key: entry
+        for key, entry in entries.items()
+        if isinstance(entry, dict)
+        and isinstance(entry.get(COMMAND_KEY), str)
+        and isinstance(entry.get(CREATED_AT_KEY), int)
+        and isinstance(entry.get(LAST_USED_AT_KEY), int)
+    }
+
+
+def _write_entries(path: Path, entries: dict[str, dict[str, Any]]) -> None:
+    try:
+        write_text_atomically(path, json.dumps({ENTRIES_KEY: entries}))
+    except OSError:
+        return
@@ -0,0 +1,529 @@
+import hashlib
+import heapq
+import marshal
+import math
+import mmap
+import os
+import re
+from array import array
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any
+
+from .atomic_file import cache_file_path, locked, write_bytes_atomically
+from .environment_config import spawn_background_refresh
+from .posting_index import (
+    ENTRY_TYPECODE,
+    init_sections,
+    map_sections,
+    merge_postings,
+    posting_ids,
+    posting_span,
+    read_marshal,
+    sections_bytes,
+)
+from .system_prompt_cache import cached_settings
+
+
+# Each history file has an index of its own, named by a digest of its path,
+# so switching between shells does not rebuild one shared index.
+CACHE_FILE_NAME = "shell-history-index-{}.bin"
+DELTA_FILE_NAME = "shell-history-index-{}.delta"
+INDEX_FORMAT_VERSION = 1
+HISTORY_CONTEXT_SETTING = "history_context"
+HISTORY_FILE_SETTING = "history_file"
+HISTORY_CONTEXT_HEADER = "Relevant commands from the user's shell history:"
+HISTORY_CONTEXT_MAX_COMMANDS = 5
+HISTORY_CONTEXT_MAX_CHARACTERS = 600
+HISTORY_COMMAND_MAX_CHARACTERS = 200
+# Only the newest ids of a common token are scored, which bounds retrieval time
+# however long the history grows.
+MAX_SCORED_POSTINGS = 512
+RANKED_CANDIDATES = 32
+# Commands indexed since the last merge go to a small delta file, so appending
+# a few commands does not rewrite the whole index. The delta is merged in once
+# it holds this many posting bytes or changed entries.
+DELTA_MERGE_POSTING_BYTES = 64 * 1024
+DELTA_MERGE_CHANGED_ENTRIES = 4096
+MIN_SHAPE_SLOTS = 1024
+# A rewritten history longer than this is indexed by the background refresh.
+FOREGROUND_REBUILD_BYTES = 256 * 1024
+TAIL_CHECK_BYTES = 64
+MIN_TOKEN_BYTES = 2
+MAX_TOKEN_BYTES = 64
+START_TYPECODE = "Q"
+SHAPE_KEY_TYPECODE = "Q"
+
+TOKEN_PATTERN = re.compile(rb"[a-z0-9]+")
+DIGITS_PATTERN = re.compile(rb"\d+")
+ZSH_EXTENDED_PREFIX = re.compile(rb": \d+:\d+;")
+BASH_TIMESTAMP_LINE = re.compile(rb"#\d+")
+FISH_COMMAND_PREFIX = re.compile(rb"- cmd: ")
+# zsh escapes bytes above 0x7f as a marker byte followed by the byte xor 32.
+ZSH_META_BYTE = 0x83
+
+# Index layout: entry i is the latest use of one command shape (the command
+# with its numbers blanked), whose text spans starts[i]:starts[i] + lengths[i]
+# in the history file, and last_used[i] orders entries by recency. shape_slots
+# is an open-addressing table from shape key to entry id. Each token has a
+# posting list of entry ids, stored as posting_index describes.
+#
+# The delta file holds what changed since the base was written: entries for new
+# shapes, newer spans of base entries, and the postings of new entries. It
+# names the base generation it extends and is ignored after any other merge.
+# The history file is indexed up to `offset`, and `tail` holds the bytes just
+# before it, so an appended file is read from there and a rewritten one is
+# indexed again.
+SECTIONS = (
+    ("starts", START_TYPECODE),
+    ("lengths", ENTRY_TYPECODE),
+    ("last_used", ENTRY_TYPECODE),
+    ("shape_slots", SHAPE_KEY_TYPECODE),
+    ("shape_slot_ids", ENTRY_TYPECODE),
+    ("directory_bucket_ends", ENTRY_TYPECODE),
+    ("directory", None),
+    ("postings", None),
+)
+
+
+class ShellHistoryIndex:
+    def __init__(self, header=None, sections=None, delta=None):
+        header = header or {}
+        self.generation: int = header.get("generation", 0)
+        init_sections(self, SECTIONS, sections or {})
+        self.base_count = len(self.starts)
+
+        if not delta or delta.get("generation") != self.generation:
+            delta = header
+        self.path: str = delta.get("path", "")
+        self.inode: int = delta.get("inode", 0)
+        self.offset: int = delta.get("offset", 0)
+        self.tail: bytes = delta.get("tail", b"")
+        self.commands_seen: int = delta.get("commands_seen", 0)
+        self.new_starts = array(START_TYPECODE, delta.get("new_starts", b""))
+        self.new_lengths = array(ENTRY_TYPECODE, delta.get("new_lengths", b""))
+        self.new_last_used = array(ENTRY_TYPECODE, delta.get("new_last_used", b""))
+        self.changed: dict[int, tuple[int, int, int]] = delta.get("changed", {})
+        self.new_shapes: dict[int, int] = delta.get("new_shapes", {})
+        self.new_postings: dict[bytes, bytes] = delta.get("new_postings", {})
+
+    def matches(self, path: Path, stat: os.stat_result, history: mmap.mmap) -> bool:
+        return (
+            self.path == str(path)
+            and self.inode == stat.st_ino
+            and self.offset <= len(history)
+            and history[max(self.offset - TAIL_CHECK_BYTES, 0) : self.offset]
+            == self.tail
+        )
+
+    def update(self, history: mmap.mmap, fish: bool) -> bool:
+        end = history.rfind(b"\n", self.offset) + 1
+        if end <= self.offset:
+            return False
+
+        added: dict[bytes, array] = {}
+        for start, length in _command_spans(history, self.offset, end, fish):
+            command = history[start : start + length]
+            shape_key = _shape_key(command)
+            entry_id = self._entry_for_shape(shape_key)
+            if entry_id is None:
+                entry_id = self.new_shapes[shape_key] = self._entry_count()
+                self.new_starts.append(start)
+                self.new_lengths.append(length)
+                self.new_last_used.append(self.commands_seen)
+                for token in set(TOKEN_PATTERN.findall(command.lower())):
+                    if MIN_TOKEN_BYTES <= len(token) <= MAX_TOKEN_BYTES:
+                        ids = added.get(token)
+                        if ids is None:
+                            ids = added[token] = array(
+                                ENTRY_TYPECODE, self.new_postings.get(token, b"")
+                            )
+                        ids.append(entry_id)
+            elif entry_id >= self.base_count:
+                new_id = entry_id - self.base_count
+                self.new_starts[new_id] = start
+                self.new_lengths[new_id] = length
+                self.new_last_used[new_id] = self.commands_seen
+            else:
+                self.changed[entry_id] = (start, length, self.commands_seen)
+            self.commands_seen += 1
+
+        for token, ids in added.items():
+            self.new_postings[token] = ids.tobytes()
+        self.offset = end
+        self.tail = history[max(end - TAIL_CHECK_BYTES, 0) : end]
+        return True
+
+    def needs_merge(self) -> bool:
+        return (
+            sum(map(len, self.new_postings.values())) > DELTA_MERGE_POSTING_BYTES
+            or len(self.changed) + len(self.new_starts) > DELTA_MERGE_CHANGED_ENTRIES
+        )
+
+    def merge(self) -> None:
+        starts = array(START_TYPECODE, self.starts.tobytes())
+        lengths = array(ENTRY_TYPECODE, self.lengths.tobytes())
+        last_used = array(ENTRY_TYPECODE, self.last_used.tobytes())
+        for entry_id, (start, length, used_at) in self.changed.items():
+            starts[entry_id] = start
+            lengths[entry_id] = length
+            last_used[entry_id] = used_at
+        starts.extend(self.new_starts)
+        lengths.extend(self.new_lengths)
+        last_used.extend(self.new_last_used)
+        self._merge_shape_slots(len(starts))
+        self._merge_postings()
+
+        self.starts, self.lengths, self.last_used = starts, lengths, last_used
+        self.base_count = len(starts)
+        self.generation = int.from_bytes(os.urandom(8), "little")
+        self.new_starts = array(START_TYPECODE)
+        self.new_lengths = array(ENTRY_TYPECODE)
+        self.new_last_used = array(ENTRY_TYPECODE)
+        self.changed = {}
+        self.new_shapes = {}
+        self.new_postings = {}
+
+    def relevant_commands(self, history: mmap.mmap, prompt: str, fish: bool):
+        entry_count = self._entry_count()
+        query_tokens = {
+            token
+            for token in TOKEN_PATTERN.findall(prompt.lower().encode())
+            if MIN_TOKEN_BYTES <= len(token) <= MAX_TOKEN_BYTES
+        }
+
+        scores: dict[int, float] = {}
+        for token in query_tokens:
+            ids = self._posting_ids(token)
+            if not ids:
+                continue
+            weight = math.log(1 + entry_count / len(ids))
+            for entry_id in ids[-MAX_SCORED_POSTINGS:]:
+                scores[entry_id] = scores.get(entry_id, 0.0) + weight
+
+        ranked = heapq.nlargest(
+            RANKED_CANDIDATES,
+            scores,
+            key=lambda entry_id: (scores[entry_id], self._entry(entry_id)[2]),
+        )
+        for entry_id in ranked:
+            start, length, _used_at = self._entry(entry_id)
+            command = _decode_command(history[start : start + length], fish)
+            # The zsh integration adds the request itself to history.
+            if command != prompt.strip():
+                yield command
+
+    def base_bytes(self) -> bytes:
+        return sections_bytes(self, SECTIONS, self._position())
+
+    def delta_bytes(self) -> bytes:
+        return marshal.dumps(
+            {
+                **self._position(),
+                "new_starts": self.new_starts.tobytes(),
+                "new_lengths": self.new_lengths.tobytes(),
+                "new_last_used": self.new_last_used.tobytes(),
+                "changed": self.changed,
+                "new_shapes": self.new_shapes,
+                "new_postings": self.new_postings,
+            }
+        )
+
+    def _position(self) -> dict[str, Any]:
+        return {
+            "version": INDEX_FORMAT_VERSION,
+            "generation": self.generation,
+            "path": self.path,
+            "inode": self.inode,
+            "offset": self.offset,
+            "tail": self.tail,
+            "commands_seen": self.commands_seen,
+        }
+
+    def _entry_count(self) -> int:
+        return self.base_count + len(self.new_starts)
+
+    def _entry(self, entry_id: int) -> tuple[int, int, int]:
+        # (start, length, last_used) of an entry, newest data first.
+        if entry_id >= self.base_count:
+            new_id = entry_id - self.base_count
+            return (
+                self.new_starts[new_id],
+                self.new_lengths[new_id],
+                self.new_last_used[new_id],
+            )
+        changed = self.changed.get(entry_id)
+        if changed is not None:
+            return changed
+        return self.starts[entry_id], self.lengths[entry_id], self.last_used[entry_id]
+
+    def _entry_for_shape(self, shape_key: int) -> int | None:
+        entry_id = self.new_shapes.get(shape_key)
+        if entry_id is not None or not self.shape_slots:
+            return entry_id
+
+        mask = len(self.shape_slots) - 1
+        slot = shape_key & mask
+        while self.shape_slots[slot]:
+            if self.shape_slots[slot] == shape_key:
+                return self.shape_slot_ids[slot]
+            slot = (slot + 1) & mask
+        return None
+
+    def _merge_shape_slots(self, entry_count: int) -> None:
+        occupied = [
+            (shape_key, entry_id)
+            for shape_key, entry_id in zip(self.shape_slots, self.shape_slot_ids)
+            if shape_key
+        ]
+        occupied.extend(self.new_shapes.items())
+        # At most half full keeps probe sequences short.
+        size = MIN_SHAPE_SLOTS
+        while size < 2 * entry_count:
+            size *= 2
+        shape_slots = array(SHAPE_KEY_TYPECODE, bytes(8 * size))
+        shape_slot_ids = array(ENTRY_TYPECODE, bytes(4 * size))
+        mask = size - 1
+        for shape_key, entry_id in occupied:
+            slot = shape_key & mask
+            while shape_slots[slot]:
+                slot = (slot + 1) & mask
+            shape_slots[slot] = shape_key
+            shape_slot_ids[slot] = entry_id
+        self.shape_slots, self.shape_slot_ids = shape_slots, shape_slot_ids
+
+    def _posting_ids(self, token: bytes) -> array:
+        ids = posting_ids(
+            self.postings,
+            posting_span(self.directory, self.directory_bucket_ends, token),
+        )
+        ids.frombytes(self.new_postings.get(token, b""))
+        return ids
+
+    def _merge_postings(self) -> None:
+        self.directory, self.postings, self.directory_bucket_ends = merge_postings(
+            self.directory, self.postings, self.new_postings
+        )
+
+
+def shell_history_context(
+    prompt: str, settings: dict[str, Any] | None = None, histfile: str | None = None
+) -> str:
+    path = _configured_history_path(settings, histfile)
+    if path is None:
+        return ""
+    commands = relevant_history_commands(path, prompt)
+    if not commands:
+        return ""
+    lines = [f"- {command}" for command in commands]
+    return "\n".join([HISTORY_CONTEXT_HEADER, *lines])
+
+
+def relevant_history_commands(path: Path, prompt: str) -> list[str]:
+    try:
+        with _mapped_history(path) as (stat, history):
+            if history is None:
+                return []
+            fish = _is_fish_history(path)
+            index = _current_index(
+                path, stat, history, fish, rebuild_limit=FOREGROUND_REBUILD_BYTES
+            )
+            if index is None:
+                return []
+            return _select_commands(index, history, prompt, fish)
+    except (OSError, ValueError):
+        return []
+
+
+def refresh_shell_history_index() -> None:
+    path = _configured_history_path()
+    if path is None:
+        return
+    try:
+        with _mapped_history(path) as (stat, history):
+            if history is not None:
+                _current_index(path, stat, history, _is_fish_history(path))
+    except (OSError, ValueError):
+        return
+
+
+@contextmanager
+def _mapped_history(path: Path):
+    with open(path, "rb") as history_file:
+        stat = os.fstat(history_file.fileno())
+        if stat.st_size == 0:
+            yield stat, None
+            return
+        with mmap.mmap(history_file.fileno(), 0, access=mmap.ACCESS_READ) as history:
+            yield stat, history
+
+
+def _select_commands(
+    index: ShellHistoryIndex, history: mmap.mmap, prompt: str, fish: bool
+) -> list[str]:
+    selected: list[str] = []
+    remaining_characters = HISTORY_CONTEXT_MAX_CHARACTERS
+    for command in index.relevant_commands(history, prompt, fish):
+        if not command or len(command) > HISTORY_COMMAND_MAX_CHARACTERS:
+            continue
+        if len(command) > remaining_characters:
+            break
+        selected.append(command)
+        remaining_characters -= len(command)
+        if len(selected) == HISTORY_CONTEXT_MAX_COMMANDS:
+            break
+    return selected
+
+
+def _current_index(
+    path: Path,
+    stat: os.stat_result,
+    history: mmap.mmap,
+    fish: bool,
+    rebuild_limit: int | None = None,
+) -> ShellHistoryIndex | None:
+    cache_path, delta_path = _index_paths(path)
+    index = _load_index(cache_path, delta_path)
+    rebuilt = not index.matches(path, stat, history)
+    if rebuilt:
+        if rebuild_limit is not None and len(history) > rebuild_limit:
+            # Shells rewrite the file when they trim it, and indexing a long
+            # history from scratch takes too long to wait for.
+            spawn_background_refresh()
+            return None
+        index = ShellHistoryIndex(
+            delta={"path": str(path), "inode": stat.st_ino, "generation": 0}
+        )
+
+    if index.update(history, fish):
+        try:
+            with locked(cache_path):
+                # A rebuilt index needs a base of its own, or the delta would
+                # still name the generation of the old one.
+                if rebuilt or index.needs_merge():
+                    index.merge()
+                    write_bytes_atomically(cache_path, index.base_bytes())
+                write_bytes_atomically(delta_path, index.delta_bytes())
+        except OSError:
+            pass
+    return index
+
+
+def _command_spans(history: mmap.mmap, start: int, end: int, fish: bool):
+    # Yields (start, length) for each command in history[start:end], which
+    # ends with a newline. Spans keep the on-disk encoding; _decode_command
+    # turns one into text only when it is shown.
+    position = start
+    while position < end:
+        line_end = history.find(b"\n", position, end)
+        line_start = position
+        position = line_end + 1
+
+        if fish:
+            prefix = FISH_COMMAND_PREFIX.match(history, line_start, line_end)
+            if prefix:
+                yield prefix.end(), line_end - prefix.end()
+            continue
+
+        if BASH_TIMESTAMP_LINE.fullmatch(history, line_start, line_end):
+            continue
+        prefix = ZSH_EXTENDED_PREFIX.match(history, line_start, line_end)
+        command_start = prefix.end() if prefix else line_start
+        # zsh writes each line of a multi-line command with a trailing
+        # backslash before the newline.
+        while line_end > command_start and history[line_end - 1] == ord("\\"):
+            next_end = history.find(b"\n", position, end)
+            if next_end == -1:
+                break
+            line_end, position = next_end, next_end + 1
+        if line_end > command_start:
+            yield command_start, line_end - command_start
+
+
+def _shape_key(command: bytes) -> int:
+    # Commands that differ only in numbers, like ssh web1 and ssh web2, share
+    # an entry so one habit cannot fill every slot. Zero marks an empty slot.
+    shape = DIGITS_PATTERN.sub(b"0", command.strip())
+    digest = hashlib.blake2b(shape, digest_size=8).digest()
+    return int.from_bytes(digest, "little") or 1
+
+
+def _decode_command(raw: bytes, fish: bool) -> str:
+    if fish:
+        raw = raw.replace(b"\\n", b"\n").replace(b"\\\\", b"\\")
+    else:
+        raw = raw.replace(b"\\\n", b"\n")
+        if ZSH_META_BYTE in raw:
+            raw = _unmetafy(raw)
+    return raw.decode("utf-8", errors="replace").strip()
+
+
+def _unmetafy(raw: bytes) -> bytes:
+    decoded = bytearray()
+    escaped = False
+    for byte in raw:
+        if escaped:
+            decoded.append(byte ^ 32)
+            escaped = False
+        elif byte == ZSH_META_BYTE:
+            escaped = True
+        else:
+            decoded.append(byte)
+    return bytes(decoded)
+
+
+def _configured_history_path(
+    settings: dict[str, Any] | None = None, histfile: str | None = None
+) -> Path | None:
+    if settings is None:
+        settings = cached_settings()
+    if settings.get(HISTORY_CONTEXT_SETTING) is not True:
+        return None
+    return _history_file_path(settings, histfile)
+
+
+def _history_file_path(
+    settings: dict[str, Any], histfile: str | None = None
+) -> Path | None:
+    # The daemon is sent the requesting shell's HISTFILE, since its own
+    # environment belongs to whichever shell started it.
+    configured = (
+        settings.get(HISTORY_FILE_SETTING) or histfile or os.environ.get("HISTFILE")
+    )
+    if isinstance(configured, str) and configured:
+        return Path(configured).expanduser()
+
+    home = Path.home()
+    shell = Path(os.environ.get("SHELL", "")).name
+    if shell == "zsh":
+        return Path(os.environ.get("ZDOTDIR") or home) / ".zsh_history"
+    if shell == "bash":
+        return home / ".bash_history"
+    if shell == "fish":
+        data_home = os.environ.get("XDG_DATA_HOME") or home / ".local" / "share"
+        session = os.environ.get("fish_history") or "fish"
+        return Path(data_home) / "fish" / f"{session}_history"
+    return None
+
+
+def _is_fish_history(path: Path) -> bool:
+    return path.name.endswith("_history") and path.parent.name == "fish"
+
+
+def _index_paths(history_path: Path) -> tuple[Path, Path]:
+    digest = hashlib.blake2b(
+        str(history_path).encode("utf-8", errors="surrogateescape"), digest_size=8
+    ).hexdigest()
+    return (
+        cache_file_path(CACHE_FILE_NAME.format(digest)),
+        cache_file_path(DELTA_FILE_NAME.format(digest)),
+    )
+
+
+def _load_index(path: Path, delta_path: Path) -> ShellHistoryIndex:
+    delta = read_marshal(delta_path, INDEX_FORMAT_VERSION)
+    mapped = map_sections(path, SECTIONS, INDEX_FORMAT_VERSION)
+    if mapped is None:
+        return ShellHistoryIndex(delta=delta)
+    header, sections = mapped
+    return ShellHistoryIndex(header, sections, delta)
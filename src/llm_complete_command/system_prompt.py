@@ -6,7 +6,40 @@ PROBED_TOOLS = ("rg", "fd", "choose", "eza", "procs", "jq", "yq")
 ADDITIONAL_DETAILS_KEY = "additional_details"
 
 
+# Instructions that never change come first and environment details last, so
+# providers that cache prompt prefixes keep reusing the instructions when a
+# tool is installed or upgraded.
+STABLE_INSTRUCTIONS = "\n".join(
+    [
+        "You are an expert system administrator and shell maestro with decades of experience.",
+        "",
+        "Convert plain-English shell requests into elegant and efficient command lines.",
+        "",
+        "Respond ONLY with the raw command to execute.",
+        "- No markdown",
+        "- No explanations",
+        "- No code fences",
+        "- No surrounding quotes",
+        "",
+        "Response format rules:",
+        "- Return only the command itself",
+        "- Keep multi-line commands valid with continuations or heredocs",
+        "- For potentially destructive operations, include safeguards",
+        "- Follow the tool preferences below when they apply",
+        "",
+        "Examples:",
+        '- "find all python files" -> fd .py',
+        '- "search for pattern in text files" -> rg "pattern" -t txt',
+        '- "list directories by size" -> eza -la --sort=size',
+    ]
+)
+
+
 def build_system_prompt(environment: dict[str, Any]) -> str:
+    return f"{STABLE_INSTRUCTIONS}\n\n{_format_environment_details(environment)}"
+
+
+def _format_environment_details(environment: dict[str, Any]) -> str:
     os_line = _format_os_line(environment)
     shell_line = _format_shell_line(environment)
     terminal_line = _format_terminal_line(environment)
@@ -16,16 +49,6 @@ def build_system_prompt(environment: dict[str, Any]) -> str:
 
     return "\n".join(
         [
-            "You are an expert system administrator and shell maestro with decades of experience.",
-            "",
-            "Convert plain-English shell requests into elegant and efficient command lines.",
-            "",
-            "Respond ONLY with the raw command to execute.",
-            "- No markdown",
-            "- No explanations",
-            "- No code fences",
-            "- No surrounding quotes",
-            "",
             "Runtime environment:",
             f"- {os_line}",
             f"- {shell_line}",
@@ -39,16 +62,6 @@ def build_system_prompt(environment: dict[str, Any]) -> str:
             "",
             "Tool preferences:",
             tool_preference_lines,
-            "",
-            "Response format rules:",
-            "- Return only the command itself",
-            "- Keep multi-line commands valid with continuations or heredocs",
-            "- For potentially destructive operations, include safeguards",
-            "",
-            "Examples:",
-            '- "find all python files" -> fd .py',
-            '- "search for pattern in text files" -> rg "pattern" -t txt',
-            '- "list directories by size" -> eza -la --sort=size',
         ]
     )
 
@@ -102,6 +115,12 @@ def _format_tool_lines(environment: dict[str, Any]) -> str:
         state = "available" if available else "missing"
         lines.append(f"- {tool_name}: {state} ({version})")
 
+    for tool_name, tool_info in tools.items():
+        if tool_name in PROBED_TOOLS or not _tool_available(tools, tool_name):
+            continue
+        version = tool_info.get("version", UNKNOWN_VALUE)
+        lines.append(f"- {tool_name}: available ({version})")
+
     return "\n".join(lines)
 
 
@@ -0,0 +1,100 @@
+import functools
+import hashlib
+import json
+from pathlib import Path
+from typing import Any
+
+from .atomic_file import cache_file_path, write_text_atomically
+from .environment_config import (
+    config_signature,
+    freshness_fields,
+    load_effective_environment,
+    load_settings,
+    schedule_refresh_if_needed,
+)
+from .system_prompt import build_system_prompt
+
+
+CACHE_FILE_NAME = "system-prompt.json"
+DISTRIBUTION_NAME = "llm-complete-command"
+KEY_KEY = "key"
+PROMPT_KEY = "prompt"
+FRESHNESS_KEY = "freshness"
+SETTINGS_KEY = "settings"
+
+
+def render_cached_system_prompt() -> tuple[str, bool]:
+    entry, cache_hit = _cached_entry()
+    return entry[PROMPT_KEY], cache_hit
+
+
+def cached_settings() -> dict[str, Any]:
+    # Settings share the prompt's cache entry so the hot path never parses YAML.
+    entry, _cache_hit = _cached_entry()
+    return entry[SETTINGS_KEY]
+
+
+def forget_cached_entry() -> None:
+    # The entry is read once per process; a long-running daemon forgets it
+    # now and then to pick up config changes.
+    _cached_entry.cache_clear()
+
+
+@functools.cache
+def _cached_entry() -> tuple[dict[str, Any], bool]:
+    cache_path = cache_file_path(CACHE_FILE_NAME)
+    cached_entry = _read_cached_entry(cache_path)
+    if cached_entry is not None and cached_entry[KEY_KEY] == _cache_key():
+        # Neither the detected environment nor the settings are parsed on a
+        # hit, so the staleness check runs against the copies saved here.
+        schedule_refresh_if_needed(
+            cached_entry[FRESHNESS_KEY], cached_entry[SETTINGS_KEY]
+        )
+        return cached_entry, True
+
+    environment = load_effective_environment()
+    entry = {
+        KEY_KEY: _cache_key(),
+        PROMPT_KEY: build_system_prompt(environment),
+        FRESHNESS_KEY: freshness_fields(environment),
+        SETTINGS_KEY: load_settings(),
+    }
+    try:
+        write_text_atomically(cache_path, json.dumps(entry, default=str))
+    except OSError:
+        pass
+
+    return entry, False
+
+
+def _cache_key() -> str:
+    key_material = json.dumps([config_signature(), _plugin_version()])
+    return hashlib.sha256(key_material.encode("utf-8")).hexdigest()
+
+
+def _plugin_version() -> str:
+    from importlib.metadata import PackageNotFoundError, version
+
+    try:
+        return version(DISTRIBUTION_NAME)
+    except PackageNotFoundError:
+        return "unknown"
+
+
+def _read_cached_entry(path: Path) -> dict[str, Any] | None:
+    try:
+        entry = json.loads(path.read_text())
+    except (OSError, json.JSONDecodeError):
+        return None
+
+    if not isinstance(entry, dict):
+        return None
+    if not isinstance(entry.get(KEY_KEY), str):
+        return None
+    if not isinstance(entry.get(PROMPT_KEY), str):
+        return None
+    if not isinstance(entry.get(FRESHNESS_KEY), dict):
+        return None
+    if not isinstance(entry.get(SETTINGS_KEY), dict):
+        return None
+    return entry
@@ -1,14 +1,22 @@
+import json
 import os
 import re
 import select
 import sys
 import threading
 import time
+from pathlib import Path
+from typing import Any
 
-from yaspin import yaspin
+from .atomic_file import cache_file_path, locked, write_text_atomically
+from .system_prompt_cache import cached_settings
 
 
-SPINNER_REFRESH_SECONDS = 0.1
+SPINNER_FRAME_SECONDS = 0.08
+SPINNER_FRAMES = "⠋⠙⠹⠸⠼⠴⠦⠧⠇⠏"
+HIDE_CURSOR = "\x1b[?25l"
+SHOW_CURSOR = "\x1b[?25h"
+CLEAR_LINE = "\r\x1b[K"
 ELAPSED_TIME_FIELD_WIDTH = 5
 ELAPSED_COLOR_TRANSITION_SECONDS = 45.0
 ELAPSED_COLOR_START_RGB = (255, 255, 255)
@@ -21,6 +29,14 @@ CPR_QUERY = "\x1b[6n"
 OSC_TERMINATOR = "\x07"
 CPR_RESPONSE_PATTERN = re.compile(rb"\x1b\[(\d+);(\d+)R")
 STATUS_SEPARATOR = " · "
+TEXT_SIZING_SETTING = "text_sizing"
+CACHE_FILE_NAME = "terminal-capabilities.json"
+CACHE_TTL_SECONDS = 30 * 24 * 60 * 60
+TERMINALS_KEY = "terminals"
+TEXT_SIZING_KEY = "text_sizing"
+UPDATED_AT_KEY = "updated_at"
+TERMINAL_IDENTITY_ENV_VARS = ("TERM_PROGRAM", "TERM_PROGRAM_VERSION", "TERM")
+MULTIPLEXER_ENV_VARS = (("TMUX", "tmux"), ("STY", "screen"), ("ZELLIJ", "zellij"))
 
 _text_sizing_scale_support_cache: bool | None = None
 
@@ -102,14 +118,16 @@ def _cpr_positions_support_scale(positions: list[tuple[int, int]]) -> bool:
     return width_supported and scale_supported
 
 
-def _detect_text_sizing_scale_support() -> bool:
+def _detect_text_sizing_scale_support() -> bool | None:
+    # None means there was no terminal to ask, which says nothing about the
+    # terminal itself, so that result is never persisted.
     if not sys.stdin.isatty() or not sys.stderr.isatty():
-        return False
+        return None
 
     try:
         tty_fd = os.open("/dev/tty", os.O_RDWR)
     except OSError:
-        return False
+        return None
 
     probe = (
         f"{CPR_QUERY}"
@@ -122,7 +140,7 @@ def _detect_text_sizing_scale_support() -> bool:
         positions = _read_cpr_positions(tty_fd, expected_responses=3)
         return _cpr_positions_support_scale(positions)
     except OSError:
-        return False
+        return None
     finally:
         os.close(tty_fd)
 
@@ -130,44 +148,159 @@ def _detect_text_sizing_scale_support() -> bool:
 def _supports_fractional_text_sizing() -> bool:
     global _text_sizing_scale_support_cache
     if _text_sizing_scale_support_cache is None:
-        _text_sizing_scale_support_cache = _detect_text_sizing_scale_support()
+        _text_sizing_scale_support_cache = _resolve_text_sizing_scale_support()
     return _text_sizing_scale_support_cache
 
 
+def _resolve_text_sizing_scale_support() -> bool:
+    configured = cached_settings().get(TEXT_SIZING_SETTING)
+    if isinstance(configured, bool):
+        return configured
+
+    identity = _terminal_identity()
+    persisted = _read_persisted_text_sizing(identity)
+    if persisted is not None:
+        return persisted
+
+    detected = _detect_text_sizing_scale_support()
+    if detected is None:
+        return False
+
+    try:
+        _persist_text_sizing(identity, detected)
+    except OSError:
+        pass
+    return detected
+
+
+def _terminal_identity() -> str:
+    fields = [os.environ.get(name, "") for name in TERMINAL_IDENTITY_ENV_VARS]
+    multiplexers = [
+        multiplexer
+        for env_var, multiplexer in MULTIPLEXER_ENV_VARS
+        if os.environ.get(env_var)
+    ]
+    return "|".join([*fields, ",".join(multiplexers)])
+
+
+def _read_persisted_text_sizing(identity: str) -> bool | None:
+    entry = _read_terminals(cache_file_path(CACHE_FILE_NAME)).get(identity)
+    if not isinstance(entry, dict):
+        return None
+
+    updated_at = entry.get(UPDATED_AT_KEY)
+    if not isinstance(updated_at, int):
+        return None
+    if int(time.time()) - updated_at > CACHE_TTL_SECONDS:
+        return None
+
+    value = entry.get(TEXT_SIZING_KEY)
+    return value if isinstance(value, bool) else None
+
+
+def _persist_text_sizing(identity: str, supported: bool) -> None:
+    path = cache_file_path(CACHE_FILE_NAME)
+    with locked(path):
+        terminals = _read_terminals(path)
+        terminals[identity] = {
+            TEXT_SIZING_KEY: supported,
+            UPDATED_AT_KEY: int(time.time()),
+        }
+        write_text_atomically(
+            path,
+            json.dumps({TERMINALS_KEY: terminals}, indent=2, sort_keys=True) + "\n",
+        )
+
+
+def _read_terminals(path: Path) -> dict[str, Any]:
+    try:
+        cache = json.loads(path.read_text())
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+    if not isinstance(cache, dict):
+        return {}
+    terminals = cache.get(TERMINALS_KEY)
+    return terminals if isinstance(terminals, dict) else {}
+
+
 class ThinkingSpinner:
+    # One timer redraws the spinner frame and the elapsed time together: a
+    # daemon thread from start(), or the caller's event loop through run().
+    # stop() never waits for either: the lock guarantees nothing is drawn once
+    # the line has been cleared, so the first token is written straight away.
     def __init__(self, model_name: str):
         self._model_name = model_name
-        self._spinner = None
+        self._stream = None
         self._started_at = 0.0
+        self._lock = threading.Lock()
         self._stop_event = threading.Event()
-        self._updater_thread = None
         self._use_fractional_status_text = False
 
     def start(self) -> None:
-        if self._spinner is not None or not sys.stderr.isatty():
+        if not self._begin():
             return
 
+        threading.Thread(
+            target=self._animate,
+            args=(self._stop_event,),
+            daemon=True,
+        ).start()
+
+    async def run(self) -> None:
+        import asyncio
+
+        if not self._begin():
+            return
+
+        stop_event = self._stop_event
+        frame_index = 0
+        while True:
+            await asyncio.sleep(SPINNER_FRAME_SECONDS)
+            frame_index += 1
+            if not self._draw_next_frame(stop_event, frame_index):
+                return
+
+    def _begin(self) -> bool:
+        if self._stream is not None or not sys.stderr.isatty():
+            return False
+
         self._started_at = time.monotonic()
         self._use_fractional_status_text = _supports_fractional_text_sizing()
-        self._spinner = yaspin(text=self._status_text(), stream=sys.stderr)
-        self._spinner.start()
-
-        self._updater_thread = threading.Thread(
-            target=self._update_text_loop,
-            daemon=True,
-        )
-        self._updater_thread.start()
+        self._stream = sys.stderr
+        self._stop_event = threading.Event()
+        self._stream.write(HIDE_CURSOR)
+        self._draw_frame(self._stream, 0)
+        return True
 
     def stop(self) -> None:
-        if self._spinner is None:
-            return
+        with self._lock:
+            if self._stream is None:
+                return
+
+            self._stop_event.set()
+            self._stream.write(f"{CLEAR_LINE}{SHOW_CURSOR}")
+            self._stream.flush()
+            self._stream = None
 
-        self._stop_event.set()
-        if self._updater_thread is not None:
-            self._updater_thread.join(timeout=0.2)
+    def _animate(self, stop_event: threading.Event) -> None:
+        frame_index = 0
+        while not stop_event.wait(SPINNER_FRAME_SECONDS):
+            frame_index += 1
+            if not self._draw_next_frame(stop_event, frame_index):
+                return
+
+    def _draw_next_frame(self, stop_event: threading.Event, frame_index: int) -> bool:
+        with self._lock:
+            if stop_event.is_set() or self._stream is None:
+                return False
+            self._draw_frame(self._stream, frame_index)
+            return True
 
-        self._spinner.stop()
-        self._spinner = None
+    def _draw_frame(self, stream, frame_index: int) -> None:
+        frame = SPINNER_FRAMES[frame_index % len(SPINNER_FRAMES)]
+        stream.write(f"{CLEAR_LINE}{frame} {self._status_text()}")
+        stream.flush()
 
     def _status_text(self) -> str:
         elapsed_seconds = time.monotonic() - self._started_at
@@ -185,9 +318,3 @@ class ThinkingSpinner:
             f"{elapsed_color}{_osc66_fractional_scale(elapsed_text)}{ANSI_RESET}"
             f"{_osc66_fractional_scale(f'{STATUS_SEPARATOR}{self._model_name}')}"
         )
-
-    def _update_text_loop(self) -> None:
-        while not self._stop_event.wait(SPINNER_REFRESH_SECONDS):
-            if self._spinner is None:
-                return
-            self._spinner.text = self._status_text()
@@ -0,0 +1,174 @@
+import heapq
+import marshal
+import os
+import time
+from pathlib import Path
+from typing import Any
+
+from .atomic_file import cache_file_path, write_bytes_atomically
+from .system_prompt_cache import cached_settings
+
+
+CACHE_FILE_NAME = "working-directory-context.bin"
+CACHE_FORMAT_VERSION = 1
+DIRECTORIES_KEY = "directories"
+VERSION_KEY = "version"
+WORKING_DIRECTORY_CONTEXT_SETTING = "working_directory_context"
+MAX_LISTED_ENTRIES = 30
+MAX_SCANNED_ENTRIES = 2000
+MAX_NAME_CHARACTERS = 80
+MAX_CACHED_DIRECTORIES = 64
+# A directory that takes longer than this to list is described from what was
+# read so far; the deadline is checked every BUDGET_CHECK_INTERVAL entries.
+SCAN_BUDGET_SECONDS = 0.015
+BUDGET_CHECK_INTERVAL = 64
+SIZE_UNITS = ("B", "KB", "MB", "GB", "TB")
+PROJECT_MARKERS = {
+    "package.json": "Node.js",
+    "deno.json": "Deno",
+    "Cargo.toml": "Rust",
+    "pyproject.toml": "Python",
+    "setup.py": "Python",
+    "requirements.txt": "Python",
+    "go.mod": "Go",
+    "Gemfile": "Ruby",
+    "composer.json": "PHP",
+    "pom.xml": "Maven",
+    "build.gradle": "Gradle",
+    "build.gradle.kts": "Gradle",
+    "CMakeLists.txt": "CMake",
+    "meson.build": "Meson",
+    "Makefile": "make",
+    "justfile": "just",
+    "Dockerfile": "Docker",
+    "compose.yaml": "Docker Compose",
+    "docker-compose.yml": "Docker Compose",
+    "flake.nix": "Nix",
+}
+
+
+def working_directory_context(
+    cwd: str | None = None, settings: dict[str, Any] | None = None
+) -> str:
+    if settings is None:
+        settings = cached_settings()
+    if settings.get(WORKING_DIRECTORY_CONTEXT_SETTING) is False:
+        return ""
+    try:
+        path = os.path.abspath(cwd or os.getcwd())
+        stat = os.stat(path)
+    except OSError:
+        return ""
+
+    # A directory's mtime changes when entries are added, removed or renamed,
+    # but not when a file grows, so listed sizes can lag until the next change.
+    signature = (stat.st_mtime_ns, stat.st_ino)
+    cache_path = cache_file_path(CACHE_FILE_NAME)
+    directories = _read_cached_directories(cache_path)
+    cached = directories.get(path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
+    context = _describe_directory(path)
+    directories.pop(path, None)
+    directories[path] = (signature, context)
+    while len(directories) > MAX_CACHED_DIRECTORIES:
+        del directories[next(iter(directories))]
+    try:
+        write_bytes_atomically(
+            cache_path,
+            marshal.dumps(
+                {VERSION_KEY: CACHE_FORMAT_VERSION, DIRECTORIES_KEY: directories}
+            ),
+        )
+    except OSError:
+        pass
+    return context
+
+
+def _describe_directory(path: str) -> str:
+    deadline = time.monotonic() + SCAN_BUDGET_SECONDS
+    visible: list[os.DirEntry] = []
+    markers: list[str] = []
+    scanned = hidden = 0
+    complete = True
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                scanned += 1
+                name = entry.name
+                if name in PROJECT_MARKERS:
+                    markers.append(name)
+                if name.startswith("."):
+                    hidden += 1
+                else:
+                    visible.append(entry)
+                if scanned >= MAX_SCANNED_ENTRIES or (
+                    scanned % BUDGET_CHECK_INTERVAL == 0 and time.monotonic() > deadline
+                ):
+                    complete = False
+                    break
+    except OSError:
+        return ""
+
+    lines = [f"Current working directory: {path}"]
+    if markers:
+        described_markers = ", ".join(
+            f"{name} ({PROJECT_MARKERS[name]})" for name in sorted(markers)
+        )
+        lines.append(f"Project files: {described_markers}")
+
+    count = f"{scanned}" if complete else f"at least {scanned}"
+    hidden_note = f", {hidden} hidden" if hidden else ""
+    lines.append(f"Entries ({count}{hidden_note}):")
+    listed = heapq.nsmallest(MAX_LISTED_ENTRIES, visible, key=lambda entry: entry.name)
+    lines.extend(f"- {_describe_entry(entry, deadline)}" for entry in listed)
+    if len(visible) > len(listed):
+        lines.append(f"- ... {len(visible) - len(listed)} more not listed")
+    return "\n".join(lines)
+
+
+def _describe_entry(entry: os.DirEntry, deadline: float) -> str:
+    name = _display_name(entry.name)
+    try:
+        if entry.is_symlink():
+            return f"{name}@"
+        if entry.is_dir(follow_symlinks=False):
+            return f"{name}/"
+        # Sizes cost a stat call each, so they are dropped once time runs out.
+        if time.monotonic() > deadline:
+            return name
+        return f"{name} ({_format_size(entry.stat(follow_symlinks=False).st_size)})"
+    except OSError:
+        return name
+
+
+def _display_name(name: str) -> str:
+    # A file name may hold newlines or escape sequences; keep it on one line.
+    printable = "".join(char if char.isprintable() else "?" for char in name)
+    if len(printable) > MAX_NAME_CHARACTERS:
+        return f"{printable[: MAX_NAME_CHARACTERS - 3]}..."
+    return printable
+
+
+def _format_size(size_bytes: int) -> str:
+    size = float(size_bytes)
+    for unit in SIZE_UNITS[:-1]:
+        if size < 1024:
+            break
+        size /= 1024
+    else:
+        unit = SIZE_UNITS[-1]
+    return f"{size_bytes} B" if unit == SIZE_UNITS[0] else f"{size:.1f} {unit}"
+
+
+def _read_cached_directories(path: Path) -> dict[str, Any]:
+    try:
+        data = marshal.loads(path.read_bytes())
+    except (OSError, EOFError, ValueError, TypeError):
+        return {}
+
+    if not isinstance(data, dict) or data.get(VERSION_KEY) != CACHE_FORMAT_VERSION:
+        return {}
+    directories = data.get(DIRECTORIES_KEY)
+    return directories if isinstance(directories, dict) else {}
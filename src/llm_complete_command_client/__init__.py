@@ -0,0 +1,132 @@
+import argparse
+import json
+import os
+import socket
+import sys
+import tempfile
+from pathlib import Path
+from typing import Any
+
+
+APP_NAME = "llm-complete-command"
+SOCKET_FILE_NAME = "daemon.sock"
+FALLBACK_COMMAND = ("llm", "complete_command")
+FRAME_ENCODING = "utf-8"
+COMPLETE_FRAME = "complete"
+REVISE_FRAME = "revise"
+OUTPUT_FRAME = "output"
+FEEDBACK_FRAME = "feedback"
+RESULT_FRAME = "result"
+ERROR_FRAME = "error"
+
+
+def daemon_socket_path() -> Path:
+    # The client only uses the standard library, and the daemon imports this
+    # so both sides agree on where the socket lives.
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return Path(runtime_dir) / APP_NAME / SOCKET_FILE_NAME
+    return Path(tempfile.gettempdir()) / f"{APP_NAME}-{os.getuid()}" / SOCKET_FILE_NAME
+
+
+def write_frame(stream, frame: dict[str, Any]) -> None:
+    stream.write(json.dumps(frame).encode(FRAME_ENCODING) + b"\n")
+    stream.flush()
+
+
+def read_frame(stream) -> dict[str, Any] | None:
+    line = stream.readline()
+    if not line:
+        return None
+
+    try:
+        frame = json.loads(line.decode(FRAME_ENCODING))
+    except (UnicodeDecodeError, json.JSONDecodeError):
+        return None
+
+    return frame if isinstance(frame, dict) else None
+
+
+def _parse_args(argv: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="llm-complete-command-client")
+    parser.add_argument("-m", "--model", default=None)
+    parser.add_argument("-s", "--system", default=None)
+    parser.add_argument("--key", default=None)
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--race", default=None)
+    parser.add_argument("args", nargs="*")
+    return parser.parse_args(argv)
+
+
+def _connect(path: Path) -> socket.socket | None:
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(str(path))
+    except OSError:
+        connection.close()
+        return None
+    return connection
+
+
+def _fall_back_to_one_shot(argv: list[str]) -> None:
+    os.execvp(FALLBACK_COMMAND[0], [*FALLBACK_COMMAND, *argv])
+
+
+def _current_directory() -> str | None:
+    # The daemon runs elsewhere, so it is told where the request was made.
+    try:
+        return os.getcwd()
+    except OSError:
+        return None
+
+
+def run_session(stream, request: dict[str, Any], tty_in, tty_out, stdout) -> int:
+    write_frame(stream, {"type": COMPLETE_FRAME, **request})
+
+    while True:
+        frame = read_frame(stream)
+        if frame is None:
+            print("lost connection to the completion daemon", file=sys.stderr)
+            return 1
+
+        frame_type = frame.get("type")
+        if frame_type == OUTPUT_FRAME:
+            tty_out.write(str(frame.get("text", "")))
+            tty_out.flush()
+        elif frame_type == FEEDBACK_FRAME:
+            tty_out.write(str(frame.get("prompt", "")))
+            tty_out.flush()
+            feedback = tty_in.readline().rstrip("\n")
+            write_frame(stream, {"type": REVISE_FRAME, "feedback": feedback})
+        elif frame_type == RESULT_FRAME:
+            print(frame.get("command", ""), file=stdout)
+            return 0
+        elif frame_type == ERROR_FRAME:
+            print(frame.get("message", "completion failed"), file=sys.stderr)
+            return 1
+
+
+def main(argv: list[str] | None = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    options = _parse_args(argv)
+
+    connection = _connect(daemon_socket_path())
+    if connection is None:
+        _fall_back_to_one_shot(argv)
+        return 1
+
+    request = {
+        "prompt": " ".join(options.args),
+        "model": options.model,
+        "system": options.system,
+        "key": options.key,
+        "no_cache": options.no_cache,
+        "race": options.race,
+        "cwd": _current_directory(),
+        # The shell widgets export HISTFILE for this call.
+        "histfile": os.environ.get("HISTFILE") or None,
+    }
+
+    with connection, connection.makefile("rwb") as stream:
+        with open("/dev/tty", "r") as tty_in, open("/dev/tty", "w") as tty_out:
+            return run_session(stream, request, tty_in, tty_out, sys.stdout)
@@ -1,9 +1,23 @@
 import sys
 from pathlib import Path
 
+import pytest
+
 
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
 SRC_PATH = PROJECT_ROOT / "src"
 
 if str(SRC_PATH) not in sys.path:
     sys.path.insert(0, str(SRC_PATH))
+
+
+@pytest.fixture(autouse=True)
+def _isolated_user_dirs(tmp_path, monkeypatch):
+    # Caches and settings resolve through platformdirs, so no test can touch
+    # the real ~/.cache or ~/.config even when it does not patch a path itself.
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "xdg-cache"))
+    monkeypatch.setenv("XDG_CONFIG_HOME", str(tmp_path / "xdg-config"))
+    # The settings are read once per process, so each test starts over.
+    from llm_complete_command.system_prompt_cache import forget_cached_entry
+
+    forget_cached_entry()
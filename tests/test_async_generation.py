@@ -0,0 +1,223 @@
+import asyncio
+import time
+
+import pytest
+from prompt_toolkit.input import create_pipe_input
+
+import llm_complete_command as plugin
+import llm_complete_command.async_generation as async_generation
+import llm_complete_command.request_context as request_context
+
+
+class _FakeModel:
+    def __init__(self, model_id: str):
+        self.model_id = model_id
+
+
+class _FakeAsyncConversation:
+    def __init__(
+        self, model_id: str, chunks: list[str], on_first_chunk=None, hang=False
+    ):
+        self.model = _FakeModel(model_id)
+        self.prompt_calls: list[tuple[str, dict]] = []
+        self.stream_closed = False
+        self._chunks = chunks
+        self._on_first_chunk = on_first_chunk
+        self._hang = hang
+
+    def prompt(self, prompt: str, **kwargs):
+        self.prompt_calls.append((prompt, kwargs))
+        return self._stream()
+
+    async def _stream(self):
+        try:
+            for index, chunk in enumerate(self._chunks):
+                yield chunk
+                if index == 0 and self._on_first_chunk is not None:
+                    self._on_first_chunk()
+                await asyncio.sleep(0)
+            if self._hang:
+                await asyncio.sleep(30)
+        finally:
+            self.stream_closed = True
+
+
+class _FakeKeyTerminal:
+    def __init__(self, key_input=None, feedback: list[str] | None = None):
+        self.input = key_input
+        self.written: list[str] = []
+        self._feedback = feedback or []
+
+    def write(self, text: str) -> None:
+        self.written.append(text)
+
+    def read_feedback(self) -> str:
+        return self._feedback.pop(0)
+
+
+@pytest.fixture(autouse=True)
+def _known_temperature_support(monkeypatch):
+    monkeypatch.setattr(
+        async_generation, "get_model_capability", lambda _model_id, _name: True
+    )
+
+
+def test_generate_cancellable_command_text_streams_through_frames():
+    conversation = _FakeAsyncConversation("model-a", ["ls", " -la"])
+    written: list[str] = []
+
+    text = async_generation.generate_cancellable_command_text(
+        conversation, "list", "system", written.append, terminal=None
+    )
+
+    assert text == "ls -la"
+    assert "".join(written) == "ls -la"
+    assert conversation.prompt_calls == [
+        ("list", {"system": "system", "temperature": plugin.DEFAULT_TEMPERATURE})
+    ]
+
+
+@pytest.mark.parametrize("key", ["\x1b", "\x03"])
+def test_cancel_key_stops_stream_and_keeps_partial_text(key):
+    written: list[str] = []
+    with create_pipe_input() as key_input:
+        conversation = _FakeAsyncConversation(
+            "model-a",
+            ["rm -rf", " /"],
+            on_first_chunk=lambda: key_input.send_text(key),
+            hang=True,
+        )
+        started_at = time.monotonic()
+
+        with pytest.raises(plugin.GenerationCancelledError) as cancelled:
+            async_generation.generate_cancellable_command_text(
+                conversation,
+                "clean up",
+                "system",
+                written.append,
+                terminal=_FakeKeyTerminal(key_input),
+            )
+
+    assert time.monotonic() - started_at < 5
+    assert cancelled.value.partial_text in ("rm -rf", "rm -rf /")
+    assert "".join(written) == cancelled.value.partial_text
+    assert conversation.stream_closed
+
+
+def test_run_completion_session_returns_to_revision_prompt_after_cancel(
+    monkeypatch,
+):
+    conversation = _FakeAsyncConversation("model-a", [])
+    monkeypatch.setattr(async_generation, "async_conversation_for", lambda value: value)
+    monkeypatch.setattr(plugin, "get_cached_response", lambda _key: None)
+    monkeypatch.setattr(
+        plugin, "find_similar_completion", lambda _prompt, _context_key: None
+    )
+    generated_prompts: list[str] = []
+
+    def fake_generate(_conversation, prompt, _system, **_kwargs):
+        generated_prompts.append(prompt)
+        if len(generated_prompts) == 1:
+            raise plugin.GenerationCancelledError("rm -rf")
+        return "rm -rf ./build"
+
+    monkeypatch.setattr(
+        async_generation, "generate_cancellable_command_text", fake_generate
+    )
+    terminal = _FakeKeyTerminal(feedback=["only the build folder", ""])
+
+    command = plugin.run_completion_session(
+        conversation, "clean up", "system", terminal, cancellable=True
+    )
+
+    assert command == "rm -rf ./build"
+    assert plugin.CANCELLED_NOTE in terminal.written
+    assert generated_prompts == [
+        "clean up",
+        "clean up\n\nPrevious command:\nrm -rf\n\n"
+        "Revision instructions:\nonly the build folder",
+    ]
+
+
+def test_accepting_a_cancelled_command_does_not_remember_it(monkeypatch):
+    conversation = _FakeAsyncConversation("model-a", [])
+    monkeypatch.setattr(async_generation, "async_conversation_for", lambda value: value)
+
+    def cancelled_generate(*_args, **_kwargs):
+        raise plugin.GenerationCancelledError("rm -rf")
+
+    monkeypatch.setattr(
+        async_generation, "generate_cancellable_command_text", cancelled_generate
+    )
+
+    command = plugin.run_completion_session(
+        conversation,
+        "clean up",
+        "system",
+        _FakeKeyTerminal(feedback=[""]),
+        cancellable=True,
+    )
+    plugin.remember_accepted_command(conversation, "clean up", "system", command)
+
+    assert command == "rm -rf"
+    assert (
+        plugin.get_cached_response(
+            plugin.response_cache_key(
+                "model-a", "system", "clean up", request_context.request_context_key()
+            )
+        )
+        is None
+    )
+    assert (
+        plugin.find_similar_completion(
+            "clean up", request_context.request_context_key()
+        )
+        is None
+    )
+
+
+def test_budget_restart_opens_async_conversation_from_sync_model(monkeypatch):
+    class _SyncModel:
+        model_id = "model-a"
+
+        def __init__(self):
+            self.opened: list[object] = []
+
+        def conversation(self):
+            conversation = _SyncConversation(self)
+            self.opened.append(conversation)
+            return conversation
+
+    class _SyncConversation:
+        def __init__(self, model: _SyncModel):
+            self.model = model
+
+    model = _SyncModel()
+    first_conversation = model.conversation()
+    monkeypatch.setattr(
+        async_generation,
+        "async_conversation_for",
+        lambda conversation: ("async", conversation),
+    )
+    monkeypatch.setattr(plugin, "cached_settings", lambda: {"revision_token_budget": 1})
+    monkeypatch.setattr(plugin, "get_cached_response", lambda _key: None)
+    monkeypatch.setattr(
+        plugin, "find_similar_completion", lambda _prompt, _context_key: None
+    )
+    generating: list[object] = []
+
+    def fake_generate(conversation, _prompt, _system, **_kwargs):
+        generating.append(conversation)
+        return "ls -la"
+
+    monkeypatch.setattr(
+        async_generation, "generate_cancellable_command_text", fake_generate
+    )
+    terminal = _FakeKeyTerminal(feedback=["include hidden files", ""])
+
+    plugin.run_completion_session(
+        first_conversation, "list files", "system", terminal, cancellable=True
+    )
+
+    assert generating == [("async", conversation) for conversation in model.opened]
+    assert len(model.opened) == 2
@@ -0,0 +1,52 @@
+import importlib
+import sys
+
+import pytest
+
+from conftest import PROJECT_ROOT
+
+sys.path.insert(0, str(PROJECT_ROOT / "benchmarks"))
+
+import fake_model  # noqa: E402
+import run_benchmarks  # noqa: E402
+
+
+def test_scripted_streaming_model_emits_chunks_for_each_prompt():
+    model = fake_model.ScriptedStreamingModel(
+        fake_model.tiny_delta_chunks("ls -la", width=2),
+        first_chunk_delay=0.01,
+        chunk_interval=0.002,
+    )
+
+    chunks = list(model.conversation().prompt("list files", system="system"))
+
+    assert chunks == ["ls", " -", "la"]
+    assert model.prompt_calls == ["list files"]
+    assert model.scripted_seconds() == pytest.approx(0.014)
+
+
+def test_compare_results_flags_only_meaningful_regressions():
+    baseline = {"slow": 0.010, "noise": 0.0001, "steady": 0.010, "removed": 1.0}
+    current = {"slow": 0.020, "noise": 0.0003, "steady": 0.011, "added": 1.0}
+
+    regressions = run_benchmarks.compare_results(baseline, current, threshold=0.25)
+
+    assert regressions == ["slow: 10.000 ms -> 20.000 ms"]
+
+
+def test_only_errors_about_missing_plugin_code_skip_a_benchmark():
+    import llm_complete_command
+
+    with pytest.raises(ImportError) as missing_module:
+        importlib.import_module("llm_complete_command.no_such_module")
+    with pytest.raises(AttributeError) as missing_function:
+        getattr(llm_complete_command, "no_such_function")
+    with pytest.raises(ImportError) as missing_dependency:
+        importlib.import_module("no_such_dependency")
+    with pytest.raises(AttributeError) as broken_benchmark:
+        getattr(object(), "no_such_attribute")
+
+    assert run_benchmarks._is_missing_from_src(missing_module.value)
+    assert run_benchmarks._is_missing_from_src(missing_function.value)
+    assert not run_benchmarks._is_missing_from_src(missing_dependency.value)
+    assert not run_benchmarks._is_missing_from_src(broken_benchmark.value)
@@ -0,0 +1,46 @@
+import io
+
+import llm_complete_command_client as client
+
+
+def test_read_frame_round_trips_written_frames():
+    stream = io.BytesIO()
+    client.write_frame(stream, {"type": client.OUTPUT_FRAME, "text": "ls\n"})
+    stream.seek(0)
+
+    assert client.read_frame(stream) == {"type": client.OUTPUT_FRAME, "text": "ls\n"}
+    assert client.read_frame(stream) is None
+
+
+def test_read_frame_ignores_malformed_lines():
+    assert client.read_frame(io.BytesIO(b"{not json\n")) is None
+    assert client.read_frame(io.BytesIO(b"[1, 2]\n")) is None
+
+
+def test_main_falls_back_to_one_shot_command_without_daemon(tmp_path, monkeypatch):
+    exec_calls: list[tuple[str, list[str]]] = []
+    monkeypatch.setattr(client, "daemon_socket_path", lambda: tmp_path / "missing.sock")
+    monkeypatch.setattr(
+        client.os, "execvp", lambda file, args: exec_calls.append((file, args))
+    )
+
+    client.main(["-m", "model-a", "find big files"])
+
+    assert exec_calls == [
+        ("llm", ["llm", "complete_command", "-m", "model-a", "find big files"])
+    ]
+
+
+def test_daemon_socket_path_uses_the_runtime_dir_then_a_per_user_temp_dir(
+    tmp_path, monkeypatch
+):
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path))
+    assert client.daemon_socket_path() == (
+        tmp_path / client.APP_NAME / client.SOCKET_FILE_NAME
+    )
+
+    monkeypatch.delenv("XDG_RUNTIME_DIR")
+    monkeypatch.setattr(client.tempfile, "gettempdir", lambda: str(tmp_path))
+    assert client.daemon_socket_path() == (
+        tmp_path / f"{client.APP_NAME}-{client.os.getuid()}" / client.SOCKET_FILE_NAME
+    )
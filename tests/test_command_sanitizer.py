@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+
+from llm_complete_command.command_sanitizer import (
+    CommandSanitizer,
+    sanitized_async_chunks,
+    sanitized_chunks,
+)
+
+
+def _sanitize(chunks: list[str]) -> tuple[str, bool]:
+    sanitizer = CommandSanitizer()
+    output = []
+    for chunk in chunks:
+        output.append(sanitizer.feed(chunk))
+        if sanitizer.finished:
+            return "".join(output), True
+    output.append(sanitizer.finish())
+    return "".join(output), False
+
+
+@pytest.mark.parametrize(
+    ("raw", "command", "stopped_early"),
+    [
+        ("ls -la", "ls -la", False),
+        ("ls -la\n", "ls -la", False),
+        ("```bash\nls -la\n```\nThis lists every file.", "ls -la", True),
+        ("```\nset -e\n\nmake\n```", "set -e\n\nmake", True),
+        ("`ls -la`", "ls -la", False),
+        ("'ls -la'\n\nThis lists every file.", "ls -la", True),
+        ('"$EDITOR" notes.txt', '"$EDITOR" notes.txt', False),
+        ("for f in *; do\n  echo $f\ndone", "for f in *; do\n  echo $f\ndone", False),
+        ("ls -la\n\nThis command lists every file.", "ls -la", True),
+        ("git status\n\n- shows what changed", "git status", True),
+        ("make\n\n# then run the tests\nmake test", None, False),
+        ("SELECT 1;\n\nSELECT 2;", None, False),
+        ("cat <<EOF > notes.md\n# Notes\n\nThis is the body.\nEOF", None, False),
+        ("git commit -F - <<EOF\nFix parser\n\nMore detail here.\nEOF", None, False),
+        (
+            "cat <<'EOF' > notes.md\nTitle\n\nBody text.\nEOF\n\nThis writes notes.",
+            "cat <<'EOF' > notes.md\nTitle\n\nBody text.\nEOF",
+            True,
+        ),
+        (
+            "cat <<-END\n\tFirst\n\n\tSecond line.\n\tEND\n\nThis prints two lines.",
+            "cat <<-END\n\tFirst\n\n\tSecond line.\n\tEND",
+            True,
+        ),
+        (
+            "```bash\ncat <<EOF\n```\n\nA fence.\nEOF\n```\nThis prints a fence.",
+            "cat <<EOF\n```\n\nA fence.\nEOF",
+            True,
+        ),
+        ('grep x <<< "$text"\n\nThis searches the text.', 'grep x <<< "$text"', True),
+    ],
+)
+def test_sanitizer_strips_wrapping_and_stops_at_prose(raw, command, stopped_early):
+    command = raw if command is None else command
+
+    assert _sanitize([raw]) == (command, stopped_early)
+    assert _sanitize(list(raw)) == (command, stopped_early)
+
+
+def test_sanitized_chunks_closes_the_stream_once_prose_begins():
+    pulled: list[str] = []
+    closed = []
+
+    def stream():
+        try:
+            for chunk in ["ls -la", "\n", "\nThis", " lists", " every", " file."]:
+                pulled.append(chunk)
+                yield chunk
+        finally:
+            closed.append(True)
+
+    assert list(sanitized_chunks(stream())) == ["ls -la"]
+    assert pulled == ["ls -la", "\n", "\nThis", " lists"]
+    assert closed == [True]
+
+
+def test_sanitized_async_chunks_strips_fences():
+    async def stream():
+        for chunk in ["```sh\n", "echo hi", "\n```", "\nDone."]:
+            yield chunk
+
+    async def collect():
+        return [chunk async for chunk in sanitized_async_chunks(stream())]
+
+    assert asyncio.run(collect()) == ["echo hi"]
@@ -0,0 +1,223 @@
+import io
+import socket
+import threading
+
+import pytest
+
+import llm_complete_command as plugin
+import llm_complete_command.daemon as daemon
+import llm_complete_command.model_race as model_race
+import llm_complete_command.request_context as request_context
+import llm_complete_command_client as client
+
+
+@pytest.fixture(autouse=True)
+def _isolated_caches(tmp_path, monkeypatch):
+    monkeypatch.setattr(model_race, "cached_settings", lambda: {})
+    monkeypatch.setattr(plugin, "cached_settings", lambda: {})
+
+
+class _FakeModel:
+    def __init__(self, model_id: str):
+        self.model_id = model_id
+
+
+class _FakeConversation:
+    def __init__(self, responses: list[list[str]]):
+        self.model = _FakeModel("daemon-model")
+        self.prompt_calls: list[str] = []
+        self._responses = responses
+
+    def prompt(self, prompt: str, **_kwargs):
+        self.prompt_calls.append(prompt)
+        return self._responses.pop(0)
+
+
+class _FakeState:
+    def __init__(self, conversation: _FakeConversation):
+        self._conversation = conversation
+        self.model_requests: list[tuple[str | None, str | None]] = []
+
+    def model(self, model_id, key):
+        self.model_requests.append((model_id, key))
+        conversation = self._conversation
+
+        class _Model:
+            def conversation(self):
+                return conversation
+
+        return _Model()
+
+    def expire_config(self) -> None:
+        pass
+
+    def system_prompt(self) -> str:
+        return "daemon system prompt"
+
+
+def _run_client_against(state, request, feedback_lines: str):
+    server_end, client_end = socket.socketpair()
+    server_thread = threading.Thread(
+        target=lambda: daemon.serve_session(server_end.makefile("rwb"), state)
+    )
+    server_thread.start()
+
+    tty_out = io.StringIO()
+    stdout = io.StringIO()
+    with client_end.makefile("rwb") as stream:
+        exit_code = client.run_session(
+            stream, request, io.StringIO(feedback_lines), tty_out, stdout
+        )
+
+    server_thread.join(timeout=5)
+    server_end.close()
+    client_end.close()
+    return exit_code, tty_out.getvalue(), stdout.getvalue()
+
+
+def test_serve_session_streams_chunks_and_returns_accepted_command(monkeypatch):
+    monkeypatch.setattr(plugin, "get_model_capability", lambda _model, _cap: True)
+    conversation = _FakeConversation([["ls", " -la"]])
+    state = _FakeState(conversation)
+
+    exit_code, tty_output, stdout = _run_client_against(
+        state,
+        {"prompt": "list files", "model": "m", "system": None, "key": "k"},
+        feedback_lines="\n",
+    )
+
+    assert exit_code == 0
+    assert stdout == "ls -la\n"
+    assert tty_output.startswith(plugin.COMMAND_PROMPT + "ls -la")
+    assert tty_output.endswith(plugin.REVISION_INSTRUCTIONS + plugin.FEEDBACK_PROMPT)
+    assert conversation.prompt_calls == ["list files"]
+    assert state.model_requests == [("m", "k")]
+
+
+def test_serve_session_continues_conversation_on_revision(monkeypatch):
+    monkeypatch.setattr(plugin, "get_model_capability", lambda _model, _cap: True)
+    conversation = _FakeConversation([["ls"], ["ls -la"]])
+    state = _FakeState(conversation)
+
+    exit_code, _tty_output, stdout = _run_client_against(
+        state,
+        {"prompt": "list files", "model": None, "system": None, "key": None},
+        feedback_lines="include hidden files\n\n",
+    )
+
+    assert exit_code == 0
+    assert stdout == "ls -la\n"
+    assert conversation.prompt_calls == ["list files", "include hidden files"]
+
+
+def test_serve_session_reports_generation_errors_to_client(monkeypatch):
+    monkeypatch.setattr(plugin, "get_model_capability", lambda _model, _cap: True)
+
+    class _BrokenConversation(_FakeConversation):
+        def prompt(self, prompt: str, **_kwargs):
+            raise RuntimeError("provider unavailable")
+
+    state = _FakeState(_BrokenConversation([]))
+
+    exit_code, _tty_output, stdout = _run_client_against(
+        state,
+        {"prompt": "list files", "model": None, "system": None, "key": None},
+        feedback_lines="",
+    )
+
+    assert exit_code == 1
+    assert stdout == ""
+
+
+def test_serve_session_replays_accepted_commands_unless_cache_disabled(monkeypatch):
+    monkeypatch.setattr(plugin, "get_model_capability", lambda _model, _cap: True)
+    conversation = _FakeConversation([["ls -la"], ["ls -la --color"]])
+    state = _FakeState(conversation)
+    request = {"prompt": "list files", "model": None, "system": None, "key": None}
+
+    _run_client_against(state, request, feedback_lines="\n")
+    _exit_code, tty_output, stdout = _run_client_against(
+        state, request, feedback_lines="\n"
+    )
+
+    assert stdout == "ls -la\n"
+    assert plugin.COMMAND_PROMPT + "ls -la" in tty_output
+    assert conversation.prompt_calls == ["list files"]
+
+    _exit_code, _tty_output, stdout = _run_client_against(
+        state, {**request, "no_cache": True}, feedback_lines="\n"
+    )
+
+    assert stdout == "ls -la --color\n"
+    assert conversation.prompt_calls == ["list files", "list files"]
+
+
+def test_serve_session_describes_the_client_working_directory(monkeypatch):
+    monkeypatch.setattr(plugin, "get_model_capability", lambda _model, _cap: True)
+    described: list[str | None] = []
+    monkeypatch.setattr(
+        request_context,
+        "working_directory_context",
+        lambda cwd, _settings: described.append(cwd) or "",
+    )
+    state = _FakeState(_FakeConversation([["ls -la"]]))
+
+    _run_client_against(
+        state,
+        {"prompt": "list files", "system": None, "cwd": "/srv/app"},
+        feedback_lines="\n",
+    )
+
+    assert described == ["/srv/app"]
+
+
+def test_serve_session_reads_the_client_history_file(monkeypatch):
+    monkeypatch.setattr(plugin, "get_model_capability", lambda _model, _cap: True)
+    histfiles: list[str | None] = []
+    monkeypatch.setattr(
+        request_context,
+        "shell_history_context",
+        lambda _prompt, _settings, histfile: histfiles.append(histfile) or "",
+    )
+    state = _FakeState(_FakeConversation([["ls -la"]]))
+
+    _run_client_against(
+        state,
+        {"prompt": "list files", "system": None, "histfile": "/home/u/.zsh_history"},
+        feedback_lines="\n",
+    )
+
+    assert histfiles == ["/home/u/.zsh_history"]
+
+
+def test_daemon_state_forgets_config_once_the_ttl_passes(monkeypatch):
+    now = [100.0]
+    forgotten: list[bool] = []
+    monkeypatch.setattr(daemon.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(daemon, "forget_cached_entry", lambda: forgotten.append(True))
+    state = daemon.DaemonState()
+
+    state.expire_config()
+    now[0] += daemon.SYSTEM_PROMPT_TTL_SECONDS + 1
+    state.expire_config()
+    state.expire_config()
+
+    assert forgotten == [True]
+
+
+def test_prepare_socket_path_removes_stale_socket(tmp_path):
+    socket_path = tmp_path / "daemon.sock"
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(str(socket_path))
+    stale.close()
+
+    daemon._prepare_socket_path(socket_path)
+
+    assert not socket_path.exists()
+
+
+def test_prepare_socket_path_refuses_another_users_directory(tmp_path, monkeypatch):
+    monkeypatch.setattr(daemon.os, "getuid", lambda: tmp_path.stat().st_uid + 1)
+
+    with pytest.raises(PermissionError):
+        daemon._prepare_socket_path(tmp_path / "daemon.sock")
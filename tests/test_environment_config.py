@@ -1,4 +1,23 @@
+import threading
+import time
+
+import pytest
+
 import llm_complete_command.environment_config as environment_config
+import llm_complete_command.executable_index as executable_index
+
+
+@pytest.fixture(autouse=True)
+def _isolated_config_and_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(environment_config, "_config_dir", lambda: tmp_path)
+    monkeypatch.setattr(executable_index, "_index_cache", None)
+
+
+def _current_fingerprints() -> dict[str, str]:
+    return {
+        probe_name: environment_config._section_fingerprint(probe_name)
+        for probe_name in environment_config._probe_names()
+    }
 
 
 def test_deep_merge_dicts_merges_nested_objects_without_mutating_inputs():
@@ -53,10 +72,10 @@ def test_detect_terminal_name_prefers_term_program_then_known_env_vars(monkeypat
     assert environment_config._detect_terminal_name() == "alacritty"
 
 
-def test_probe_tools_captures_available_and_missing_tools(monkeypatch):
+def test_probe_tool_captures_available_and_missing_tools(monkeypatch):
     monkeypatch.setattr(
-        environment_config.shutil,
-        "which",
+        environment_config,
+        "find_executable",
         lambda tool_name: f"/usr/bin/{tool_name}" if tool_name == "rg" else None,
     )
     monkeypatch.setattr(
@@ -65,16 +84,238 @@ def test_probe_tools_captures_available_and_missing_tools(monkeypatch):
         lambda tool_name, _args: "ripgrep 14.0" if tool_name == "rg" else "unknown",
     )
 
-    tools = environment_config._probe_tools()
-
-    assert tools["rg"] == {
+    assert environment_config._probe_tool("rg") == {
         "available": True,
         "path": "/usr/bin/rg",
         "version": "ripgrep 14.0",
     }
-    assert tools["fd"]["available"] is False
-    assert tools["fd"]["path"] == environment_config.UNKNOWN_VALUE
-    assert tools["fd"]["version"] == environment_config.UNKNOWN_VALUE
+    missing_tool = environment_config._probe_tool("fd")
+    assert missing_tool["available"] is False
+    assert missing_tool["path"] == environment_config.UNKNOWN_VALUE
+    assert missing_tool["version"] == environment_config.UNKNOWN_VALUE
+
+
+def test_probe_names_include_extra_tools_from_settings(monkeypatch):
+    monkeypatch.setattr(
+        environment_config,
+        "load_settings",
+        lambda: {"extra_probed_tools": ["kubectl", "rg", 3, "gh"]},
+    )
+
+    probe_names = environment_config._probe_names()
+
+    assert probe_names[-2:] == ["tools.kubectl", "tools.gh"]
+    assert probe_names.count("tools.rg") == 1
+
+
+def test_load_effective_environment_keeps_settings_out_of_environment(
+    tmp_path, monkeypatch
+):
+    (tmp_path / "config.yaml").write_text(
+        "os:\n  version: '24.10'\nsettings:\n  extra_probed_tools: [gh]\n"
+    )
+    monkeypatch.setattr(environment_config, "_config_dir", lambda: tmp_path)
+    monkeypatch.setattr(
+        environment_config, "_load_detected_environment", lambda: {"os": {}}
+    )
+
+    assert environment_config.load_effective_environment() == {
+        "os": {"version": "24.10"}
+    }
+    assert environment_config.load_settings() == {"extra_probed_tools": ["gh"]}
+
+
+def test_probe_environment_runs_probes_concurrently_under_one_deadline(
+    monkeypatch,
+):
+    release_slow_probe = threading.Event()
+
+    def fake_probe_tool(tool_name, _probe_version=True):
+        if tool_name == "fd":
+            release_slow_probe.wait(5)
+        time.sleep(0.05)
+        return {"available": True, "path": f"/bin/{tool_name}", "version": "1.0"}
+
+    monkeypatch.setattr(environment_config, "_probe_tool", fake_probe_tool)
+    monkeypatch.setattr(environment_config, "_probe_os", lambda: {"family": "Linux"})
+    monkeypatch.setattr(environment_config, "_probe_shell", lambda: {"name": "zsh"})
+    monkeypatch.setattr(environment_config, "_probe_terminal", lambda: {"name": "x"})
+    monkeypatch.setattr(environment_config, "ENVIRONMENT_PROBE_DEADLINE_SECONDS", 0.5)
+
+    started_at = time.monotonic()
+    environment = environment_config._probe_environment()
+    elapsed_seconds = time.monotonic() - started_at
+    release_slow_probe.set()
+
+    assert elapsed_seconds < 1.0
+    assert environment["os"] == {"family": "Linux"}
+    assert environment["tools"]["rg"]["available"] is True
+    assert environment["tools"]["fd"] == {
+        "available": False,
+        "path": environment_config.UNKNOWN_VALUE,
+        "version": environment_config.UNKNOWN_VALUE,
+    }
+    assert environment[environment_config.PENDING_PROBES_KEY] == ["tools.fd"]
+
+
+def test_probe_environment_runs_version_probes_at_once_and_extra_tools_inline(
+    monkeypatch,
+):
+    monkeypatch.setattr(
+        environment_config, "load_settings", lambda: {"extra_probed_tools": ["gh"]}
+    )
+    lock = threading.Lock()
+    running = peak = 0
+    probe_threads: dict[str, threading.Thread] = {}
+
+    def fake_probe_tool(tool_name, _probe_version=True):
+        nonlocal running, peak
+        probe_threads[tool_name] = threading.current_thread()
+        with lock:
+            running += 1
+            peak = max(peak, running)
+        time.sleep(0.1)
+        with lock:
+            running -= 1
+        return {"available": True, "path": f"/bin/{tool_name}", "version": "1.0"}
+
+    monkeypatch.setattr(environment_config, "_probe_tool", fake_probe_tool)
+    monkeypatch.setattr(environment_config, "_probe_os", lambda: {"family": "Linux"})
+    monkeypatch.setattr(environment_config, "_probe_shell", lambda: {"name": "zsh"})
+    monkeypatch.setattr(environment_config, "_probe_terminal", lambda: {"name": "x"})
+
+    environment = environment_config._probe_environment()
+
+    assert environment[environment_config.PENDING_PROBES_KEY] == []
+    assert probe_threads["gh"] is threading.current_thread()
+    assert probe_threads["rg"] is not threading.current_thread()
+    # Every version probe runs at once, so none waits for another's timeout.
+    assert peak == len(environment_config.PROBED_TOOLS)
+
+
+def test_refresh_detected_environment_retries_only_pending_probes(
+    tmp_path, monkeypatch
+):
+    detected_path = tmp_path / "config.detected.yaml"
+    monkeypatch.setattr(environment_config, "_config_dir", lambda: tmp_path)
+    monkeypatch.setattr(environment_config.time, "time", lambda: 10_000)
+    environment_config._write_yaml_dict(
+        detected_path,
+        {
+            "detected_at": 9_000,
+            "os": {"family": "Linux"},
+            "tools": {"rg": {"available": True}, "fd": {"available": False}},
+            environment_config.PENDING_PROBES_KEY: ["tools.fd"],
+            environment_config.FINGERPRINTS_KEY: _current_fingerprints(),
+        },
+    )
+    probed_tools: list[str] = []
+
+    def fake_probe_tool(tool_name, _probe_version=True):
+        probed_tools.append(tool_name)
+        return {"available": True, "path": "/bin/fd", "version": "fd 9.0"}
+
+    monkeypatch.setattr(environment_config, "_probe_tool", fake_probe_tool)
+
+    environment_config.refresh_detected_environment()
+
+    environment = environment_config._read_yaml_dict(detected_path)
+    assert probed_tools == ["fd"]
+    assert environment["detected_at"] == 9_000
+    assert environment["tools"]["fd"]["version"] == "fd 9.0"
+    assert environment[environment_config.PENDING_PROBES_KEY] == []
+
+
+def test_refresh_detected_environment_reprobes_sections_whose_fingerprint_changed(
+    tmp_path, monkeypatch
+):
+    detected_path = tmp_path / "config.detected.yaml"
+    monkeypatch.setattr(environment_config, "_config_dir", lambda: tmp_path)
+    monkeypatch.setattr(environment_config.time, "time", lambda: 10_000)
+    fingerprints = _current_fingerprints()
+    fingerprints["tools.rg"] = "/usr/bin/rg:1:1"
+    environment_config._write_yaml_dict(
+        detected_path,
+        {
+            "detected_at": 9_000,
+            "tools": {"rg": {"available": True, "version": "ripgrep 13.0"}},
+            environment_config.PENDING_PROBES_KEY: [],
+            environment_config.FINGERPRINTS_KEY: fingerprints,
+        },
+    )
+    probed_tools: list[str] = []
+
+    def fake_probe_tool(tool_name, _probe_version=True):
+        probed_tools.append(tool_name)
+        return {"available": True, "path": "/usr/bin/rg", "version": "ripgrep 14.0"}
+
+    monkeypatch.setattr(environment_config, "_probe_tool", fake_probe_tool)
+
+    assert environment_config._needs_refresh(
+        environment_config._read_yaml_dict(detected_path)
+    )
+    environment_config.refresh_detected_environment()
+
+    environment = environment_config._read_yaml_dict(detected_path)
+    assert probed_tools == ["rg"]
+    assert environment["tools"]["rg"]["version"] == "ripgrep 14.0"
+    assert environment[environment_config.FINGERPRINTS_KEY] == _current_fingerprints()
+    assert not environment_config._needs_refresh(environment)
+
+
+def test_file_fingerprint_changes_when_binary_is_replaced(tmp_path):
+    binary_path = tmp_path / "rg"
+    binary_path.write_text("old")
+    original_fingerprint = environment_config._file_fingerprint(binary_path)
+
+    replacement_path = tmp_path / "rg.new"
+    replacement_path.write_text("new")
+    replacement_path.replace(binary_path)
+
+    assert environment_config._file_fingerprint(binary_path) != original_fingerprint
+    assert environment_config._file_fingerprint(tmp_path / "missing").endswith(
+        environment_config.MISSING_FINGERPRINT
+    )
+
+
+def test_load_detected_environment_serves_stale_snapshot_and_refreshes_in_background(
+    tmp_path, monkeypatch
+):
+    detected_path = tmp_path / "config.detected.yaml"
+    stale_environment = {
+        "detected_at": 1,
+        "os": {"family": "Linux"},
+        environment_config.PENDING_PROBES_KEY: [],
+    }
+    environment_config._write_yaml_dict(detected_path, stale_environment)
+    monkeypatch.setattr(environment_config, "_config_dir", lambda: tmp_path)
+    monkeypatch.setattr(
+        environment_config,
+        "_probe_environment",
+        lambda *_args: (_ for _ in ()).throw(AssertionError("probed on keypress")),
+    )
+    spawned_commands: list[list[str]] = []
+    monkeypatch.setattr(
+        environment_config.subprocess,
+        "Popen",
+        lambda command, **_kwargs: spawned_commands.append(command),
+    )
+
+    assert environment_config._load_detected_environment() == stale_environment
+    assert environment_config._load_detected_environment() == stale_environment
+    assert spawned_commands == [
+        [environment_config.sys.executable, *environment_config.REFRESH_COMMAND]
+    ]
+
+
+def test_write_yaml_dict_replaces_file_without_leaving_temporary_files(tmp_path):
+    detected_path = tmp_path / "config.detected.yaml"
+    detected_path.write_text("old: true\n")
+
+    environment_config._write_yaml_dict(detected_path, {"new": True})
+
+    assert environment_config._read_yaml_dict(detected_path) == {"new": True}
+    assert [path.name for path in tmp_path.iterdir()] == ["config.detected.yaml"]
 
 
 def test_load_effective_environment_merges_detected_and_override(monkeypatch):
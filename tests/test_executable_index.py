@@ -0,0 +1,75 @@
+import os
+
+import llm_complete_command.executable_index as executable_index
+
+
+def _make_executable(path):
+    path.write_text("#!/bin/sh\n")
+    path.chmod(0o755)
+
+
+def _use_index_at(tmp_path, monkeypatch, path_directories):
+    monkeypatch.setenv("PATH", os.pathsep.join(str(d) for d in path_directories))
+    monkeypatch.setattr(executable_index, "_index_cache", None)
+
+
+def test_find_executable_prefers_earlier_path_entries(tmp_path, monkeypatch):
+    first_bin = tmp_path / "first"
+    second_bin = tmp_path / "second"
+    first_bin.mkdir()
+    second_bin.mkdir()
+    _make_executable(first_bin / "rg")
+    _make_executable(second_bin / "rg")
+    _make_executable(second_bin / "fd")
+    (second_bin / "notes.txt").write_text("not executable")
+    _use_index_at(tmp_path, monkeypatch, [first_bin, second_bin])
+
+    assert executable_index.find_executable("rg") == str(first_bin / "rg")
+    assert executable_index.find_executable("fd") == str(second_bin / "fd")
+    assert executable_index.find_executable("notes.txt") is None
+    assert executable_index.find_executable("missing") is None
+
+
+def test_index_is_reused_from_disk_until_a_path_directory_changes(
+    tmp_path, monkeypatch
+):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    _make_executable(bin_dir / "rg")
+    _use_index_at(tmp_path, monkeypatch, [bin_dir])
+    assert executable_index.find_executable("rg") is not None
+
+    scans: list[str] = []
+    original_build_index = executable_index._build_index
+
+    def counting_build_index(directories):
+        scans.append("scan")
+        return original_build_index(directories)
+
+    monkeypatch.setattr(executable_index, "_build_index", counting_build_index)
+    monkeypatch.setattr(executable_index, "_index_cache", None)
+
+    assert executable_index.find_executable("rg") == str(bin_dir / "rg")
+    assert scans == []
+
+    _make_executable(bin_dir / "fd")
+    stat_result = bin_dir.stat()
+    os.utime(bin_dir, ns=(stat_result.st_atime_ns, stat_result.st_mtime_ns + 1_000))
+
+    assert executable_index.find_executable("fd") == str(bin_dir / "fd")
+    assert scans == ["scan"]
+
+
+def test_index_file_names_each_directory_once(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    for name in ("rg", "fd", "jq"):
+        _make_executable(bin_dir / name)
+    _use_index_at(tmp_path, monkeypatch, [bin_dir])
+
+    assert executable_index.find_executable("jq") == str(bin_dir / "jq")
+
+    stored = executable_index.cache_file_path(
+        executable_index.INDEX_FILE_NAME
+    ).read_text()
+    assert stored.count(str(bin_dir)) == 1
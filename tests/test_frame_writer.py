@@ -0,0 +1,54 @@
+import threading
+
+import llm_complete_command.frame_writer as frame_writer
+
+
+def test_first_chunk_is_written_immediately_and_rest_coalesced(monkeypatch):
+    monkeypatch.setattr(frame_writer.time, "monotonic", lambda: 100.0)
+    frames: list[str] = []
+    writer = frame_writer.CoalescingChunkWriter(frames.append, frame_seconds=60)
+
+    writer.write("ca")
+    writer.write("t ")
+    writer.write("<<E")
+
+    assert frames == ["ca"]
+
+    writer.close()
+
+    assert frames == ["ca", "t <<E"]
+
+
+def test_chunks_after_frame_interval_flush_inline(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(frame_writer.time, "monotonic", lambda: clock[0])
+    frames: list[str] = []
+    writer = frame_writer.CoalescingChunkWriter(frames.append, frame_seconds=0.016)
+
+    writer.write("a")
+    clock[0] += 0.005
+    writer.write("b")
+    clock[0] += 0.02
+    writer.write("c")
+    writer.close()
+
+    assert frames == ["a", "bc"]
+
+
+def test_timer_flushes_pending_text_when_stream_pauses():
+    flushed = threading.Event()
+    frames: list[str] = []
+
+    def emit(frame: str) -> None:
+        frames.append(frame)
+        if len(frames) == 2:
+            flushed.set()
+
+    writer = frame_writer.CoalescingChunkWriter(emit, frame_seconds=0.01)
+    writer.write("first")
+    writer.write(" second")
+
+    assert flushed.wait(timeout=2)
+    assert frames == ["first", " second"]
+    writer.close()
+    assert frames == ["first", " second"]
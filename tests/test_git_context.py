@@ -0,0 +1,132 @@
+import subprocess
+import time
+
+import pytest
+
+import llm_complete_command.git_context as git_context
+
+
+@pytest.fixture(autouse=True)
+def _isolated_cache(monkeypatch):
+    monkeypatch.setattr(git_context, "cached_settings", lambda: {})
+
+
+def _git(repository, *args):
+    subprocess.run(
+        [
+            "git",
+            "-c",
+            "user.name=Test",
+            "-c",
+            "user.email=test@example.com",
+            "-C",
+            str(repository),
+            *args,
+        ],
+        check=True,
+        capture_output=True,
+    )
+
+
+@pytest.fixture
+def repository(tmp_path):
+    repository = tmp_path / "repository"
+    repository.mkdir()
+    _git(repository, "init", "-b", "main")
+    (repository / "app.py").write_text("print('hello')\n")
+    _git(repository, "add", "app.py")
+    _git(repository, "commit", "-m", "Add app")
+    (repository / "README.md").write_text("# app\n")
+    _git(repository, "add", "README.md")
+    _git(repository, "commit", "-m", "Add readme")
+    _git(repository, "config", "branch.main.remote", "origin")
+    _git(repository, "config", "branch.main.merge", "refs/heads/main")
+    return repository
+
+
+def test_git_context_describes_branch_changes_and_recent_commits(repository):
+    (repository / "app.py").write_text("print('changed')\n")
+    (repository / "notes.txt").write_text("todo\n")
+    (repository / "src").mkdir()
+
+    context = git_context.git_context(str(repository / "src"))
+
+    lines = context.splitlines()
+    assert lines[0] == f"Git repository: {repository}"
+    assert lines[1] == "- branch: main (tracking origin/main)"
+    assert lines[2].startswith("- HEAD: ") and len(lines[2]) == 8 + 12
+    assert lines[3:] == [
+        "- working tree: 1 modified, 1 untracked",
+        "- recent commits:",
+        "  - Add readme",
+        "  - Add app",
+    ]
+
+
+def test_git_context_resolves_packed_refs_and_detached_head(repository):
+    _git(repository, "pack-refs", "--all")
+    packed_context = git_context.git_context(str(repository))
+    head_line = packed_context.splitlines()[2]
+
+    _git(repository, "checkout", "--detach", "HEAD~1")
+    detached_context = git_context.git_context(str(repository))
+
+    assert head_line.startswith("- HEAD: ") and len(head_line) == 8 + 12
+    assert detached_context.splitlines()[1] == "- branch: none (detached HEAD)"
+    assert detached_context.splitlines()[2] != head_line
+
+
+def test_git_context_is_cached_until_index_or_head_changes(repository, monkeypatch):
+    git_context.git_context(str(repository))
+    popen = subprocess.Popen
+    spawned: list[str] = []
+
+    def recording_popen(args, **kwargs):
+        # The test's own git calls pass -c first and are not counted.
+        if args[1] == "-C":
+            spawned.append(args[3])
+        return popen(args, **kwargs)
+
+    monkeypatch.setattr(git_context.subprocess, "Popen", recording_popen)
+
+    git_context.git_context(str(repository))
+    assert spawned == []
+
+    (repository / "app.py").write_text("print('staged')\n")
+    _git(repository, "add", "app.py")
+    context = git_context.git_context(str(repository))
+
+    assert spawned == ["status", "log"]
+    assert "- working tree: 1 staged" in context
+
+
+def test_git_context_keeps_file_details_when_git_misses_deadline(
+    repository, tmp_path, monkeypatch
+):
+    slow_git = tmp_path / "slow-git"
+    slow_git.write_text("#!/bin/sh\nexec sleep 5\n")
+    slow_git.chmod(0o755)
+    monkeypatch.setattr(git_context, "GIT_EXECUTABLE", str(slow_git))
+    monkeypatch.setattr(git_context, "GIT_DEADLINE_SECONDS", 0.05)
+
+    started_at = time.monotonic()
+    lines = git_context.git_context(str(repository)).splitlines()
+
+    assert time.monotonic() - started_at < 1
+    assert lines[1] == "- branch: main (tracking origin/main)"
+    assert lines[3:] == ["- working tree: unknown"]
+
+
+def test_git_context_is_empty_outside_a_repository_or_when_disabled(
+    tmp_path, repository, monkeypatch
+):
+    outside = tmp_path / "outside"
+    outside.mkdir()
+    assert git_context.git_context(str(outside)) == ""
+
+    monkeypatch.setattr(
+        git_context,
+        "cached_settings",
+        lambda: {git_context.GIT_CONTEXT_SETTING: False},
+    )
+    assert git_context.git_context(str(repository)) == ""
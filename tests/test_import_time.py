@@ -0,0 +1,81 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+from conftest import SRC_PATH
+
+
+PLUGIN_IMPORT_BUDGET_MICROSECONDS = 30_000
+CLIENT_IMPORT_BUDGET_MICROSECONDS = 75_000
+DEFERRED_MODULES = (
+    "better_exceptions",
+    "loguru",
+    "platformdirs",
+    "prompt_toolkit",
+    "yaml",
+)
+
+
+def _import_profile(
+    preload: str, module: str, pycache_dir: Path
+) -> tuple[int, set[str]]:
+    code = (
+        f"import sys\n{preload}\nbefore = set(sys.modules)\nimport {module}\n"
+        "print('\\n'.join(sorted(set(sys.modules) - before)))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+        # Installed packages import from cached bytecode, so measure that rather
+        # than compile time when the environment disables writing .pyc files.
+        env={
+            **{
+                name: value
+                for name, value in os.environ.items()
+                if name != "PYTHONDONTWRITEBYTECODE"
+            },
+            "PYTHONPATH": str(SRC_PATH),
+            "PYTHONPYCACHEPREFIX": str(pycache_dir),
+        },
+    )
+
+    cumulative_microseconds = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _self_time, cumulative, name = line.removeprefix("import time:").split("|")
+        if name.strip() == module:
+            cumulative_microseconds = int(cumulative)
+
+    return cumulative_microseconds, set(result.stdout.split())
+
+
+def _best_of(
+    attempts: int, preload: str, module: str, pycache_dir: Path
+) -> tuple[int, set[str]]:
+    profiles = [_import_profile(preload, module, pycache_dir) for _ in range(attempts)]
+    return min(profiles, key=lambda profile: profile[0])
+
+
+def test_plugin_import_defers_heavy_dependencies_and_stays_within_budget(tmp_path):
+    import_time, imported_modules = _best_of(
+        3, "import llm", "llm_complete_command", tmp_path
+    )
+
+    assert not {module.split(".")[0] for module in imported_modules} & set(
+        DEFERRED_MODULES
+    )
+    assert 0 < import_time <= PLUGIN_IMPORT_BUDGET_MICROSECONDS
+
+
+def test_client_import_skips_llm_and_stays_within_budget(tmp_path):
+    import_time, imported_modules = _best_of(
+        3, "", "llm_complete_command_client", tmp_path
+    )
+
+    assert "llm" not in imported_modules
+    assert "platformdirs" not in imported_modules
+    assert 0 < import_time <= CLIENT_IMPORT_BUDGET_MICROSECONDS
@@ -0,0 +1,156 @@
+import json
+
+import pytest
+
+import llm_complete_command.latency_stats as latency_stats
+from llm_complete_command.atomic_file import cache_file_path
+
+
+@pytest.fixture(autouse=True)
+def _isolated_latency(tmp_path, monkeypatch):
+    monkeypatch.setattr(latency_stats, "_pending_first_tokens", [])
+    monkeypatch.setattr(latency_stats, "_pending_generations", [])
+
+
+def test_timed_chunks_records_first_token_and_completed_stream(monkeypatch):
+    clock = iter([10.0, 10.75, 12.0])
+    monkeypatch.setattr(latency_stats.time, "monotonic", lambda: next(clock))
+
+    chunks = list(
+        latency_stats.timed_chunks(
+            ["ls", " -la"], "model-a", revision_round=1, temperature_retry=True
+        )
+    )
+
+    assert chunks == ["ls", " -la"]
+    assert latency_stats._pending_first_tokens == [("model-a", 0.75)]
+    assert latency_stats._pending_generations == [
+        latency_stats.GenerationRecord("model-a", 2.0, 2, 6, 1, True, 0.75)
+    ]
+
+
+def test_timed_chunks_skips_generation_record_for_abandoned_stream():
+    stream = latency_stats.timed_chunks(iter(["ls", " -la"]), "model-a")
+
+    assert next(stream) == "ls"
+    stream.close()
+
+    assert len(latency_stats._pending_first_tokens) == 1
+    assert latency_stats._pending_generations == []
+
+
+def test_flush_latency_records_writes_daily_histograms(monkeypatch):
+    monkeypatch.setattr(latency_stats.time, "strftime", lambda _format: "2026-10-17")
+    latency_stats.note_first_token("model-a", 0.3)
+    latency_stats._pending_generations.append(
+        latency_stats.GenerationRecord("model-a", 1.5, 4, 20, 0, False, 0.3, 1200, 1024)
+    )
+
+    latency_stats.flush_latency_records()
+
+    assert latency_stats._pending_first_tokens == []
+    assert latency_stats._pending_generations == []
+    stats = json.loads(cache_file_path(latency_stats.CACHE_FILE_NAME).read_text())
+    model_day = stats["days"]["2026-10-17"]["model-a"]
+    assert model_day["generations"] == 1
+    assert model_day["temperature_retries"] == 0
+    assert model_day["input_tokens"] == 1200
+    assert model_day["cached_input_tokens"] == 1024
+    for metric, bounds in latency_stats.METRIC_BUCKETS.items():
+        assert len(model_day[metric]) == len(bounds) + 1
+        assert sum(model_day[metric]) == 1
+
+
+def test_flush_latency_records_keeps_bounded_number_of_days(monkeypatch):
+    monkeypatch.setattr(latency_stats, "HISTOGRAM_RETENTION_DAYS", 2)
+    for day in ("2026-10-15", "2026-10-16", "2026-10-17"):
+        monkeypatch.setattr(latency_stats.time, "strftime", lambda _format: day)
+        latency_stats.note_first_token("model-a", 0.3)
+        latency_stats.flush_latency_records()
+
+    days = latency_stats._read_days(cache_file_path(latency_stats.CACHE_FILE_NAME))
+
+    assert sorted(days) == ["2026-10-16", "2026-10-17"]
+
+
+def test_first_token_percentile_requires_enough_samples(monkeypatch):
+    monkeypatch.setattr(latency_stats, "MIN_SAMPLES_FOR_PERCENTILE", 5)
+    for seconds in (0.4, 0.5, 0.6, 0.7):
+        latency_stats.note_first_token("model-a", seconds)
+    latency_stats.flush_latency_records()
+
+    assert latency_stats.first_token_percentile("model-a", 95) is None
+
+    latency_stats.note_first_token("model-a", 9.0)
+    latency_stats.flush_latency_records()
+
+    bounds = latency_stats.METRIC_BUCKETS[latency_stats.FIRST_TOKEN_METRIC]
+    p95 = latency_stats.first_token_percentile("model-a", 95)
+    p50 = latency_stats.first_token_percentile("model-a", 50)
+    assert p95 in bounds and 9.0 <= p95 < 9.0 * 1.25
+    assert p50 in bounds and 0.6 <= p50 < 0.6 * 1.25
+
+
+def test_format_latency_report_lists_percentiles_per_model():
+    assert latency_stats.format_latency_report() == "No completions recorded yet."
+
+    latency_stats.note_first_token("model-a", 0.3)
+    latency_stats._pending_generations.append(
+        latency_stats.GenerationRecord("model-a", 1.5, 4, 20, 0, True)
+    )
+    latency_stats.flush_latency_records()
+
+    report = latency_stats.format_latency_report().splitlines()
+
+    assert report[0] == "model-a (1 generations, 1 temperature retries)"
+    assert report[1].startswith("  first token    p50 ")
+    assert "p90" in report[1] and "p99" in report[1]
+    assert [line.split()[0] for line in report[2:]] == [
+        "stream",
+        "chunks",
+        "characters",
+        "revision",
+    ]
+
+
+class _FakeUsageResponse:
+    def __init__(self, input_tokens, token_details):
+        self.input_tokens = input_tokens
+        self.token_details = token_details
+
+
+def test_timed_chunks_reads_cached_tokens_from_response_usage():
+    openai_response = _FakeUsageResponse(
+        1500, {"prompt_tokens_details": {"cached_tokens": 1280}}
+    )
+    anthropic_response = _FakeUsageResponse(
+        20, {"cache_read_input_tokens": 1400, "cache_creation_input_tokens": 0}
+    )
+
+    list(latency_stats.timed_chunks(["ls"], "model-a", usage_from=openai_response))
+    list(latency_stats.timed_chunks(["ls"], "model-b", usage_from=anthropic_response))
+    list(latency_stats.timed_chunks(["ls"], "model-c", usage_from=object()))
+
+    assert [
+        (record.input_tokens, record.cached_input_tokens)
+        for record in latency_stats._pending_generations
+    ] == [(1500, 1280), (1420, 1400), (None, None)]
+
+
+def test_format_latency_report_shows_cached_input_share():
+    latency_stats._pending_generations.extend(
+        [
+            latency_stats.GenerationRecord(
+                "model-a", 1.0, 2, 9, 0, False, 0.4, 1000, 0
+            ),
+            latency_stats.GenerationRecord(
+                "model-a", 0.8, 2, 9, 0, False, 0.2, 1000, 900
+            ),
+        ]
+    )
+    latency_stats.flush_latency_records()
+
+    report = latency_stats.format_latency_report().splitlines()
+
+    assert report[1].startswith("  first (cached) p50 0.24s")
+    assert report[-1] == "  cached input   900 of 2000 tokens (45%)"
@@ -1,6 +1,12 @@
 import re
 
+import llm
+import pytest
+
 import llm_complete_command as plugin
+import llm_complete_command.prompt_index as prompt_index
+import llm_complete_command.request_context as request_context
+import llm_complete_command.response_cache as response_cache
 
 
 ANSI_ESCAPE_PATTERN = re.compile(r"\x1b\[[0-9;]*m")
@@ -64,11 +70,16 @@ def test_write_terminal_falls_back_to_write_when_write_raw_missing():
 
 
 class _FakeModel:
+    Options: type[llm.Options] = llm.Options
+
     def __init__(self, model_id: str):
         self.model_id = model_id
 
 
 class _FakeConversation:
+    # Only set by tests that exercise the history-length checks.
+    responses: list[object]
+
     def __init__(self, model_id: str = "test-model"):
         self.model = _FakeModel(model_id)
         self.prompt_calls: list[tuple[str, dict[str, object]]] = []
@@ -232,3 +243,434 @@ def test_generate_command_text_reraises_original_error_when_no_retry(monkeypatch
         raise AssertionError("Expected SomeStreamError")
 
     assert len(conversation.prompt_calls) == 1
+
+
+class _FakeTerminal:
+    def __init__(self, feedback: list[str]):
+        self.written: list[str] = []
+        self._feedback = feedback
+
+    def write(self, text: str) -> None:
+        self.written.append(text)
+
+    def read_feedback(self) -> str:
+        return self._feedback.pop(0)
+
+
+def test_run_completion_session_replays_cached_command_through_chunk_writer(
+    monkeypatch,
+):
+    conversation = _FakeConversation("model-delta")
+    lookups: list[str] = []
+
+    def fake_get_cached_response(key):
+        lookups.append(key)
+        return "kill $(lsof -t -i :8080)"
+
+    monkeypatch.setattr(plugin, "get_cached_response", fake_get_cached_response)
+    monkeypatch.setattr(
+        plugin,
+        "_generate_command_text",
+        lambda *_args, **_kwargs: (_ for _ in ()).throw(AssertionError("model used")),
+    )
+    terminal = _FakeTerminal([""])
+
+    command = plugin.run_completion_session(
+        conversation, "kill whatever is on port 8080", "system", terminal
+    )
+
+    assert command == "kill $(lsof -t -i :8080)"
+    assert terminal.written[:2] == [plugin.COMMAND_PROMPT, command]
+    assert lookups == [
+        plugin.response_cache_key(
+            "model-delta",
+            "system",
+            "kill whatever is on port 8080",
+            request_context.request_context_key(),
+        )
+    ]
+
+
+def test_run_completion_session_replays_prefetched_command(monkeypatch):
+    conversation = _FakeConversation("model-delta")
+    response_cache.store_prefetched_response(
+        response_cache.response_cache_key(
+            "model-delta",
+            "system",
+            "show folder sizes",
+            request_context.request_context_key(),
+        ),
+        "du -sh *",
+    )
+    monkeypatch.setattr(
+        plugin,
+        "_generate_command_text",
+        lambda *_args, **_kwargs: (_ for _ in ()).throw(AssertionError("model used")),
+    )
+
+    command = plugin.run_completion_session(
+        conversation, "show folder sizes", "system", _FakeTerminal([""])
+    )
+
+    assert command == "du -sh *"
+
+
+def test_run_completion_session_revises_replayed_command_with_full_context(
+    monkeypatch,
+):
+    conversation = _FakeConversation("model-delta")
+    monkeypatch.setattr(plugin, "get_cached_response", lambda _key: "du -sh *")
+    generated_prompts: list[str] = []
+
+    def fake_generate_command_text(_conversation, prompt, _system, **_kwargs):
+        generated_prompts.append(prompt)
+        return "du -sh * | sort -h"
+
+    monkeypatch.setattr(plugin, "_generate_command_text", fake_generate_command_text)
+    terminal = _FakeTerminal(["sort by size", ""])
+
+    command = plugin.run_completion_session(
+        conversation, "show folder sizes", "system", terminal
+    )
+
+    assert command == "du -sh * | sort -h"
+    assert generated_prompts == [
+        "show folder sizes\n\nPrevious command:\ndu -sh *\n\n"
+        "Revision instructions:\nsort by size"
+    ]
+
+
+def test_run_completion_session_sends_request_context_after_system_prompt(
+    monkeypatch,
+):
+    conversation = _FakeConversation("model-delta")
+    lookups: list[str] = []
+    monkeypatch.setattr(plugin, "get_cached_response", lookups.append)
+    monkeypatch.setattr(
+        plugin, "find_similar_completion", lambda _prompt, _context_key: None
+    )
+    monkeypatch.setattr(plugin, "cached_settings", lambda: {})
+    monkeypatch.setattr(
+        request_context,
+        "shell_history_context",
+        lambda prompt, _settings, _histfile: (
+            f"History for {prompt}:\n- ssh -p 2222 web1"
+        ),
+    )
+    monkeypatch.setattr(
+        request_context,
+        "working_directory_context",
+        lambda cwd, _settings: f"Directory {cwd}",
+    )
+    monkeypatch.setattr(
+        request_context, "git_context", lambda cwd, _settings: f"Git in {cwd}"
+    )
+    generated_systems: list[str] = []
+
+    def fake_generate_command_text(_conversation, _prompt, system, **_kwargs):
+        generated_systems.append(system)
+        return "ssh -p 2222 web2"
+
+    monkeypatch.setattr(plugin, "_generate_command_text", fake_generate_command_text)
+
+    plugin.run_completion_session(
+        conversation,
+        "ssh to web2",
+        "system",
+        _FakeTerminal(["as root", ""]),
+        cwd="/srv/app",
+    )
+
+    assert (
+        generated_systems
+        == [
+            "system\n\nDirectory /srv/app\n\nGit in /srv/app\n\n"
+            "History for ssh to web2:\n- ssh -p 2222 web1"
+        ]
+        * 2
+    )
+    assert lookups == [
+        plugin.response_cache_key(
+            "model-delta",
+            "system",
+            "ssh to web2",
+            request_context.request_context_key("/srv/app", {}),
+        )
+    ]
+
+
+def test_run_completion_session_skips_cache_lookup_when_disabled(monkeypatch):
+    conversation = _FakeConversation("model-delta")
+    monkeypatch.setattr(
+        plugin,
+        "get_cached_response",
+        lambda _key: (_ for _ in ()).throw(AssertionError("cache used")),
+    )
+    monkeypatch.setattr(
+        plugin, "_generate_command_text", lambda *_args, **_kwargs: "ls"
+    )
+
+    command = plugin.run_completion_session(
+        conversation, "list", "system", _FakeTerminal([""]), use_cache=False
+    )
+
+    assert command == "ls"
+
+
+def test_run_completion_session_offers_similar_completion_on_cache_miss(
+    monkeypatch,
+):
+    conversation = _FakeConversation("model-delta")
+    monkeypatch.setattr(plugin, "get_cached_response", lambda _key: None)
+    monkeypatch.setattr(
+        plugin,
+        "_generate_command_text",
+        lambda *_args, **_kwargs: (_ for _ in ()).throw(AssertionError("model used")),
+    )
+    prompt_index.add_accepted_completion(
+        "show folder sizes", "du -sh *", request_context.request_context_key()
+    )
+    terminal = _FakeTerminal([""])
+
+    command = plugin.run_completion_session(
+        conversation, "show the folder sizes", "system", terminal
+    )
+
+    assert command == "du -sh *"
+    assert terminal.written[:3] == [
+        plugin.SIMILAR_PROMPT_NOTE.format(prompt="show folder sizes"),
+        plugin.COMMAND_PROMPT,
+        "du -sh *",
+    ]
+
+
+def test_run_completion_session_revises_similar_completion_with_model(monkeypatch):
+    conversation = _FakeConversation("model-delta")
+    monkeypatch.setattr(plugin, "get_cached_response", lambda _key: None)
+    generated_prompts: list[str] = []
+
+    def fake_generate_command_text(_conversation, prompt, _system, **_kwargs):
+        generated_prompts.append(prompt)
+        return "du -sh .[!.]*"
+
+    monkeypatch.setattr(plugin, "_generate_command_text", fake_generate_command_text)
+    prompt_index.add_accepted_completion(
+        "show folder sizes", "du -sh *", request_context.request_context_key()
+    )
+    terminal = _FakeTerminal(["hidden folders only", ""])
+
+    command = plugin.run_completion_session(
+        conversation, "show hidden folder sizes", "system", terminal
+    )
+
+    assert command == "du -sh .[!.]*"
+    assert generated_prompts == [
+        "show hidden folder sizes\n\nPrevious command:\ndu -sh *\n\n"
+        "Revision instructions:\nhidden folders only"
+    ]
+
+
+def test_remember_accepted_command_adds_prompt_to_index(monkeypatch):
+    monkeypatch.setattr(plugin, "store_response", lambda _key, _command: None)
+
+    plugin.remember_accepted_command(
+        _FakeConversation("model-delta"), "list files", "system", "ls"
+    )
+
+    assert prompt_index.find_similar_completion(
+        "list all files", request_context.request_context_key()
+    ) == (
+        "list files",
+        "ls",
+    )
+
+
+def test_accepted_command_is_replayed_only_in_its_directory(tmp_path, monkeypatch):
+    monkeypatch.setattr(request_context, "git_context", lambda _cwd, _settings: "")
+    generated: list[str] = []
+
+    def fake_generate_command_text(_conversation, _prompt, _system, **_kwargs):
+        generated.append("model")
+        return "pytest"
+
+    monkeypatch.setattr(plugin, "_generate_command_text", fake_generate_command_text)
+    conversation = _FakeConversation("model-delta")
+    first, second = tmp_path / "first", tmp_path / "second"
+    first.mkdir()
+    second.mkdir()
+    plugin.remember_accepted_command(
+        conversation, "run the tests here", "system", "make test", str(first)
+    )
+
+    replayed = plugin.run_completion_session(
+        conversation,
+        "run the tests here",
+        "system",
+        _FakeTerminal([""]),
+        cwd=str(first),
+    )
+    generated_elsewhere = plugin.run_completion_session(
+        conversation,
+        "run the tests here",
+        "system",
+        _FakeTerminal([""]),
+        cwd=str(second),
+    )
+
+    assert replayed == "make test"
+    assert generated_elsewhere == "pytest"
+    assert generated == ["model"]
+
+
+def test_accepted_command_is_replayed_only_on_its_branch(tmp_path, monkeypatch):
+    monkeypatch.setattr(request_context, "git_context", lambda _cwd, _settings: "")
+    generated: list[str] = []
+
+    def fake_generate_command_text(_conversation, _prompt, _system, **_kwargs):
+        generated.append("model")
+        return "git push -u origin feature"
+
+    monkeypatch.setattr(plugin, "_generate_command_text", fake_generate_command_text)
+    conversation = _FakeConversation("model-delta")
+    (tmp_path / ".git").mkdir()
+    head = tmp_path / ".git" / "HEAD"
+    head.write_text("ref: refs/heads/main\n")
+    plugin.remember_accepted_command(
+        conversation, "push this branch", "system", "git push", str(tmp_path)
+    )
+    head.write_text("ref: refs/heads/feature\n")
+
+    command = plugin.run_completion_session(
+        conversation,
+        "push this branch now",
+        "system",
+        _FakeTerminal([""]),
+        cwd=str(tmp_path),
+    )
+
+    assert command == "git push -u origin feature"
+    assert generated == ["model"]
+
+
+def test_run_completion_session_coalesces_streamed_chunks(monkeypatch):
+    conversation = _FakeConversation("model-delta")
+
+    def fake_generate_command_text(_conversation, _prompt, _system, **kwargs):
+        for chunk in ["echo one", "\n", "echo", " two"]:
+            kwargs["write_chunk"](chunk)
+        return "echo one\necho two"
+
+    monkeypatch.setattr(plugin, "_generate_command_text", fake_generate_command_text)
+    monkeypatch.setattr(plugin.frame_writer.time, "monotonic", lambda: 100.0)
+    terminal = _FakeTerminal([""])
+
+    plugin.run_completion_session(
+        conversation, "two echoes", "system", terminal, use_cache=False
+    )
+
+    assert terminal.written[1:3] == [
+        "echo one",
+        f"\n{plugin.FEEDBACK_PROMPT}echo two",
+    ]
+
+
+def test_run_completion_session_revises_stream_cut_short_with_full_context(
+    monkeypatch,
+):
+    conversation = _FakeConversation("model-delta")
+    conversation.responses = []
+    generated_prompts: list[str] = []
+
+    def fake_generate_command_text(generating, prompt, _system, **_kwargs):
+        generated_prompts.append(prompt)
+        if len(generated_prompts) == 2:
+            generating.responses.append(prompt)
+        return "ls -la" if len(generated_prompts) == 1 else "ls -lah"
+
+    monkeypatch.setattr(plugin, "_generate_command_text", fake_generate_command_text)
+    terminal = _FakeTerminal(["human sizes", "sort by size", ""])
+
+    plugin.run_completion_session(
+        conversation, "list files", "system", terminal, use_cache=False
+    )
+
+    assert generated_prompts == [
+        "list files",
+        "list files\n\nPrevious command:\nls -la\n\nRevision instructions:\n"
+        "human sizes",
+        "sort by size",
+    ]
+
+
+class _HistoryModel:
+    model_id = "model-history"
+
+    def __init__(self):
+        self.payload_sizes: list[int] = []
+
+    def conversation(self):
+        return _HistoryConversation(self)
+
+
+class _HistoryConversation:
+    # Re-sends every earlier turn with each prompt, like an llm conversation.
+    def __init__(self, model: _HistoryModel):
+        self.model = model
+        self.responses: list[tuple[str, str]] = []
+
+    def prompt(self, prompt: str, **_kwargs):
+        history = sum(len(sent) + len(received) for sent, received in self.responses)
+        self.model.payload_sizes.append(history + len(prompt))
+        return self._stream(prompt)
+
+    def _stream(self, prompt: str):
+        command = f"find . -name '*.log' -mtime +{len(self.responses)} -delete"
+        yield command
+        self.responses.append((prompt, command))
+
+
+@pytest.mark.parametrize("budget", [0, 150])
+def test_revision_payload_stays_bounded_by_token_budget(monkeypatch, budget):
+    model = _HistoryModel()
+    monkeypatch.setattr(
+        plugin, "cached_settings", lambda: {"revision_token_budget": budget}
+    )
+    feedback = [f"keep logs from the last {days} days" for days in range(12)]
+    terminal = _FakeTerminal([*feedback, ""])
+
+    plugin.run_completion_session(
+        model.conversation(),
+        "delete old log files",
+        "system",
+        terminal,
+        collect=plugin._collect_without_spinner,
+        use_cache=False,
+    )
+
+    later_rounds = model.payload_sizes[5:]
+    if budget:
+        assert max(later_rounds) <= budget * plugin.CHARACTERS_PER_TOKEN
+    else:
+        assert later_rounds == sorted(later_rounds)
+        assert later_rounds[-1] > 3 * later_rounds[0] / 2
+
+
+def test_prompt_with_temperature_passes_cache_hint_when_model_supports_it():
+    class CachingOptions(llm.Options):
+        cache: bool | None = None
+
+    conversation = _FakeConversation("model-cache")
+    conversation.model.Options = CachingOptions
+
+    plugin._prompt_with_temperature(
+        conversation, "list files", "system", use_temperature=False
+    )
+    plain_conversation = _FakeConversation("model-plain")
+    plugin._prompt_with_temperature(
+        plain_conversation, "list files", "system", use_temperature=False
+    )
+
+    assert conversation.prompt_calls == [
+        ("list files", {"system": "system", "cache": True})
+    ]
+    assert plain_conversation.prompt_calls == [("list files", {"system": "system"})]
@@ -1,11 +1,35 @@
 import json
+import subprocess
+import sys
 
+import pytest
+
+from conftest import SRC_PATH
+
+import llm_complete_command.model_capabilities_cache as model_cache
+from llm_complete_command.atomic_file import cache_file_path
+
+
+STRESS_WORKER_SCRIPT = """
+import sys
+
+sys.path.insert(0, sys.argv[1])
 import llm_complete_command.model_capabilities_cache as model_cache
 
+# The cache directory comes from XDG_CACHE_HOME, inherited from the test.
+worker = sys.argv[2]
+for index in range(int(sys.argv[3])):
+    model_cache.set_model_capability(f"model-{worker}-{index}", "supports_temperature", True)
+    model_cache.set_model_capability("shared-model", f"capability-{worker}", True)
+"""
+
+
+@pytest.fixture(autouse=True)
+def _fresh_snapshot(monkeypatch):
+    monkeypatch.setattr(model_cache, "_cache_snapshot", None)
+
 
 def test_set_and_get_model_capability_round_trip(tmp_path, monkeypatch):
-    cache_path = tmp_path / "model-capabilities.json"
-    monkeypatch.setattr(model_cache, "_cache_file_path", lambda: cache_path)
     monkeypatch.setattr(model_cache.time, "time", lambda: 1_000)
 
     model_cache.set_model_capability("model-a", "supports_temperature", True)
@@ -16,8 +40,6 @@ def test_set_and_get_model_capability_round_trip(tmp_path, monkeypatch):
 
 
 def test_get_model_capability_returns_none_when_expired(tmp_path, monkeypatch):
-    cache_path = tmp_path / "model-capabilities.json"
-    monkeypatch.setattr(model_cache, "_cache_file_path", lambda: cache_path)
     monkeypatch.setattr(model_cache.time, "time", lambda: 1_000)
 
     model_cache.set_model_capability("model-a", "supports_temperature", False)
@@ -32,16 +54,15 @@ def test_get_model_capability_returns_none_when_expired(tmp_path, monkeypatch):
 
 
 def test_read_cache_recovers_from_invalid_json(tmp_path, monkeypatch):
-    cache_path = tmp_path / "model-capabilities.json"
+    cache_path = cache_file_path(model_cache.CACHE_FILE_NAME)
     cache_path.write_text("{not-valid-json")
-    monkeypatch.setattr(model_cache, "_cache_file_path", lambda: cache_path)
 
     value = model_cache._read_cache()
     assert value == {model_cache.MODEL_CAPABILITIES_KEY: {}}
 
 
 def test_get_model_capability_ignores_non_boolean_values(tmp_path, monkeypatch):
-    cache_path = tmp_path / "model-capabilities.json"
+    cache_path = cache_file_path(model_cache.CACHE_FILE_NAME)
     cache_path.write_text(
         json.dumps(
             {
@@ -54,8 +75,81 @@ def test_get_model_capability_ignores_non_boolean_values(tmp_path, monkeypatch):
             }
         )
     )
-    monkeypatch.setattr(model_cache, "_cache_file_path", lambda: cache_path)
     monkeypatch.setattr(model_cache.time, "time", lambda: 50_001)
 
     value = model_cache.get_model_capability("model-a", "supports_temperature")
     assert value is None
+
+
+def test_get_model_capability_reads_the_cache_file_once_per_process(
+    tmp_path, monkeypatch
+):
+    monkeypatch.setattr(model_cache.time, "time", lambda: 1_000)
+    model_cache.set_model_capability("model-a", "supports_temperature", True)
+    monkeypatch.setattr(model_cache, "_cache_snapshot", None)
+
+    reads: list[str] = []
+    original_read_cache = model_cache._read_cache
+
+    def counting_read_cache(path=None):
+        reads.append("read")
+        return original_read_cache(path)
+
+    monkeypatch.setattr(model_cache, "_read_cache", counting_read_cache)
+
+    for _ in range(3):
+        assert model_cache.get_model_capability("model-a", "supports_temperature")
+    assert reads == ["read"]
+
+
+def test_set_model_capability_merges_updates_written_by_other_processes(
+    tmp_path, monkeypatch
+):
+    cache_path = cache_file_path(model_cache.CACHE_FILE_NAME)
+    monkeypatch.setattr(model_cache.time, "time", lambda: 1_000)
+    assert model_cache.get_model_capability("model-a", "supports_temperature") is None
+
+    cache_path.write_text(
+        json.dumps(
+            {
+                model_cache.MODEL_CAPABILITIES_KEY: {
+                    "model-b": {
+                        model_cache.UPDATED_AT_KEY: 1_000,
+                        "supports_temperature": False,
+                    }
+                }
+            }
+        )
+    )
+    model_cache.set_model_capability("model-a", "supports_temperature", True)
+
+    assert model_cache.get_model_capability("model-b", "supports_temperature") is False
+    assert model_cache.get_model_capability("model-a", "supports_temperature") is True
+
+
+def test_concurrent_processes_never_tear_or_lose_cache_updates(tmp_path):
+    cache_path = cache_file_path(model_cache.CACHE_FILE_NAME)
+    workers = 6
+    updates_per_worker = 10
+
+    processes = [
+        subprocess.Popen(
+            [
+                sys.executable,
+                "-c",
+                STRESS_WORKER_SCRIPT,
+                str(SRC_PATH),
+                str(worker),
+                str(updates_per_worker),
+            ]
+        )
+        for worker in range(workers)
+    ]
+    assert [process.wait(timeout=60) for process in processes] == [0] * workers
+
+    cache = json.loads(cache_path.read_text())
+    model_capabilities = cache[model_cache.MODEL_CAPABILITIES_KEY]
+    assert len(model_capabilities) == workers * updates_per_worker + 1
+    assert {f"capability-{worker}" for worker in range(workers)} <= set(
+        model_capabilities["shared-model"]
+    )
@@ -0,0 +1,344 @@
+import threading
+import time
+
+import pytest
+
+import llm_complete_command as plugin
+import llm_complete_command.model_race as model_race
+
+
+class _FakeModel:
+    def __init__(self, model_id: str):
+        self.model_id = model_id
+        self.next_conversation: object = None
+
+    def conversation(self):
+        return self.next_conversation
+
+
+class _FakeConversation:
+    def __init__(
+        self, model_id: str, chunks: list[str], release=None, error=None, response=None
+    ):
+        self.model = _FakeModel(model_id)
+        self.prompt_calls: list[str] = []
+        self._chunks = chunks
+        self._release = release
+        self._error = error
+        self._response = response
+
+    def prompt(self, prompt: str, **_kwargs):
+        self.prompt_calls.append(prompt)
+        return self._stream() if self._response is None else self._response
+
+    def _stream(self):
+        if self._release is not None:
+            self._release.wait(timeout=5)
+        if self._error is not None:
+            raise self._error
+        yield from self._chunks
+
+
+@pytest.fixture(autouse=True)
+def _isolated_race(tmp_path, monkeypatch):
+    monkeypatch.setattr(model_race, "cached_settings", lambda: {})
+    monkeypatch.setattr(plugin, "cached_settings", lambda: {})
+    monkeypatch.setattr(model_race, "get_model_capability", lambda _model, _cap: True)
+
+
+def _collect_plain(_conversation, response, write_chunk) -> str:
+    return plugin._collect_response_text(response, write_chunk)
+
+
+def test_race_model_ids_parses_option_and_settings(monkeypatch):
+    assert model_race.race_model_ids("model-a, model-b,model-a") == [
+        "model-a",
+        "model-b",
+    ]
+    assert model_race.race_model_ids("model-a") == []
+
+    monkeypatch.setattr(
+        model_race,
+        "cached_settings",
+        lambda: {model_race.RACE_MODELS_SETTING: ["model-c", "model-d"]},
+    )
+    assert model_race.race_model_ids(None) == ["model-c", "model-d"]
+
+
+def test_race_command_text_streams_first_model_to_answer():
+    slow_release = threading.Event()
+    slow = _FakeConversation("model-slow", ["slow"], release=slow_release)
+    fast = _FakeConversation("model-fast", ["ls ", "-la"])
+    written: list[str] = []
+
+    try:
+        winner, text = model_race.race_command_text(
+            [slow, fast], "list files", "system", written.append, _collect_plain
+        )
+    finally:
+        slow_release.set()
+
+    assert winner is fast
+    assert text == "ls -la"
+    assert written == ["ls ", "-la"]
+    assert model_race.race_win_rates() == {"model-slow": (0, 1), "model-fast": (1, 1)}
+
+
+def test_race_command_text_ignores_failed_racers():
+    broken = _FakeConversation("model-broken", [], error=RuntimeError("down"))
+    working_release = threading.Event()
+    working = _FakeConversation("model-working", ["pwd"], release=working_release)
+
+    threading.Timer(0.05, working_release.set).start()
+    winner, text = model_race.race_command_text(
+        [broken, working], "where am i", "system", lambda _chunk: None, _collect_plain
+    )
+
+    assert winner is working
+    assert text == "pwd"
+
+
+def test_race_command_text_raises_when_every_racer_fails():
+    conversations = [
+        _FakeConversation("model-a", [], error=RuntimeError("a down")),
+        _FakeConversation("model-b", [], error=RuntimeError("b down")),
+    ]
+
+    with pytest.raises(model_race.RaceFailedError):
+        model_race.race_command_text(
+            conversations, "list", "system", lambda _chunk: None, _collect_plain
+        )
+
+
+def test_run_completion_session_revises_on_winning_conversation(monkeypatch):
+    monkeypatch.setattr(plugin, "get_cached_response", lambda _key: None)
+    monkeypatch.setattr(
+        plugin, "find_similar_completion", lambda _prompt, _context_key: None
+    )
+    slow_release = threading.Event()
+    slow = _FakeConversation("model-slow", ["slow"], release=slow_release)
+    fast = _FakeConversation("model-fast", ["ls"])
+    revised: list[tuple[object, str]] = []
+
+    def fake_generate_command_text(conversation, prompt, _system, **_kwargs):
+        revised.append((conversation, prompt))
+        return "ls -la"
+
+    monkeypatch.setattr(plugin, "_generate_command_text", fake_generate_command_text)
+
+    class _Terminal:
+        def __init__(self):
+            self.written: list[str] = []
+            self._feedback = ["include hidden files", ""]
+
+        def write(self, text: str) -> None:
+            self.written.append(text)
+
+        def read_feedback(self) -> str:
+            return self._feedback.pop(0)
+
+    terminal = _Terminal()
+    try:
+        command = plugin.run_completion_session(
+            slow,
+            "list files",
+            "system",
+            terminal,
+            collect=_collect_plain,
+            race_conversations=[slow, fast],
+        )
+    finally:
+        slow_release.set()
+
+    assert command == "ls -la"
+    assert revised == [(fast, "include hidden files")]
+    assert plugin.RACE_WINNER_NOTE.format(model_id="model-fast") in terminal.written
+
+
+def test_run_completion_session_revises_replay_without_racing(monkeypatch):
+    monkeypatch.setattr(plugin, "get_cached_response", lambda _key: "ls")
+    planned: list[object] = []
+    monkeypatch.setattr(
+        model_race, "plan_hedge", lambda *args: planned.append(args) or None
+    )
+    first = _FakeConversation("model-a", ["never"])
+    second = _FakeConversation("model-b", ["never"])
+    revised: list[tuple[object, str]] = []
+
+    def fake_generate_command_text(conversation, prompt, _system, **_kwargs):
+        revised.append((conversation, prompt))
+        return "ls -la"
+
+    monkeypatch.setattr(plugin, "_generate_command_text", fake_generate_command_text)
+
+    class _Terminal:
+        def __init__(self):
+            self._feedback = ["include hidden files", ""]
+
+        def write(self, _text: str) -> None:
+            pass
+
+        def read_feedback(self) -> str:
+            return self._feedback.pop(0)
+
+    command = plugin.run_completion_session(
+        first,
+        "list files",
+        "system",
+        _Terminal(),
+        collect=_collect_plain,
+        race_conversations=[first, second],
+    )
+
+    assert command == "ls -la"
+    assert [conversation for conversation, _prompt in revised] == [first]
+    assert planned == []
+    assert first.prompt_calls == second.prompt_calls == []
+
+
+def test_plan_hedge_resolves_hedge_model_key_from_option(monkeypatch):
+    class _KeyedModel(_FakeModel):
+        needs_key = "fallback-provider"
+        key_env_var = "FALLBACK_API_KEY"
+        key: str | None = None
+
+    hedge_model = _KeyedModel("model-fallback")
+    hedge_model.next_conversation = "fallback-conversation"
+    key_requests: list[tuple[object, ...]] = []
+    monkeypatch.setattr("llm.get_model", lambda _model_id: hedge_model)
+    monkeypatch.setattr(
+        "llm.get_key", lambda *args: key_requests.append(args) or "resolved-key"
+    )
+    settings = {
+        model_race.HEDGE_AFTER_SECONDS_SETTING: 1,
+        model_race.HEDGE_MODEL_SETTING: "model-fallback",
+    }
+
+    hedge = model_race.plan_hedge(_FakeConversation("model-a", []), settings, "cli-key")
+
+    assert hedge == model_race.HedgePlan("fallback-conversation", 1.0)
+    assert key_requests == [("cli-key", "fallback-provider", "FALLBACK_API_KEY")]
+    assert hedge_model.key == "resolved-key"
+
+
+def test_plan_hedge_uses_fixed_or_adaptive_deadline(monkeypatch):
+    conversation = _FakeConversation("model-a", [])
+    conversation.model.next_conversation = "hedge-conversation"
+
+    assert model_race.plan_hedge(conversation) is None
+
+    monkeypatch.setattr(
+        model_race,
+        "cached_settings",
+        lambda: {model_race.HEDGE_AFTER_SECONDS_SETTING: 2},
+    )
+    assert model_race.plan_hedge(conversation) == model_race.HedgePlan(
+        "hedge-conversation", 2.0
+    )
+
+    monkeypatch.setattr(
+        model_race,
+        "cached_settings",
+        lambda: {
+            model_race.HEDGE_AFTER_SECONDS_SETTING: model_race.ADAPTIVE_HEDGE_DEADLINE
+        },
+    )
+    monkeypatch.setattr(
+        model_race, "first_token_percentile", lambda _model_id, _percentile: None
+    )
+    hedge = model_race.plan_hedge(conversation)
+    assert hedge is not None
+    assert hedge.delay_seconds == model_race.DEFAULT_ADAPTIVE_HEDGE_SECONDS
+
+    monkeypatch.setattr(
+        model_race, "first_token_percentile", lambda _model_id, _percentile: 3.25
+    )
+    hedge = model_race.plan_hedge(conversation)
+    assert hedge is not None
+    assert hedge.delay_seconds == 3.25
+
+
+def test_hedged_request_wins_when_primary_misses_deadline():
+    primary_release = threading.Event()
+    primary = _FakeConversation("model-a", ["slow"], release=primary_release)
+    hedge = _FakeConversation("model-fallback", ["fast"])
+
+    try:
+        winner, text = model_race.race_command_text(
+            [primary, hedge],
+            "list",
+            "system",
+            lambda _chunk: None,
+            _collect_plain,
+            start_delays=[0, 0.05],
+            record_results=False,
+        )
+    finally:
+        primary_release.set()
+
+    assert winner is hedge
+    assert text == "fast"
+    assert model_race.race_win_rates() == {}
+
+
+def test_hedged_request_never_starts_when_primary_answers_in_time():
+    primary = _FakeConversation("model-a", ["ls"])
+    hedge = _FakeConversation("model-fallback", ["fast"])
+
+    winner, _text = model_race.race_command_text(
+        [primary, hedge],
+        "list",
+        "system",
+        lambda _chunk: None,
+        _collect_plain,
+        start_delays=[0, 0.2],
+        record_results=False,
+    )
+
+    time.sleep(0.3)
+    assert winner is primary
+    assert hedge.prompt_calls == []
+
+
+class _CountingStream:
+    def __init__(self, chunks: list[str], first_delay: float, delay: float):
+        self.pulled = 0
+        self.closed = False
+        self._chunks = chunks
+        self._first_delay = first_delay
+        self._delay = delay
+
+    def __iter__(self):
+        for index, chunk in enumerate(self._chunks):
+            time.sleep(self._delay if index else self._first_delay)
+            self.pulled += 1
+            yield chunk
+
+    def close(self):
+        self.closed = True
+
+
+def test_loser_stops_consuming_chunks_after_the_winners_first_token():
+    loser_stream = _CountingStream(["a"] * 50, first_delay=0.05, delay=0.01)
+    loser = _FakeConversation("model-slow", [], response=loser_stream)
+    winner_stream = _CountingStream(
+        ["ls", " -la", " /tmp"], first_delay=0.01, delay=0.1
+    )
+    winner = _FakeConversation("model-fast", [], response=winner_stream)
+
+    # Left running, the loser would stream for as long as the winner does.
+    winning_conversation, text = model_race.race_command_text(
+        [winner, loser],
+        "list",
+        "system",
+        lambda _chunk: None,
+        _collect_plain,
+        record_results=False,
+    )
+
+    assert winning_conversation is winner
+    assert text == "ls -la /tmp"
+    assert loser_stream.closed
+    # Its first chunk arrives after the winner's first token and is dropped.
+    assert loser_stream.pulled == 1
+    assert not winner_stream.closed
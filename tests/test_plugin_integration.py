@@ -2,6 +2,7 @@ import click
 from click.testing import CliRunner
 
 import llm_complete_command as plugin
+import llm_complete_command.model_race as model_race
 
 
 class _FakeModel:
@@ -30,11 +31,21 @@ def test_complete_command_wires_model_key_and_exec_flow(monkeypatch):
     monkeypatch.setattr(
         plugin, "render_default_prompt", lambda: "default system prompt"
     )
+    monkeypatch.setattr(model_race, "cached_settings", lambda: {})
     monkeypatch.setattr(
         plugin,
         "interactive_exec",
-        lambda conversation, prompt, system: captured.update(
-            {"conversation": conversation, "prompt": prompt, "system": system}
+        lambda conversation, prompt, system, use_cache, race_conversations, key: (
+            captured.update(
+                {
+                    "conversation": conversation,
+                    "prompt": prompt,
+                    "system": system,
+                    "use_cache": use_cache,
+                    "race_conversations": race_conversations,
+                    "key": key,
+                }
+            )
         ),
     )
 
@@ -49,5 +60,124 @@ def test_complete_command_wires_model_key_and_exec_flow(monkeypatch):
         "conversation": fake_conversation,
         "prompt": "show cwd",
         "system": "default system prompt",
+        "use_cache": True,
+        "race_conversations": None,
+        "key": None,
     }
     assert fake_model.key == "resolved:None:provider-key:PROVIDER_API_KEY"
+
+
+def test_print_system_prompt_reports_cache_status(monkeypatch):
+    monkeypatch.setattr(
+        plugin, "render_cached_system_prompt", lambda: ("cached prompt", True)
+    )
+
+    cli = click.Group()
+    plugin.register_commands(cli)
+    result = CliRunner().invoke(cli, ["complete", "--print-system-prompt"])
+
+    assert result.exit_code == 0
+    assert result.stdout == "cached prompt\n"
+    assert "system prompt cache hit, rendered in" in result.stderr
+
+
+def test_complete_command_races_configured_models(monkeypatch):
+    captured: dict[str, object] = {}
+    conversations = {"model-a": object(), "model-b": object()}
+
+    monkeypatch.setattr(
+        plugin.llm,
+        "get_model",
+        lambda model_id: _FakeModel(conversations[model_id]),
+    )
+    monkeypatch.setattr(plugin.llm, "get_key", lambda *_args: "key")
+    monkeypatch.setattr(plugin, "render_default_prompt", lambda: "system")
+    monkeypatch.setattr(
+        model_race,
+        "cached_settings",
+        lambda: {model_race.RACE_MODELS_SETTING: ["model-a", "model-b"]},
+    )
+    monkeypatch.setattr(
+        plugin,
+        "interactive_exec",
+        lambda conversation, _prompt, _system, use_cache, race_conversations, key: (
+            captured.update({"conversation": conversation, "race": race_conversations})
+        ),
+    )
+
+    cli = click.Group()
+    plugin.register_commands(cli)
+    result = CliRunner().invoke(cli, ["complete", "show", "cwd"])
+
+    assert result.exit_code == 0
+    assert captured == {
+        "conversation": conversations["model-a"],
+        "race": [conversations["model-a"], conversations["model-b"]],
+    }
+
+
+def test_stats_flag_prints_latency_report_without_a_model(monkeypatch):
+    monkeypatch.setattr(plugin, "format_latency_report", lambda: "latency report")
+    monkeypatch.setattr(
+        plugin.llm,
+        "get_model",
+        lambda _model_id: (_ for _ in ()).throw(AssertionError("model used")),
+    )
+
+    cli = click.Group()
+    plugin.register_commands(cli)
+    result = CliRunner().invoke(cli, ["complete", "--stats"])
+
+    assert result.exit_code == 0
+    assert result.stdout == "latency report\n"
+
+
+def test_stats_prompt_is_sent_to_the_model(monkeypatch):
+    prompts: list[str] = []
+    monkeypatch.setattr(plugin, "format_latency_report", lambda: "latency report")
+    monkeypatch.setattr("llm.get_default_model", lambda: "default-model")
+    monkeypatch.setattr(plugin.llm, "get_model", lambda _model_id: _FakeModel(object()))
+    monkeypatch.setattr(plugin.llm, "get_key", lambda *_args: None)
+    monkeypatch.setattr(plugin, "render_default_prompt", lambda: "system prompt")
+    monkeypatch.setattr(model_race, "cached_settings", lambda: {})
+    monkeypatch.setattr(
+        plugin,
+        "interactive_exec",
+        lambda _conversation, prompt, *_args, **_kwargs: prompts.append(prompt),
+    )
+
+    cli = click.Group()
+    plugin.register_commands(cli)
+    result = CliRunner().invoke(cli, ["complete", "stats"])
+
+    assert result.exit_code == 0
+    assert result.stdout == ""
+    assert prompts == ["stats"]
+
+
+def test_prefetch_asks_the_first_race_model(monkeypatch):
+    prefetched: list[tuple[object, str]] = []
+    models = {
+        "model-a": _FakeModel("conversation-a"),
+        "model-b": _FakeModel("conversation-b"),
+    }
+    monkeypatch.setattr("llm.get_default_model", lambda: "default-model")
+    monkeypatch.setattr(plugin.llm, "get_model", models.__getitem__)
+    monkeypatch.setattr(plugin.llm, "get_key", lambda *_args: None)
+    monkeypatch.setattr(plugin, "render_default_prompt", lambda: "system prompt")
+    monkeypatch.setattr(
+        model_race,
+        "cached_settings",
+        lambda: {model_race.RACE_MODELS_SETTING: ["model-a", "model-b"]},
+    )
+    monkeypatch.setattr(
+        "llm_complete_command.prefetch.prefetch_completion",
+        lambda conversation, prompt, _system: prefetched.append((conversation, prompt)),
+    )
+
+    cli = click.Group()
+    plugin.register_commands(cli)
+    result = CliRunner().invoke(cli, ["complete", "--prefetch", "list all files"])
+
+    assert result.exit_code == 0
+    assert prefetched == [("conversation-a", "list all files")]
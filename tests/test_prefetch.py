@@ -0,0 +1,84 @@
+import pytest
+
+import llm_complete_command as plugin
+import llm_complete_command.prefetch as prefetch
+import llm_complete_command.request_context as request_context
+import llm_complete_command.response_cache as response_cache
+
+
+class _FakeModel:
+    def __init__(self, model_id: str):
+        self.model_id = model_id
+
+
+class _FakeConversation:
+    def __init__(self):
+        self.model = _FakeModel("prefetch-model")
+        self.prompt_calls: list[str] = []
+
+    def prompt(self, prompt: str, **_kwargs):
+        self.prompt_calls.append(prompt)
+        return ["du -sh ", "*"]
+
+
+@pytest.fixture(autouse=True)
+def _isolated_prefetch(tmp_path, monkeypatch):
+    monkeypatch.setattr(prefetch, "cached_settings", lambda: {})
+    monkeypatch.setattr(plugin, "get_model_capability", lambda _model, _cap: True)
+
+
+def test_prefetch_completion_keeps_generated_command_out_of_response_cache():
+    conversation = _FakeConversation()
+
+    assert prefetch.prefetch_completion(conversation, "show folder sizes", "system")
+
+    key = response_cache.response_cache_key(
+        "prefetch-model",
+        "system",
+        "show folder sizes",
+        request_context.request_context_key(),
+    )
+    assert response_cache.get_prefetched_response(key) == "du -sh *"
+    assert response_cache.get_cached_response(key) is None
+    assert conversation.prompt_calls == ["show folder sizes"]
+    assert not prefetch.prefetch_completion(conversation, "show folder sizes", "system")
+
+
+def test_prefetch_completion_skips_short_and_cached_prompts():
+    conversation = _FakeConversation()
+    response_cache.store_response(
+        response_cache.response_cache_key(
+            "prefetch-model",
+            "system",
+            "list all files",
+            request_context.request_context_key(),
+        ),
+        "ls -a",
+    )
+
+    assert not prefetch.prefetch_completion(conversation, "ls", "system")
+    assert not prefetch.prefetch_completion(conversation, "list all files", "system")
+    assert conversation.prompt_calls == []
+
+
+def test_prefetch_completion_respects_per_minute_budget(monkeypatch):
+    monkeypatch.setattr(
+        prefetch,
+        "cached_settings",
+        lambda: {prefetch.PREFETCH_REQUESTS_PER_MINUTE_SETTING: 2},
+    )
+    clock = [1_000.0]
+    monkeypatch.setattr(prefetch.time, "time", lambda: clock[0])
+    conversation = _FakeConversation()
+
+    results = [
+        prefetch.prefetch_completion(conversation, f"request number {n}", "system")
+        for n in range(3)
+    ]
+    clock[0] += prefetch.PREFETCH_BUDGET_WINDOW_SECONDS
+    results.append(
+        prefetch.prefetch_completion(conversation, "request number 3", "system")
+    )
+
+    assert results == [True, True, False, True]
+    assert len(conversation.prompt_calls) == 3
@@ -0,0 +1,163 @@
+import random
+import time
+
+import llm_complete_command.prompt_index as prompt_index
+from llm_complete_command.atomic_file import cache_file_path
+
+
+LOOKUP_BUDGET_SECONDS = 0.02
+
+
+def test_find_similar_completion_returns_near_match():
+    prompt_index.add_accepted_completion(
+        "kill whatever is on port 8080", "kill $(lsof -t -i :8080)"
+    )
+    prompt_index.add_accepted_completion("show folder sizes", "du -sh *")
+
+    assert prompt_index.find_similar_completion("kill whatever is on port 8080!") == (
+        "kill whatever is on port 8080",
+        "kill $(lsof -t -i :8080)",
+    )
+    assert prompt_index.find_similar_completion("compress this directory") is None
+
+
+def test_add_accepted_completion_updates_command_for_same_prompt():
+    prompt_index.add_accepted_completion("list  files", "ls")
+    prompt_index.add_accepted_completion("list files", "ls -la")
+
+    index = prompt_index.load_prompt_index(
+        cache_file_path(prompt_index.CACHE_FILE_NAME)
+    )
+
+    assert index.prompts == ["list files"]
+    assert prompt_index.find_similar_completion("list files") == (
+        "list files",
+        "ls -la",
+    )
+
+
+def test_add_accepted_completion_ignores_blank_entries():
+    prompt_index.add_accepted_completion("   ", "ls")
+    prompt_index.add_accepted_completion("list files", "  ")
+
+    assert not cache_file_path(prompt_index.CACHE_FILE_NAME).exists()
+
+
+def test_load_prompt_index_tolerates_corrupt_file():
+    cache_file_path(prompt_index.CACHE_FILE_NAME).write_bytes(b"not marshal data")
+
+    assert prompt_index.find_similar_completion("list files") is None
+
+    prompt_index.add_accepted_completion("list files", "ls")
+    assert prompt_index.find_similar_completion("list files") == ("list files", "ls")
+
+
+def test_prompt_index_drops_oldest_entries_beyond_limit(monkeypatch):
+    monkeypatch.setattr(prompt_index, "PROMPT_INDEX_MAX_ENTRIES", 2)
+    index = prompt_index.PromptIndex()
+    index.add("first request", "one")
+    index.add("second request", "two")
+    index.add("third request", "three")
+
+    assert index.prompts == ["second request", "third request"]
+    assert index.find_similar("third request") == ("third request", "three")
+    assert index.find_similar("first request") is None
+
+
+def test_accepted_completions_go_to_the_delta_until_it_is_merged(monkeypatch):
+    monkeypatch.setattr(prompt_index, "DELTA_MERGE_CHANGED_ENTRIES", 2)
+    base_path = cache_file_path(prompt_index.CACHE_FILE_NAME)
+    delta_path = base_path.with_name(prompt_index.DELTA_FILE_NAME)
+
+    prompt_index.add_accepted_completion("show folder sizes", "du -sh *")
+    prompt_index.add_accepted_completion("list open ports", "ss -tlnp")
+
+    assert not base_path.exists()
+    assert delta_path.exists()
+
+    prompt_index.add_accepted_completion("show folder sizes", "du -sh .[!.]* *")
+    prompt_index.add_accepted_completion("count lines of code", "cloc .")
+    base_bytes = base_path.read_bytes()
+    prompt_index.add_accepted_completion("list open ports", "lsof -i -P")
+
+    assert base_path.read_bytes() == base_bytes
+    assert prompt_index.load_prompt_index(base_path).prompts == [
+        "show folder sizes",
+        "list open ports",
+        "count lines of code",
+    ]
+    assert prompt_index.find_similar_completion("show folder sizes") == (
+        "show folder sizes",
+        "du -sh .[!.]* *",
+    )
+    assert prompt_index.find_similar_completion("list open ports") == (
+        "list open ports",
+        "lsof -i -P",
+    )
+
+
+def test_merge_drops_entries_beyond_limit_from_the_base(monkeypatch):
+    monkeypatch.setattr(prompt_index, "PROMPT_INDEX_MAX_ENTRIES", 2)
+    index = prompt_index.PromptIndex()
+    index.add("first request", "one")
+    index.add("second request", "two")
+    index.merge()
+    index.add("third request", "three")
+    index.merge()
+
+    assert index.prompts == ["second request", "third request"]
+    assert index.base_count == 2
+    assert index.find_similar("first request") is None
+    assert index.find_similar("second request") == ("second request", "two")
+
+
+def test_load_prompt_index_ignores_delta_of_another_base():
+    base_path = cache_file_path(prompt_index.CACHE_FILE_NAME)
+    index = prompt_index.PromptIndex()
+    index.add("list files", "ls")
+    stale_delta = index.delta_bytes()
+    index.merge()
+    base_path.write_bytes(index.base_bytes())
+    base_path.with_name(prompt_index.DELTA_FILE_NAME).write_bytes(stale_delta)
+
+    assert prompt_index.load_prompt_index(base_path).prompts == ["list files"]
+
+
+def test_prompt_index_lookup_stays_fast_with_many_entries():
+    generator = random.Random(7)
+    words = [
+        "".join(generator.choices("abcdefghijklmnopqrstuvwxyz", k=length))
+        for length in generator.choices(range(3, 9), k=3_000)
+    ]
+    prompts = [
+        " ".join(generator.choices(words, k=generator.randint(3, 8)))
+        for _ in range(30_000)
+    ]
+    index = prompt_index.PromptIndex()
+    for number, prompt in enumerate(prompts):
+        index.add(prompt, f"cmd {number}")
+    index.merge()
+    base_path = cache_file_path(prompt_index.CACHE_FILE_NAME)
+    base_path.write_bytes(index.base_bytes())
+
+    started_at = time.perf_counter()
+    match = prompt_index.find_similar_completion(f"{prompts[12_345]} please")
+    elapsed_seconds = time.perf_counter() - started_at
+
+    assert match == (prompts[12_345], "cmd 12345")
+    assert elapsed_seconds < LOOKUP_BUDGET_SECONDS
+
+
+def test_find_similar_completion_stays_within_its_context():
+    prompt_index.add_accepted_completion("run the tests", "make test", "/srv/a")
+    prompt_index.add_accepted_completion("run the tests", "pytest", "/srv/b")
+
+    assert prompt_index.find_similar_completion("run the tests", "/srv/a") == (
+        "run the tests",
+        "make test",
+    )
+    assert prompt_index.find_similar_completion("run all the tests", "/srv/b") == (
+        "run the tests",
+        "pytest",
+    )
+    assert prompt_index.find_similar_completion("run the tests", "/srv/c") is None
@@ -0,0 +1,95 @@
+import llm_complete_command.response_cache as response_cache
+
+
+def test_response_cache_key_normalizes_whitespace_but_not_case():
+    key = response_cache.response_cache_key("model-a", "system", "tar  this\tdir ")
+
+    assert key == response_cache.response_cache_key("model-a", "system", "tar this dir")
+    assert key != response_cache.response_cache_key("model-a", "system", "tar THIS dir")
+    assert key != response_cache.response_cache_key("model-b", "system", "tar this dir")
+    assert key != response_cache.response_cache_key(
+        "model-a", "other system", "tar this dir"
+    )
+
+
+def test_store_and_get_cached_response_respects_ttl(monkeypatch):
+    monkeypatch.setattr(response_cache.time, "time", lambda: 1_000)
+    response_cache.store_response("key-a", "tar -czf dir.tgz dir")
+
+    assert response_cache.get_cached_response("key-a") == "tar -czf dir.tgz dir"
+    assert response_cache.get_cached_response("key-b") is None
+
+    monkeypatch.setattr(
+        response_cache.time,
+        "time",
+        lambda: 1_000 + response_cache.RESPONSE_CACHE_TTL_SECONDS + 1,
+    )
+    assert response_cache.get_cached_response("key-a") is None
+
+
+def test_store_response_evicts_least_recently_used_entries(monkeypatch):
+    monkeypatch.setattr(response_cache, "RESPONSE_CACHE_MAX_ENTRIES", 2)
+    clock = {"now": 1_000}
+    monkeypatch.setattr(response_cache.time, "time", lambda: clock["now"])
+
+    response_cache.store_response("oldest", "cmd-1")
+    clock["now"] += 1
+    response_cache.store_response("middle", "cmd-2")
+    clock["now"] += 1
+    response_cache.store_response("oldest", "cmd-1")
+    clock["now"] += 1
+    response_cache.store_response("newest", "cmd-3")
+
+    assert response_cache.get_cached_response("middle") is None
+    assert response_cache.get_cached_response("oldest") == "cmd-1"
+    assert response_cache.get_cached_response("newest") == "cmd-3"
+
+
+def test_cache_hits_count_as_uses_for_eviction(monkeypatch):
+    monkeypatch.setattr(response_cache, "RESPONSE_CACHE_MAX_ENTRIES", 2)
+    clock = {"now": 1_000}
+    monkeypatch.setattr(response_cache.time, "time", lambda: clock["now"])
+
+    response_cache.store_response("oldest", "cmd-1")
+    clock["now"] += 1
+    response_cache.store_response("middle", "cmd-2")
+    clock["now"] += response_cache.LAST_USED_UPDATE_INTERVAL_SECONDS
+    assert response_cache.get_cached_response("oldest") == "cmd-1"
+    clock["now"] += 1
+    response_cache.store_response("newest", "cmd-3")
+
+    assert response_cache.get_cached_response("middle") is None
+    assert response_cache.get_cached_response("oldest") == "cmd-1"
+
+
+def test_storing_a_command_again_keeps_its_ttl(monkeypatch):
+    clock = {"now": 1_000}
+    monkeypatch.setattr(response_cache.time, "time", lambda: clock["now"])
+
+    response_cache.store_response("key-a", "ls -la")
+    clock["now"] += response_cache.RESPONSE_CACHE_TTL_SECONDS
+    response_cache.store_response("key-a", "ls -la")
+    clock["now"] += 1
+
+    assert response_cache.get_cached_response("key-a") is None
+
+
+def test_store_response_skips_blank_commands():
+    response_cache.store_response("key-a", "  \n")
+
+    assert response_cache.get_cached_response("key-a") is None
+
+
+def test_prefetched_responses_expire_sooner_than_accepted_ones(monkeypatch):
+    monkeypatch.setattr(response_cache.time, "time", lambda: 1_000)
+    response_cache.store_prefetched_response("key-a", "du -sh *")
+
+    assert response_cache.get_prefetched_response("key-a") == "du -sh *"
+    assert response_cache.get_cached_response("key-a") is None
+
+    monkeypatch.setattr(
+        response_cache.time,
+        "time",
+        lambda: 1_000 + response_cache.PREFETCH_CACHE_TTL_SECONDS + 1,
+    )
+    assert response_cache.get_prefetched_response("key-a") is None
@@ -0,0 +1,252 @@
+import random
+import time
+
+import pytest
+
+import llm_complete_command.shell_history as shell_history
+
+
+RETRIEVAL_BUDGET_SECONDS = 0.02
+
+
+@pytest.fixture(autouse=True)
+def _isolated_index(tmp_path, monkeypatch):
+    spawned = []
+    monkeypatch.setattr(
+        shell_history, "spawn_background_refresh", lambda: spawned.append(True)
+    )
+    return spawned
+
+
+@pytest.fixture
+def zsh_history(tmp_path):
+    return tmp_path / ".zsh_history"
+
+
+def _write_zsh_history(path, commands):
+    path.write_bytes(
+        "".join(
+            f": {1_700_000_000 + number}:0;{command}\n"
+            for number, command in enumerate(commands)
+        ).encode()
+    )
+
+
+def test_relevant_history_commands_ranks_shared_flags_and_hosts(zsh_history):
+    _write_zsh_history(
+        zsh_history,
+        [
+            "ssh -p 2222 deploy@staging-1",
+            "git status",
+            "rsync -avz ./build/ deploy@staging-1:/srv/app",
+            "ls -la",
+            "deploy the build to staging",
+        ],
+    )
+
+    commands = shell_history.relevant_history_commands(
+        zsh_history, "deploy the build to staging"
+    )
+
+    # The request itself, pushed to history by the widget, is left out.
+    assert commands == [
+        "rsync -avz ./build/ deploy@staging-1:/srv/app",
+        "ssh -p 2222 deploy@staging-1",
+    ]
+
+
+def test_repeated_commands_keep_only_their_latest_use(zsh_history):
+    _write_zsh_history(
+        zsh_history,
+        ["ssh web1", "ssh web2", "ssh db1", "ssh web3", "ssh web3"],
+    )
+
+    assert shell_history.relevant_history_commands(zsh_history, "ssh to web") == [
+        "ssh web3",
+        "ssh db1",
+    ]
+
+
+def test_history_index_reads_only_appended_bytes(zsh_history, monkeypatch):
+    _write_zsh_history(zsh_history, ["kubectl get pods -n payments"])
+    shell_history.relevant_history_commands(zsh_history, "pods")
+    indexed_size = zsh_history.stat().st_size
+    with zsh_history.open("a") as history_file:
+        history_file.write(": 1700000009:0;kubectl logs -f -n payments api\n")
+
+    read_from = []
+    command_spans = shell_history._command_spans
+    monkeypatch.setattr(
+        shell_history,
+        "_command_spans",
+        lambda history, start, end, fish: (
+            read_from.append(start) or command_spans(history, start, end, fish)
+        ),
+    )
+
+    assert shell_history.relevant_history_commands(zsh_history, "payments logs") == [
+        "kubectl logs -f -n payments api",
+        "kubectl get pods -n payments",
+    ]
+    assert read_from == [indexed_size]
+
+
+def test_appended_commands_are_merged_into_the_base_index(zsh_history, monkeypatch):
+    monkeypatch.setattr(shell_history, "DELTA_MERGE_CHANGED_ENTRIES", 2)
+    commands = ["make build", "make test", "make lint", "make test", "make docs"]
+    for count in range(1, len(commands) + 1):
+        _write_zsh_history(zsh_history, commands[:count])
+        shell_history.relevant_history_commands(zsh_history, "make")
+
+    # The first three commands are merged into the base; the repeat of
+    # "make test" and "make docs" are read from the delta on top of it.
+    assert shell_history.relevant_history_commands(zsh_history, "run make") == [
+        "make docs",
+        "make test",
+        "make lint",
+        "make build",
+    ]
+
+
+def test_rewritten_history_is_indexed_again(zsh_history, monkeypatch, _isolated_index):
+    merge_entries = shell_history.DELTA_MERGE_CHANGED_ENTRIES
+    monkeypatch.setattr(shell_history, "DELTA_MERGE_CHANGED_ENTRIES", 0)
+    _write_zsh_history(zsh_history, ["make deploy", "make test"])
+    shell_history.relevant_history_commands(zsh_history, "make")
+    monkeypatch.setattr(shell_history, "DELTA_MERGE_CHANGED_ENTRIES", merge_entries)
+    _write_zsh_history(zsh_history, ["cargo test --workspace"])
+
+    assert shell_history.relevant_history_commands(zsh_history, "run tests") == []
+    # The new index is kept, so the rewritten file is not parsed again.
+    monkeypatch.setattr(shell_history, "_command_spans", None)
+    assert shell_history.relevant_history_commands(zsh_history, "test") == [
+        "cargo test --workspace"
+    ]
+    assert _isolated_index == []
+
+
+def test_long_rewritten_history_is_left_to_background_refresh(
+    zsh_history, monkeypatch, _isolated_index
+):
+    monkeypatch.setattr(shell_history, "FOREGROUND_REBUILD_BYTES", 10)
+    monkeypatch.setattr(shell_history, "_configured_history_path", lambda: zsh_history)
+    _write_zsh_history(zsh_history, ["terraform plan -out tfplan"])
+
+    assert shell_history.relevant_history_commands(zsh_history, "plan") == []
+    assert _isolated_index == [True]
+
+    shell_history.refresh_shell_history_index()
+    assert shell_history.relevant_history_commands(zsh_history, "plan") == [
+        "terraform plan -out tfplan"
+    ]
+
+
+@pytest.mark.parametrize(
+    ("file_name", "content", "command"),
+    [
+        (
+            ".bash_history",
+            b"#1700000000\ncurl -sS https://api.example.com/health\n",
+            "curl -sS https://api.example.com/health",
+        ),
+        (
+            ".zsh_history",
+            b": 1700000000:0;for host in a b; do\\\n  curl $host/health\\\ndone\n",
+            "for host in a b; do\n  curl $host/health\ndone",
+        ),
+        (
+            ".zsh_history",
+            b": 1700000000:0;curl ro\xc4\x83\xa3/health\n",
+            "curl ro\u0103/health",
+        ),
+        (
+            "fish/fish_history",
+            b"- cmd: curl -sS a\\\\b/health\\necho ok\n  when: 1700000000\n",
+            "curl -sS a\\b/health\necho ok",
+        ),
+    ],
+)
+def test_history_formats_decode_to_commands(tmp_path, file_name, content, command):
+    path = tmp_path / file_name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(content)
+
+    assert shell_history.relevant_history_commands(path, "check health") == [command]
+
+
+def test_shell_history_context_is_opt_in_and_capped(zsh_history, monkeypatch):
+    _write_zsh_history(
+        zsh_history,
+        [
+            f"docker run --rm -p {port}:80 image-{name}"
+            for port, name in enumerate("abcdefgh")
+        ]
+        + ["docker " + "x" * 300],
+    )
+    settings: dict[str, object] = {"history_file": str(zsh_history)}
+    monkeypatch.setattr(shell_history, "cached_settings", lambda: settings)
+
+    assert shell_history.shell_history_context("docker run") == ""
+
+    settings["history_context"] = True
+    context = shell_history.shell_history_context("docker run")
+
+    lines = context.splitlines()
+    assert lines[0] == shell_history.HISTORY_CONTEXT_HEADER
+    assert len(lines) == 1 + shell_history.HISTORY_CONTEXT_MAX_COMMANDS
+    assert lines[1] == "- docker run --rm -p 7:80 image-h"
+    assert len(context) <= shell_history.HISTORY_CONTEXT_MAX_CHARACTERS + 200
+
+
+def test_load_index_tolerates_corrupt_file(zsh_history):
+    shell_history._index_paths(zsh_history)[0].write_bytes(
+        b"\x05\x00\x00\x00\x00\x00\x00\x00x"
+    )
+    _write_zsh_history(zsh_history, ["htop"])
+
+    assert shell_history.relevant_history_commands(zsh_history, "run htop") == ["htop"]
+
+
+def test_each_history_file_keeps_its_own_index(tmp_path, monkeypatch):
+    bash_history = tmp_path / ".bash_history"
+    zsh_history = tmp_path / ".zsh_history"
+    bash_history.write_text("terraform apply\n")
+    _write_zsh_history(zsh_history, ["terraform plan"])
+    shell_history.relevant_history_commands(bash_history, "terraform")
+    shell_history.relevant_history_commands(zsh_history, "terraform")
+
+    # Neither file changed, so switching back parses nothing.
+    monkeypatch.setattr(shell_history, "_command_spans", None)
+    assert shell_history.relevant_history_commands(bash_history, "terraform") == [
+        "terraform apply"
+    ]
+    assert shell_history.relevant_history_commands(zsh_history, "terraform") == [
+        "terraform plan"
+    ]
+
+
+def test_retrieval_stays_fast_with_long_history(zsh_history, monkeypatch):
+    generator = random.Random(7)
+    words = [
+        "".join(generator.choices("abcdefghijklmnopqrstuvwxyz", k=length))
+        for length in generator.choices(range(3, 9), k=20_000)
+    ]
+    tools = ["git", "ssh", "kubectl", "docker", "rsync", "curl", "make", "jq"]
+    _write_zsh_history(
+        zsh_history,
+        [
+            " ".join([generator.choice(tools), *generator.choices(words, k=4)])
+            for _ in range(100_000)
+        ],
+    )
+    monkeypatch.setattr(shell_history, "_configured_history_path", lambda: zsh_history)
+    shell_history.refresh_shell_history_index()
+
+    started_at = time.perf_counter()
+    commands = shell_history.relevant_history_commands(
+        zsh_history, f"ssh into {words[12]} with {words[345]}"
+    )
+    elapsed_seconds = time.perf_counter() - started_at
+
+    assert len(commands) == shell_history.HISTORY_CONTEXT_MAX_COMMANDS
+    assert elapsed_seconds < RETRIEVAL_BUDGET_SECONDS
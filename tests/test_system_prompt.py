@@ -16,6 +16,20 @@ def test_format_tool_lines_outputs_each_expected_tool_in_order():
     assert lines[2] == "- choose: missing (unknown)"
 
 
+def test_format_tool_lines_lists_extra_tools_only_when_available():
+    environment = {
+        "tools": {
+            "kubectl": {"available": True, "version": "unknown"},
+            "podman": {"available": False, "version": "unknown"},
+        }
+    }
+
+    lines = system_prompt._format_tool_lines(environment).splitlines()
+
+    assert lines[-1] == "- kubectl: available (unknown)"
+    assert not any("podman" in line for line in lines)
+
+
 def test_format_tool_preferences_uses_available_tools_and_avoids_default_message():
     environment = {
         "tools": {
@@ -47,3 +61,16 @@ def test_build_system_prompt_contains_core_sections_and_additional_details():
     assert "Detected tools:" in prompt
     assert "Tool preferences:" in prompt
     assert "- workspace: repo-root" in prompt
+
+
+def test_build_system_prompt_keeps_environment_out_of_the_stable_prefix():
+    environment = {
+        "os": {"family": "Linux", "name": "Ubuntu", "version": "24.10"},
+        "tools": {"rg": {"available": True, "version": "14.1.0"}},
+    }
+
+    prompt = system_prompt.build_system_prompt(environment)
+
+    assert prompt.startswith(system_prompt.STABLE_INSTRUCTIONS + "\n\n")
+    assert "- rg: available (14.1.0)" in prompt
+    assert "14.1.0" not in system_prompt.STABLE_INSTRUCTIONS
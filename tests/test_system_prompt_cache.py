@@ -0,0 +1,132 @@
+import os
+
+import llm_complete_command.environment_config as environment_config
+import llm_complete_command.system_prompt_cache as system_prompt_cache
+
+
+def _use_tmp_dirs(tmp_path, monkeypatch):
+    config_dir = tmp_path / "config"
+    config_dir.mkdir()
+    monkeypatch.setattr(environment_config, "_config_dir", lambda: config_dir)
+    return config_dir
+
+
+def test_render_cached_system_prompt_hits_until_config_changes(tmp_path, monkeypatch):
+    config_dir = _use_tmp_dirs(tmp_path, monkeypatch)
+    scheduled: list[tuple[dict, dict | None]] = []
+    monkeypatch.setattr(
+        system_prompt_cache,
+        "schedule_refresh_if_needed",
+        lambda environment, settings=None: scheduled.append((environment, settings)),
+    )
+    environment_loads: list[str] = []
+
+    def fake_load_effective_environment():
+        environment_loads.append("load")
+        return {
+            "detected_at": 5,
+            "os": {"family": "Linux", "name": "Arch", "version": "rolling"},
+            "additional_details": environment_config._read_yaml_dict(
+                config_dir / "config.yaml"
+            ),
+        }
+
+    monkeypatch.setattr(
+        system_prompt_cache,
+        "load_effective_environment",
+        fake_load_effective_environment,
+    )
+
+    first_prompt, first_hit = system_prompt_cache.render_cached_system_prompt()
+    system_prompt_cache.forget_cached_entry()
+    second_prompt, second_hit = system_prompt_cache.render_cached_system_prompt()
+
+    assert (first_hit, second_hit) == (False, True)
+    assert first_prompt == second_prompt
+    assert "os: Linux (Arch, rolling)" in first_prompt
+    assert environment_loads == ["load"]
+    assert scheduled == [({"detected_at": 5}, {})]
+
+    override_path = config_dir / "config.yaml"
+    override_path.write_text("workspace: repo-root\n")
+    os.utime(override_path, ns=(1, 1))
+    system_prompt_cache.forget_cached_entry()
+
+    third_prompt, third_hit = system_prompt_cache.render_cached_system_prompt()
+
+    assert not third_hit
+    assert "- workspace: repo-root" in third_prompt
+    assert environment_loads == ["load", "load"]
+
+
+def test_cached_settings_reads_the_entry_once_per_process(tmp_path, monkeypatch):
+    config_dir = _use_tmp_dirs(tmp_path, monkeypatch)
+    (config_dir / "config.yaml").write_text("settings:\n  git_context: false\n")
+    monkeypatch.setattr(
+        system_prompt_cache, "load_effective_environment", lambda: {"tools": {}}
+    )
+    entry_reads: list[str] = []
+    read_cached_entry = system_prompt_cache._read_cached_entry
+
+    def counting_read_cached_entry(path):
+        entry_reads.append("read")
+        return read_cached_entry(path)
+
+    monkeypatch.setattr(
+        system_prompt_cache, "_read_cached_entry", counting_read_cached_entry
+    )
+
+    for _ in range(3):
+        assert system_prompt_cache.cached_settings() == {"git_context": False}
+    assert entry_reads == ["read"]
+
+    (config_dir / "config.yaml").write_text("settings:\n  git_context: true\n")
+    system_prompt_cache.forget_cached_entry()
+
+    assert system_prompt_cache.cached_settings() == {"git_context": True}
+    assert entry_reads == ["read", "read"]
+
+
+def test_render_cached_system_prompt_ignores_corrupt_cache(tmp_path, monkeypatch):
+    _use_tmp_dirs(tmp_path, monkeypatch)
+    (tmp_path / "system-prompt.json").write_text("{not json")
+    monkeypatch.setattr(
+        system_prompt_cache, "load_effective_environment", lambda: {"tools": {}}
+    )
+
+    prompt, cache_hit = system_prompt_cache.render_cached_system_prompt()
+
+    assert not cache_hit
+    assert "Detected tools:" in prompt
+
+
+def test_cache_hit_checks_staleness_without_parsing_settings(tmp_path, monkeypatch):
+    config_dir = _use_tmp_dirs(tmp_path, monkeypatch)
+    (config_dir / "config.yaml").write_text("settings:\n  extra_probed_tools: [gh]\n")
+    monkeypatch.setattr(
+        system_prompt_cache, "load_effective_environment", lambda: {"tools": {}}
+    )
+    system_prompt_cache.render_cached_system_prompt()
+    system_prompt_cache.forget_cached_entry()
+
+    def fail_load_settings():
+        raise AssertionError("settings parsed on a cache hit")
+
+    checked_probes: list[list[str]] = []
+
+    def fake_section_fingerprints(probe_names):
+        checked_probes.append(probe_names)
+        return {}
+
+    monkeypatch.setattr(environment_config, "load_settings", fail_load_settings)
+    monkeypatch.setattr(
+        environment_config, "_section_fingerprints", fake_section_fingerprints
+    )
+    monkeypatch.setattr(environment_config, "_is_fresh", lambda _environment: True)
+
+    _prompt, cache_hit = system_prompt_cache.render_cached_system_prompt()
+
+    assert cache_hit
+    assert checked_probes == [
+        environment_config._probe_names({"extra_probed_tools": ["gh"]})
+    ]
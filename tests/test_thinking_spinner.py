@@ -1,6 +1,11 @@
+import io
 import re
+import time
+
+import pytest
 
 import llm_complete_command.thinking_spinner as thinking_spinner
+from llm_complete_command.atomic_file import cache_file_path
 
 
 ANSI_ESCAPE_PATTERN = re.compile(r"\x1b\[[0-9;]*m")
@@ -59,38 +64,87 @@ def test_cpr_positions_support_scale_requires_width_and_scale_steps():
     assert not thinking_spinner._cpr_positions_support_scale([(4, 1), (4, 3)])
 
 
-def test_supports_fractional_text_sizing_caches_probe_result(monkeypatch):
+@pytest.fixture(autouse=True)
+def _isolated_text_sizing(tmp_path, monkeypatch):
+    monkeypatch.setattr(thinking_spinner, "cached_settings", lambda: {})
+    monkeypatch.setattr(thinking_spinner, "_text_sizing_scale_support_cache", None)
+    for name in ("TERM_PROGRAM", "TERM_PROGRAM_VERSION", "TMUX", "STY", "ZELLIJ"):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv("TERM", "xterm-kitty")
+
+
+def _counting_probe(monkeypatch, result):
     probe_calls = {"count": 0}
 
-    def fake_detect() -> bool:
+    def fake_detect():
         probe_calls["count"] += 1
-        return True
+        return result
 
     monkeypatch.setattr(
         thinking_spinner, "_detect_text_sizing_scale_support", fake_detect
     )
-    monkeypatch.setattr(thinking_spinner, "_text_sizing_scale_support_cache", None)
+    return probe_calls
+
+
+def test_supports_fractional_text_sizing_caches_probe_result(monkeypatch):
+    probe_calls = _counting_probe(monkeypatch, True)
 
     assert thinking_spinner._supports_fractional_text_sizing()
     assert thinking_spinner._supports_fractional_text_sizing()
     assert probe_calls["count"] == 1
 
 
-def test_start_enables_fractional_status_text_when_supported(monkeypatch):
-    class FakeYaspin:
-        def __init__(self, text, stream):
-            self.text = text
-            self.stream = stream
+def test_text_sizing_probe_result_persists_across_processes(monkeypatch):
+    probe_calls = _counting_probe(monkeypatch, False)
+
+    assert not thinking_spinner._supports_fractional_text_sizing()
+    monkeypatch.setattr(thinking_spinner, "_text_sizing_scale_support_cache", None)
+    assert not thinking_spinner._supports_fractional_text_sizing()
+
+    assert probe_calls["count"] == 1
+
+
+def test_text_sizing_probe_is_keyed_by_terminal_identity(monkeypatch):
+    probe_calls = _counting_probe(monkeypatch, True)
+    thinking_spinner._supports_fractional_text_sizing()
+
+    monkeypatch.setattr(thinking_spinner, "_text_sizing_scale_support_cache", None)
+    monkeypatch.setenv("TMUX", "/tmp/tmux-1000/default,123,0")
+    thinking_spinner._supports_fractional_text_sizing()
+
+    assert probe_calls["count"] == 2
+    assert thinking_spinner._terminal_identity() == "||xterm-kitty|tmux"
+
+
+def test_text_sizing_probe_without_a_terminal_is_not_persisted(monkeypatch):
+    probe_calls = _counting_probe(monkeypatch, None)
+
+    assert not thinking_spinner._supports_fractional_text_sizing()
+    monkeypatch.setattr(thinking_spinner, "_text_sizing_scale_support_cache", None)
+    assert not thinking_spinner._supports_fractional_text_sizing()
+
+    assert probe_calls["count"] == 2
 
-        def start(self):
-            return None
 
-        def stop(self):
-            return None
+def test_text_sizing_setting_skips_the_probe(monkeypatch):
+    probe_calls = _counting_probe(monkeypatch, False)
+    monkeypatch.setattr(
+        thinking_spinner, "cached_settings", lambda: {"text_sizing": True}
+    )
+
+    assert thinking_spinner._supports_fractional_text_sizing()
+    assert probe_calls["count"] == 0
+    assert not cache_file_path(thinking_spinner.CACHE_FILE_NAME).exists()
+
+
+class FakeTerminalStream(io.StringIO):
+    def isatty(self) -> bool:
+        return True
 
+
+def test_start_enables_fractional_status_text_when_supported(monkeypatch):
     spinner = thinking_spinner.ThinkingSpinner("test-model")
-    monkeypatch.setattr(thinking_spinner, "yaspin", FakeYaspin)
-    monkeypatch.setattr(thinking_spinner.sys.stderr, "isatty", lambda: True)
+    monkeypatch.setattr(thinking_spinner.sys, "stderr", FakeTerminalStream())
     monkeypatch.setattr(
         thinking_spinner, "_supports_fractional_text_sizing", lambda: True
     )
@@ -101,6 +155,44 @@ def test_start_enables_fractional_status_text_when_supported(monkeypatch):
     spinner.stop()
 
 
+def test_spinner_redraws_frames_and_stops_within_one_frame(monkeypatch):
+    stream = FakeTerminalStream()
+    monkeypatch.setattr(thinking_spinner.sys, "stderr", stream)
+    monkeypatch.setattr(
+        thinking_spinner, "_supports_fractional_text_sizing", lambda: False
+    )
+    frame_seconds = thinking_spinner.SPINNER_FRAME_SECONDS
+    monkeypatch.setattr(thinking_spinner, "SPINNER_FRAME_SECONDS", 0.01)
+    spinner = thinking_spinner.ThinkingSpinner("test-model")
+
+    spinner.start()
+    time.sleep(0.05)
+    stop_started_at = time.perf_counter()
+    spinner.stop()
+    stop_seconds = time.perf_counter() - stop_started_at
+    output_at_stop = stream.getvalue()
+    time.sleep(0.03)
+
+    assert stop_seconds < frame_seconds
+    assert output_at_stop.startswith(thinking_spinner.HIDE_CURSOR)
+    assert output_at_stop.count("thinking") >= 2
+    assert output_at_stop.endswith(
+        f"{thinking_spinner.CLEAR_LINE}{thinking_spinner.SHOW_CURSOR}"
+    )
+    assert stream.getvalue() == output_at_stop
+
+
+def test_spinner_stays_silent_without_a_terminal(monkeypatch):
+    stream = io.StringIO()
+    monkeypatch.setattr(thinking_spinner.sys, "stderr", stream)
+    spinner = thinking_spinner.ThinkingSpinner("test-model")
+
+    spinner.start()
+    spinner.stop()
+
+    assert stream.getvalue() == ""
+
+
 def test_status_text_scales_all_text_when_fractional_mode_enabled(monkeypatch):
     spinner = thinking_spinner.ThinkingSpinner("test-model")
     spinner._started_at = 100.0
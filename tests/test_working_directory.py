@@ -0,0 +1,110 @@
+import os
+import time
+
+import pytest
+
+import llm_complete_command.working_directory as working_directory
+
+
+@pytest.fixture(autouse=True)
+def _isolated_cache(monkeypatch):
+    monkeypatch.setattr(working_directory, "cached_settings", lambda: {})
+
+
+@pytest.fixture
+def project(tmp_path):
+    project = tmp_path / "project"
+    (project / "src").mkdir(parents=True)
+    (project / "pyproject.toml").write_text("[project]\n")
+    (project / "Makefile").write_text("test:\n")
+    (project / "app.log").write_bytes(b"x" * 3 * 1024 * 1024)
+    (project / ".env").write_text("SECRET=1\n")
+    (project / "latest.log").symlink_to(project / "app.log")
+    return project
+
+
+def test_working_directory_context_lists_entries_and_project_files(project):
+    assert working_directory.working_directory_context(str(project)) == "\n".join(
+        [
+            f"Current working directory: {project}",
+            "Project files: Makefile (make), pyproject.toml (Python)",
+            "Entries (6, 1 hidden):",
+            "- Makefile (6 B)",
+            "- app.log (3.0 MB)",
+            "- latest.log@",
+            "- pyproject.toml (10 B)",
+            "- src/",
+        ]
+    )
+
+
+def test_working_directory_context_is_cached_until_the_directory_changes(
+    project, monkeypatch
+):
+    working_directory.working_directory_context(str(project))
+    scandir = os.scandir
+    scanned: list[str] = []
+    monkeypatch.setattr(
+        working_directory.os,
+        "scandir",
+        lambda path: scanned.append(path) or scandir(path),
+    )
+
+    working_directory.working_directory_context(str(project))
+    assert scanned == []
+
+    (project / "notes.txt").write_text("todo\n")
+    # Coarse file system timestamps could hide the change otherwise.
+    os.utime(project, ns=(time.time_ns(), time.time_ns() + 10**9))
+    context = working_directory.working_directory_context(str(project))
+
+    assert scanned == [str(project)]
+    assert "- notes.txt (5 B)" in context
+
+
+def test_working_directory_context_caps_listed_entries(tmp_path, monkeypatch):
+    directory = tmp_path / "directory"
+    directory.mkdir()
+    monkeypatch.setattr(working_directory, "MAX_LISTED_ENTRIES", 3)
+    for number in range(10):
+        (directory / f"file-{number}\nname").write_text("")
+
+    lines = working_directory.working_directory_context(str(directory)).splitlines()
+
+    assert lines[1:] == [
+        "Entries (10):",
+        "- file-0?name (0 B)",
+        "- file-1?name (0 B)",
+        "- file-2?name (0 B)",
+        "- ... 7 more not listed",
+    ]
+
+
+def test_working_directory_context_stops_when_time_runs_out(tmp_path, monkeypatch):
+    directory = tmp_path / "directory"
+    directory.mkdir()
+    monkeypatch.setattr(working_directory, "BUDGET_CHECK_INTERVAL", 2)
+    monkeypatch.setattr(working_directory, "SCAN_BUDGET_SECONDS", -1)
+    for number in range(5):
+        (directory / f"file-{number}").write_text("")
+
+    lines = working_directory.working_directory_context(str(directory)).splitlines()
+
+    # Sizes are skipped once past the deadline.
+    assert lines[1] == "Entries (at least 2):"
+    assert len(lines) == 4
+    assert all("(" not in line for line in lines[2:])
+
+
+def test_working_directory_context_can_be_disabled(project, monkeypatch):
+    monkeypatch.setattr(
+        working_directory,
+        "cached_settings",
+        lambda: {working_directory.WORKING_DIRECTORY_CONTEXT_SETTING: False},
+    )
+
+    assert working_directory.working_directory_context(str(project)) == ""
+
+
+def test_working_directory_context_ignores_missing_directory(tmp_path):
+    assert working_directory.working_directory_context(str(tmp_path / "gone")) == ""